@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+import time
+import weakref
+from typing import *
+
+from cipher import *
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see BatchEngine
+    np = None
+
+"""
+An optional NumPy engine for --fixed and --random possibility grids.
+
+Text is handled as an array of byte codes and each letter's possibilities as
+a row of a padded 2D table (folded into one flat lookup per phase), so every
+--fixed row of the grid, for many texts at once, is a single gather.
+--random rows shuffle the indices into that table for every character at
+once.  Without NumPy, or for text that is not ASCII, the same results come
+from Cipher.possibilities.
+
+Run ./batch.py to compare it with the pure-Python path.
+"""
+
+
+class BatchEngine:
+    """
+    Computes --fixed and --random possibility rows for one direction of a
+    Cipher
+
+    codes[b] holds the possibilities of the letter with byte value b padded
+    out to the longest list, and lengths[b] how many of them are real.
+    Bytes that are not letters map to themselves with a length of 1, which
+    is how --include characters pass through untouched.
+
+    Since every choice repeats after NeighborTable.period rotations, the two
+    are folded into lookup[phase * 256 + b], the output byte for byte b at a
+    phase, and a row is one take() from that flat table.
+    """
+
+    # characters handled per NumPy call, to bound the temporary arrays
+    block: int = 1 << 20
+
+    def __init__(self, c: Cipher, direction: chr = "R"):
+        # only the table is kept, so batch_engine can let go of the Cipher
+        self.direction: chr = direction.upper().strip()[0]
+        self.table: NeighborTable = c.tables[self.direction]
+        self.enabled: bool = np is not None and self.table.ascii
+        if not self.enabled:
+            return
+        width = max([len(n) for n in self.table.neighbors.values()] + [1])
+        self.codes = np.repeat(np.arange(256, dtype=np.uint8)[:, None], width, axis=1)
+        self.lengths = np.ones(256, dtype=np.int64)
+        for letter, n in self.table.neighbors.items():
+            if n:
+                self.codes[ord(letter), : len(n)] = np.frombuffer(
+                    n.encode("ascii"), dtype=np.uint8
+                )
+                self.lengths[ord(letter)] = len(n)
+        # random_many needs len(ring)! to fit in 32 bits, which it does up to 12
+        self.shuffles: bool = width <= 12
+        if self.shuffles:
+            self.factorials = np.cumprod(np.arange(width + 1, dtype=np.uint64).clip(1))
+        period = self.table.period
+        phases = np.arange(period, dtype=np.int64)[:, None]
+        self.lookup = self.codes[
+            np.arange(256)[None, :], phases % self.lengths[None, :]
+        ].ravel()
+
+    def rows(
+        self, text: str, limit_possibilities: int = 8, start: int = 0, jump: int = 1
+    ) -> List[str]:
+        """The same rows as Cipher.possibilities for normalized text"""
+        return self.encode_many([text], limit_possibilities, start, jump)[0]
+
+    def encode_many(
+        self,
+        texts: Sequence[str],
+        limit_possibilities: int = 8,
+        start: int = 0,
+        jump: int = 1,
+        starts: Sequence[int] = None,
+    ) -> List[List[str]]:
+        """
+        Returns the possibility rows for each of several normalized texts
+
+        Each text starts counting positions from 0, just as if it had been
+        passed to Cipher.possibilities by itself.  starts, if given, holds a
+        separate start for each text instead of the shared one.
+        """
+        if starts is None:
+            starts = [start] * len(texts)
+        if not self.enabled or not all(t.isascii() for t in texts):
+            return [
+                [self.table.row(t, s + r, jump) for r in range(limit_possibilities)]
+                for t, s in zip(texts, starts)
+            ]
+        joined = np.frombuffer("".join(texts).encode("ascii"), dtype=np.uint8)
+        sizes = np.array([len(t) for t in texts], dtype=np.int64)
+        # position of each character within its own text
+        firsts = np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positions = np.arange(len(joined), dtype=np.int64) - firsts
+        offsets = np.repeat(np.array(starts, dtype=np.int64), sizes)
+
+        out = np.empty((limit_possibilities, len(joined)), dtype=np.uint8)
+        wrap = self.table.period * 256
+        for a in range(0, len(joined), self.block):
+            chars = joined[a : a + self.block]
+            phase = (
+                offsets[a : a + self.block] + positions[a : a + self.block] * jump
+            ) % self.table.period
+            flat = phase * 256 + chars
+            for offset in range(limit_possibilities):
+                np.take(self.lookup, flat, out=out[offset, a : a + self.block])
+                flat += 256
+                flat[flat >= wrap] -= wrap
+
+        return self._split(out, sizes)
+
+    def random_many(
+        self,
+        texts: Sequence[str],
+        rng: random.Random = random,
+        limit_possibilities: int = 8,
+    ) -> List[List[str]]:
+        """
+        Returns --random possibility rows for each of several normalized texts
+
+        The random numbers are drawn from rng text by text exactly as
+        NeighborTable.random_rows draws them, so for the same rng the rows
+        are the same with or without NumPy.  Layouts with more than 12
+        possibilities for a letter always take the NeighborTable path.
+        """
+        if not self.enabled or not self.shuffles or not all(t.isascii() for t in texts):
+            return [self.table.random_rows(t, rng, limit_possibilities) for t in texts]
+        joined = np.frombuffer("".join(texts).encode("ascii"), dtype=np.uint8)
+        sizes = np.array([len(t) for t in texts], dtype=np.int64)
+        draws = np.frombuffer(
+            b"".join(random_draws(rng, 2 * len(t)) for t in texts), dtype="<u8"
+        )
+
+        out = np.empty((limit_possibilities, len(joined)), dtype=np.uint8)
+        width = self.codes.shape[1]
+        for a in range(0, len(joined), self.block):
+            chars = joined[a : a + self.block]
+            d = draws[a : a + self.block]
+            lengths = self.lengths[chars]
+            # shuffle_ring for every character at once: the same swaps, taking
+            # the same digits of each draw, on the indices into its ring (kept
+            # flat, width to a character); only the draw modulo len(ring)!
+            # decides the order, and that fits in 32 bits
+            x = (d % self.factorials[lengths]).astype(np.uint32)
+            rows = np.arange(len(chars), dtype=np.int64) * width
+            order = np.tile(np.arange(width, dtype=np.uint8), len(chars))
+            for i in range(width - 1, 0, -1):
+                live = lengths > i  # the others swap i with itself
+                radix = np.uint32(i + 1)
+                j = rows + np.where(live, x % radix, i)
+                x = np.where(live, x // radix, x)
+                moved = order[rows + i]
+                order[rows + i] = order[j]
+                order[j] = moved
+            codes = self.codes.ravel()
+            letters = chars.astype(np.int64) * width
+            for offset in range(limit_possibilities):
+                picked = order[rows + offset % lengths]
+                out[offset, a : a + self.block] = codes[letters + picked]
+
+        return self._split(out, sizes)
+
+    @staticmethod
+    def _split(out: "np.ndarray", sizes: "np.ndarray") -> List[List[str]]:
+        """Cuts the rows for the joined texts back into rows for each text"""
+        rows = [r.tobytes().decode("ascii") for r in out]
+        results: List[List[str]] = []
+        at = 0
+        for size in sizes.tolist():
+            results.append([r[at : at + size] for r in rows])
+            at += size
+        return results
+
+
+# engines made by batch_engine for each direction, for as long as the Cipher
+# is in use elsewhere
+_engines: "weakref.WeakKeyDictionary[Cipher, Dict[chr, BatchEngine]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def batch_engine(c: Cipher, direction: chr = "R") -> Optional[BatchEngine]:
+    """Returns a shared BatchEngine, or None if NumPy is not installed"""
+    if np is None:
+        return None
+    direction = direction.upper().strip()[0]
+    engines = _engines.get(c)
+    if engines is None:
+        engines = _engines[c] = {}
+    engine = engines.get(direction)
+    if engine is None:
+        engine = engines[direction] = BatchEngine(c, direction)
+    return engine
+
+
+def compare(
+    layout: str = "QWERTY", size: int = 1_000_000, lines: int = 1, repeat: int = 3
+) -> Dict[str, float]:
+    """
+    Times the 8-row --fixed grid for size characters split into lines texts
+    with Cipher.possibilities and with BatchEngine
+
+    Returns the best time in seconds for each engine.
+    """
+    c = load_cipher(layout)
+    rng = random.Random(size)
+    letters = c.alphabet
+    texts: List[str] = [
+        "".join(rng.choices(letters, k=size // lines)) for _ in range(lines)
+    ]
+    engine = BatchEngine(c)
+    timings: Dict[str, float] = {}
+    for name, run in [
+        ("python", lambda: [c.possibilities(t, "R", False) for t in texts]),
+        ("numpy" if engine.enabled else "fallback", lambda: engine.encode_many(texts)),
+    ]:
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - t0)
+        timings[name] = best
+    return timings
+
+
+if __name__ == "__main__":
+    # Click is only for the benchmark, not for stream.py and serve.py
+    import click
+
+    @click.command()
+    @click.option("-k", "--layout", default="QWERTY", help="Layout to benchmark")
+    @click.option("--size", type=click.INT, default=1_000_000, show_default=True)
+    def batch_benchmark(layout: str, size: int) -> None:
+        """
+        Compares the pure-Python --fixed grid with the NumPy BatchEngine for
+        one long text and for many short ones
+        """
+        for lines in (1, max(1, size // 80)):
+            timings = compare(layout, size, lines)
+            texts = f"{lines} text{'s' if lines > 1 else ''}"
+            p(
+                f"{texts} of {size // lines} characters: "
+                + ", ".join(f"{k} {v:.3f}s" for k, v in timings.items())
+            )
+
+    batch_benchmark()
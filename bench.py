@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import *
+
+import click
+
+from cipher import *
+
+"""
+Benchmarks for tracking the speed and memory use of the cipher.
+
+Each benchmark times one operation over generated text of a given size,
+keeping the best of a few runs, and records how many characters (or
+calls) per second that is and the most memory it needed.  Results can be
+saved as a JSON baseline and later runs compared against it; ./bench.py
+exits with an error if anything got slower or bigger than the threshold
+allows.
+
+The CLI benchmarks run ./cipher.py in a subprocess, so their memory is the
+peak resident size of that process rather than Python allocations.
+"""
+
+BASELINE: str = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+SIZES: Dict[str, int] = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+DEFAULT_SIZES: str = "1K,64K,1M"
+# what ./bench.py --full runs: the whole range up to 100 MB
+FULL_SIZES: str = "1K,64K,1M,10M,100M"
+PUNCTUATION: str = " .,;:!?'\"()-0123456789\t"
+
+
+class Result(NamedTuple):
+    """
+    How one benchmark did
+
+    rate is units (characters or calls) per second over the best run, and
+    peak is the most memory it used in bytes.
+    """
+
+    name: str
+    unit: str
+    count: int
+    seconds: float
+    peak: int
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.seconds if self.seconds else float("inf")
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:48} {self.rate:14,.0f} {self.unit}/s"
+            f" {self.peak / (1 << 20):9.1f} MB"
+        )
+
+
+def parse_size(size: str) -> int:
+    """'64K' -> 65536; a plain number is a count of characters"""
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in SIZES:
+        return int(float(size[:-1]) * SIZES[size[-1]])
+    return int(size)
+
+
+def size_name(size: int) -> str:
+    for suffix, scale in reversed(SIZES.items()):
+        if size >= scale and size % scale == 0:
+            return f"{size // scale}{suffix}"
+    return str(size)
+
+
+def sample_text(size: int, punctuated: bool = False, line: int = 0) -> str:
+    """
+    size characters of made-up text: lower-case words, or with punctuated
+    a mix heavy in characters outside the layout (what --include keeps)
+
+    With line set, there is a newline about every line characters.  The
+    text is built from one repeated random block so even 100 MB is quick
+    to make, and the same size always gives the same text.
+    """
+    rng = random.Random(f"{size}/{punctuated}/{line}")
+    letters = ALPHABET + " " * 5
+    if punctuated:
+        letters = ALPHABET + PUNCTUATION * 2 + ALPHABET.upper()
+    block = "".join(rng.choices(letters, k=min(size, 1 << 16)))
+    if line:
+        block = "\n".join(
+            block[i : i + line - 1] for i in range(0, len(block), line - 1)
+        )
+    return (block * (size // len(block) + 1))[:size] if block else ""
+
+
+def measure(
+    name: str, run: Callable[[], Any], count: int, unit: str = "chars", repeat: int = 3
+) -> Result:
+    """
+    Times run (best of repeat, or a single run if it takes over a second)
+    and then runs it once more under tracemalloc for its peak memory
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - t0)
+        if best > 1:
+            break
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Result(name, unit, count, best, peak)
+
+
+# runs cipher.py and writes the peak resident memory of its own process
+# (VmHWM, which starts afresh at exec unlike ru_maxrss) to the file in argv[1]
+CLI_RUNNER: str = """
+import atexit, runpy, sys
+report, script = sys.argv[1], sys.argv[2]
+def peak():
+    with open("/proc/self/status") as status, open(report, "w") as out:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                out.write(str(int(line.split()[1]) * 1024))
+atexit.register(peak)
+sys.argv = sys.argv[2:]
+runpy.run_path(script, run_name="__main__")
+"""
+
+
+def measure_cli(name: str, args: List[str], text: str, repeat: int = 3) -> Result:
+    """
+    Times ./cipher.py run end to end on text (written to a temporary file),
+    with the peak resident memory of the process (0 where /proc is missing)
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cipher.py")
+    with tempfile.TemporaryDirectory() as tmp:
+        source, report = os.path.join(tmp, "input.txt"), os.path.join(tmp, "peak")
+        with open(source, "w") as f:
+            f.write(text)
+        best, peak = float("inf"), 0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-c", CLI_RUNNER, report, script, *args, source],
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+            best = min(best, time.perf_counter() - t0)
+            if os.path.exists(report):
+                with open(report) as f:
+                    peak = max(peak, int(f.read() or 0))
+            if best > 1:
+                break
+    return Result(name, "chars", len(text), best, peak)
+
+
+def suite(
+    sizes: Sequence[int],
+    layouts: Sequence[str] = ("QWERTY", "Dvorak"),
+    cli: bool = True,
+    select: str = "",
+) -> Iterator[Result]:
+    """
+    Runs the benchmarks, yielding each Result as it comes
+
+    select, if given, only runs the benchmarks whose names contain it.
+    """
+
+    def wanted(name: str) -> bool:
+        return select in name
+
+    for layout in available_layouts():
+        if not wanted(f"construct/{layout}"):
+            continue
+        try:
+            Cipher(layout)
+        except (AssertionError, ValueError):
+            continue  # broken on purpose
+        yield measure(f"construct/{layout}", lambda: Cipher(layout), 1, "calls")
+
+    for layout in layouts:
+        c = Cipher(layout)
+        short = sample_text(1 << 14)
+        for direction in "RED":
+            name = f"encode_chr/{c.layout}/{direction}"
+            if wanted(name):
+                yield measure(
+                    name,
+                    lambda: [c.encode_chr(ch, direction, True, False) for ch in short],
+                    len(short),
+                )
+        for size in sizes:
+            for punctuated in (False, True):
+                text = sample_text(size, punctuated)
+                kind = "include" if punctuated else "letters"
+                for direction in "RED":
+                    for rnd in (True, False):
+                        name = (
+                            f"encode_text/{c.layout}/{direction}/"
+                            f"{'random' if rnd else 'fixed'}/{kind}/{size_name(size)}"
+                        )
+                        if wanted(name):
+                            yield measure(
+                                name,
+                                lambda: c.encode_text(
+                                    text, not punctuated, direction, rnd, seed=1
+                                ),
+                                size,
+                            )
+            rows = c.encode_text(sample_text(size), True, "R", False)
+            name = f"display_possibilities/{c.layout}/{size_name(size)}"
+            if wanted(name):
+                yield measure(name, lambda: display_possibilities(list(rows)), size)
+
+    if not cli:
+        return
+    for size in sizes:
+        for punctuated in (False, True):
+            text = sample_text(size, punctuated, line=80)
+            kind = "include" if punctuated else "letters"
+            for label, args in [
+                ("grid", ["--fixed"]),
+                ("only-one", ["--fixed", "--only-one"]),
+                ("random", ["--only-one"]),
+            ]:
+                if punctuated:
+                    args = args + ["--include"]
+                name = f"cli/{label}/{kind}/{size_name(size)}"
+                if wanted(name):
+                    yield measure_cli(name, args, text)
+        name = f"cli/stream/{size_name(size)}"
+        if wanted(name):
+            text = sample_text(size, line=max(80, size // 4))
+            yield measure_cli(name, ["--fixed", "--only-one", "--stream"], text)
+
+
+def compare(
+    results: Iterable[Result], baseline: Dict[str, Any], threshold: float = 0.25
+) -> List[str]:
+    """
+    Returns a line for every result that is slower (or uses more memory)
+    than its baseline by more than threshold (0.25 = 25%)
+    """
+    old: Dict[str, Dict[str, float]] = baseline.get("results", {})
+    regressions: List[str] = []
+    for r in results:
+        before = old.get(r.name)
+        if not before:
+            continue
+        if r.rate < before["rate"] * (1 - threshold):
+            regressions.append(
+                f"{r.name}: {r.rate:,.0f} {r.unit}/s, down from {before['rate']:,.0f}"
+            )
+        # a little slack so tiny allocations do not count as regressions
+        if r.peak > before["peak"] * (1 + threshold) + (64 << 10):
+            regressions.append(
+                f"{r.name}: {r.peak:,} bytes at peak, up from {before['peak']:,}"
+            )
+    return regressions
+
+
+def save(results: Iterable[Result], path: str = BASELINE) -> None:
+    """Writes (or updates) a JSON baseline with the results"""
+    baseline: Dict[str, Any] = {"results": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+    baseline.update(
+        {
+            "python": platform.python_version(),
+            "machine": platform.platform(),
+            "saved": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+    )
+    for r in results:
+        baseline["results"][r.name] = {
+            "unit": r.unit,
+            "count": r.count,
+            "seconds": r.seconds,
+            "rate": r.rate,
+            "peak": r.peak,
+        }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default=DEFAULT_SIZES,
+    show_default=True,
+    help="Comma-separated input sizes (K and M suffixes are powers of 1024).",
+)
+@click.option(
+    "--full", is_flag=True, help=f"Run every size from 1K to 100M ({FULL_SIZES})."
+)
+@click.option(
+    "-k",
+    "--layout",
+    "layouts",
+    multiple=True,
+    default=["QWERTY", "Dvorak"],
+    show_default=True,
+    help="Layouts to time the encoders with (can be given more than once).",
+)
+@click.option(
+    "--select", default="", help="Only run benchmarks whose names contain this."
+)
+@click.option("--no-cli", is_flag=True, help="Skip the end-to-end CLI benchmarks.")
+@click.option(
+    "--baseline",
+    type=click.Path(dir_okay=False),
+    default=BASELINE,
+    show_default=True,
+    help="The JSON baseline to compare with (and --save to).",
+)
+@click.option("--save", "save_baseline", is_flag=True, help="Save these results.")
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=0),
+    default=0.25,
+    show_default=True,
+    help="Allowed slowdown or growth before a result counts as a regression.",
+)
+def bench(
+    sizes: str,
+    full: bool,
+    layouts: Tuple[str, ...],
+    select: str,
+    no_cli: bool,
+    baseline: str,
+    save_baseline: bool,
+    threshold: float,
+) -> None:
+    """
+    Times the cipher and compares the results with a saved baseline
+
+    Exits with status 1 if any benchmark regressed by more than --threshold.
+    """
+    results: List[Result] = []
+    for r in suite(
+        [parse_size(s) for s in (FULL_SIZES if full else sizes).split(",")],
+        layouts,
+        not no_cli,
+        select,
+    ):
+        p(str(r))
+        results.append(r)
+    if save_baseline:
+        save(results, baseline)
+        e(f"Saved {len(results)} results to {baseline}")
+        return
+    if not os.path.exists(baseline):
+        e(f"No baseline at {baseline} yet; run with --save to make one")
+        return
+    with open(baseline) as f:
+        regressions = compare(results, json.load(f), threshold)
+    for line in regressions:
+        e(f"REGRESSION {line}")
+    if regressions:
+        sys.exit(1)
+    e(f"No regressions beyond {threshold:.0%}")
+
+
+if __name__ == "__main__":
+    bench()
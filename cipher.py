@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
-import random
+from __future__ import annotations
 
-import click
+import _thread
+import io
 import os
-from typing import *
+import random
+import struct
+import sys
+from itertools import compress
+from math import gcd
 
 """
 See readme.md, other docstrings, or run ./cipher.py --help from the terminal
 to view detailed information.
+
+Importing this module only pulls in a few small parts of the standard
+library, so library users (and python -m oneline) start quickly.  Click and
+the typing module are left to the CLI modules; the annotations here are never
+evaluated.
 """
 
 
@@ -15,11 +25,11 @@ ALPHABET: str = "abcdefghijklmnopqrstuvwxyz"
 
 
 def p(content):
-    click.echo(content, err=False)
+    print(content)
 
 
 def e(content):
-    click.echo(content, err=True)
+    print(content, file=sys.stderr)
 
 
 class Keycap:
@@ -32,9 +42,26 @@ class Keycap:
         in the manner described in the book
     3. self.encrypts_to returns a list of keys that contain self in their deciphers_to
 
-    These attributes are not fully-baked until Cipher.__init__ has finished
+    These attributes are not fully-baked until Cipher.__init__ has finished.
+    Once they are, each is a tuple in counterclockwise order, and the keys in
+    each are also kept as a bitmask of their .bit values (see Keycap.links)
+    so that membership tests are a single AND.
     """
 
+    __slots__ = (
+        "blank",
+        "name",
+        "right",
+        "left",
+        "up",
+        "down",
+        "surround",
+        "encrypts_to",
+        "bit",
+        "masks",
+        "_deciphers_to",
+    )
+
     def __init__(self, display: chr):
         self.blank: bool = False if display.strip() else True
         self.name: chr = display if not self.blank else " "
@@ -43,8 +70,13 @@ class Keycap:
         self.up: Keycap
         self.down: Keycap
         # these two are set at the end of Cipher.__init__
-        self.surround: List[Keycap] = []  # these ones are reversible
-        self.encrypts_to: List[Keycap] = []
+        self.surround: Sequence[Keycap] = []  # these ones are reversible
+        self.encrypts_to: Sequence[Keycap] = []
+        # set by Cipher: one bit per letter (blanks have none) and, for each
+        # direction in "RED", the bits of that direction's keys
+        self.bit: int = 0
+        self.masks: Tuple[int, int, int] = (0, 0, 0)
+        self._deciphers_to: Optional[Tuple[Keycap, ...]] = None
 
     def __repr__(self) -> str:
         return self.name if not self.blank else "∞"
@@ -87,8 +119,12 @@ class Keycap:
         ]
 
     @property
-    def deciphers_to(self) -> "List[Keycap]":
-        return [k for k in self.raw_surround if not k.blank]
+    def deciphers_to(self) -> "Tuple[Keycap, ...]":
+        # the grid is fully linked before anything asks for this, so it is
+        # only worked out once
+        if self._deciphers_to is None:
+            self._deciphers_to = tuple(k for k in self.raw_surround if not k.blank)
+        return self._deciphers_to
 
     def bake_surround(self) -> int:
         """
@@ -98,9 +134,24 @@ class Keycap:
         Returns the number of non-reversible keys that were thrown out
         (not counting blanks)
         """
-        self.surround = [k for k in self.deciphers_to if k in self.encrypts_to]
+        self.encrypts_to = tuple(self.encrypts_to)
+        encrypts_mask: int = key_mask(self.encrypts_to)
+        self.surround = tuple(k for k in self.deciphers_to if k.bit & encrypts_mask)
+        self.bake_masks()
         return len(self.deciphers_to) - len(self.surround)
 
+    def bake_masks(self) -> None:
+        """Sets self.masks from the baked surround, encrypts_to, and deciphers_to"""
+        self.masks = (
+            key_mask(self.surround),
+            key_mask(self.encrypts_to),
+            key_mask(self.deciphers_to),
+        )
+
+    def links(self, other: "Keycap", direction: chr = "R") -> bool:
+        """Whether other is among this key's keys in direction ('R', 'E', or 'D')"""
+        return bool(self.masks["RED".index(direction)] & other.bit)
+
     def draw(self, out: bool = True) -> "List[str]":
         o: List[str] = []
 
@@ -130,10 +181,239 @@ class Keycap:
         return o
 
 
-def cap_list_str(surrounding: List[Keycap]) -> str:
+def cap_list_str(surrounding: Sequence[Keycap]) -> str:
     return "".join(str(k) for k in surrounding)
 
 
+def key_mask(keys: Iterable[Keycap]) -> int:
+    """The bits of every key in keys ORed together"""
+    mask: int = 0
+    for k in keys:
+        mask |= k.bit
+    return mask
+
+
+class NeighborTable:
+    """
+    Flat, precomputed lookups for one direction of a Cipher
+
+    neighbors maps each letter to its possibilities in their fixed order
+    (the same string that Cipher.encode_chr returns without rnd).
+    period is the least common multiple of the possibility counts, so the
+    choice made for every letter repeats after that many rotations.
+
+    Translation tables for each phase within the period are built on demand
+    and cached, which lets a whole --fixed row be produced with a handful of
+    str.translate/bytes.translate calls over strided slices of the text
+    rather than one Python-level lookup per character.
+    The inverse tables used to undo a --fixed row are cached the same way.
+    """
+
+    # below this many characters per translation table, indexing each
+    # character directly is cheaper than slicing and translating
+    min_slice: int = 4
+
+    def __init__(self, neighbors: Dict[chr, str]):
+        self.neighbors: Dict[chr, str] = neighbors
+        self.period: int = 1  # the lcm of the ring sizes
+        for n in neighbors.values():
+            if n:
+                self.period = self.period * len(n) // gcd(self.period, len(n))
+        self.ascii: bool = all(
+            k.isascii() and n.isascii() for k, n in neighbors.items()
+        )
+        self._str_tables: Dict[int, Dict[int, str]] = {}
+        self._byte_tables: Dict[int, bytes] = {}
+        self._inverse_tables: Dict[int, Dict[chr, str]] = {}
+
+    def str_table(self, phase: int) -> Dict[int, str]:
+        """The str.translate table for a given phase (mod self.period)"""
+        phase %= self.period
+        table = self._str_tables.get(phase)
+        if table is None:
+            table = {ord(k): n[phase % len(n)] for k, n in self.neighbors.items() if n}
+            self._str_tables[phase] = table
+        return table
+
+    def byte_table(self, phase: int) -> bytes:
+        """The bytes.translate table for a given phase; only valid when self.ascii"""
+        phase %= self.period
+        table = self._byte_tables.get(phase)
+        if table is None:
+            t = bytearray(range(256))
+            for k, n in self.str_table(phase).items():
+                t[k] = ord(n)
+            table = self._byte_tables[phase] = bytes(t)
+        return table
+
+    def inverse_table(self, phase: int) -> Dict[chr, str]:
+        """
+        For a given phase (mod self.period), maps each output character to
+        the letters that give it at that phase, in layout order
+
+        Output characters missing from the table can only have come from
+        themselves, as long as they are not letters of the layout.
+        """
+        phase %= self.period
+        table = self._inverse_tables.get(phase)
+        if table is None:
+            table = {}
+            for k, n in self.neighbors.items():
+                out = n[phase % len(n)] if n else k
+                table[out] = table.get(out, "") + k
+            self._inverse_tables[phase] = table
+        return table
+
+    def invert(self, row: str, start: int = 0, jump: int = 1) -> List[str]:
+        """
+        Undoes NeighborTable.row: returns, for each character of row, every
+        letter that row(…, start, jump) would have turned into it
+
+        A position with one candidate is decoded exactly; one with none
+        means row was not made with this start and jump.
+        """
+        stride = self.period // gcd(jump, self.period)
+        tables = [
+            self.inverse_table(start + r * jump) for r in range(min(stride, len(row)))
+        ]
+        n = self.neighbors
+        return [
+            tables[i % stride].get(ch, "" if ch in n else ch)
+            for i, ch in enumerate(row)
+        ]
+
+    def row(self, text: str, start: int = 0, jump: int = 1) -> str:
+        """
+        Returns one row of --fixed possibilities for already-normalized text
+
+        Character number i gets possibility (start + i * jump) of its letter;
+        characters without possibilities are passed through unchanged.
+        """
+        period = self.period
+        # positions this far apart always land on the same phase
+        stride = period // gcd(jump, period)
+        if len(text) < stride * self.min_slice:
+            n = self.neighbors
+            return "".join(
+                n[c][(start + i * jump) % len(n[c])] if n.get(c) else c
+                for i, c in enumerate(text)
+            )
+        if self.ascii and text.isascii():
+            src: bytes = text.encode("ascii")
+            out = bytearray(len(src))
+            for r in range(stride):
+                out[r::stride] = src[r::stride].translate(
+                    self.byte_table(start + r * jump)
+                )
+            return out.decode("ascii")
+        chars: List[str] = list(text)
+        for r in range(stride):
+            chars[r::stride] = text[r::stride].translate(
+                self.str_table(start + r * jump)
+            )
+        return "".join(chars)
+
+    def mismatches(self, cleartext: str, ciphertext: str) -> List[int]:
+        """
+        Returns every position where cleartext's letter is not one of the
+        possibilities of ciphertext's letter (characters outside the layout
+        must match themselves), plus any positions only one of them has
+
+        For ASCII text this is a few whole-string passes.  The distinct
+        ciphertext characters are split into groups of 8, each getting one
+        bit of a byte.  For every group, bytes.translate turns the
+        ciphertext into its characters' bits and the cleartext into the bits
+        of the ciphertext characters each letter could have come from, and
+        ANDing the two (as big integers) leaves a nonzero byte wherever
+        the letters fit.
+        """
+        size = min(len(cleartext), len(ciphertext))
+        extra = list(range(size, max(len(cleartext), len(ciphertext))))
+        cleartext, ciphertext = cleartext[:size], ciphertext[:size]
+        n = self.neighbors
+        if not (cleartext.isascii() and ciphertext.isascii() and self.ascii):
+            return [
+                i
+                for i, (x, y) in enumerate(zip(cleartext, ciphertext))
+                if x not in (n.get(y) or y)
+            ] + extra
+        pt: bytes = cleartext.encode("ascii")
+        ct: bytes = ciphertext.encode("ascii")
+        distinct: List[chr] = sorted(set(ciphertext))
+        ok: int = 0
+        for g in range(0, len(distinct), 8):
+            ct_bits, pt_bits = bytearray(256), bytearray(256)
+            for bit, y in enumerate(distinct[g : g + 8]):
+                ct_bits[ord(y)] = 1 << bit
+                for x in set(n.get(y) or y):
+                    pt_bits[ord(x)] |= 1 << bit
+            ok |= int.from_bytes(ct.translate(ct_bits), "little") & int.from_bytes(
+                pt.translate(pt_bits), "little"
+            )
+        failed: bytes = ok.to_bytes(size, "little").translate(ONLY_ZERO)
+        return list(compress(range(size), failed)) + extra
+
+    def random_rows(
+        self, text: str, rng: random.Random = random, limit_possibilities: int = 8
+    ) -> List[str]:
+        """
+        Returns rows of --random possibilities for already-normalized text
+
+        Each character's possibilities are shuffled (see shuffle_ring) and
+        the rows take them in that order, so every row picks uniformly among
+        them and a column repeats only once they run out.  All the
+        randomness for the text is drawn from rng in one go, 64 bits per
+        character.
+        """
+        return list(self.iter_random_rows(text, rng, limit_possibilities))
+
+    def iter_random_rows(
+        self, text: str, rng: random.Random = random, limit_possibilities: int = 8
+    ) -> Iterator[str]:
+        """
+        NeighborTable.random_rows one row at a time
+
+        The randomness is drawn from rng when this is called, so the rows are
+        the same however many of them are used.
+        """
+        n = self.neighbors
+        draws = struct.unpack(f"<{len(text)}Q", random_draws(rng, 2 * len(text)))
+        picks = [shuffle_ring(n.get(c) or c, d) for c, d in zip(text, draws)]
+        return (
+            "".join([s[offset % len(s)] for s in picks])
+            for offset in range(limit_possibilities)
+        )
+
+
+def shuffle_ring(ring: str, draw: int) -> str:
+    """
+    The possibilities in ring in a random order, using draw (a random 64-bit
+    number) for a Fisher–Yates shuffle: each swap takes the next mixed-radix
+    digit of draw.  Every order is (all but exactly) equally likely for rings
+    of up to 20 possibilities.
+    """
+    if len(ring) < 2:
+        return ring
+    s = list(ring)
+    for i in range(len(s) - 1, 0, -1):
+        draw, j = divmod(draw, i + 1)
+        s[i], s[j] = s[j], s[i]
+    return "".join(s)
+
+
+# a bytes.translate table that turns 0 into 1 and everything else into 0
+ONLY_ZERO: bytes = bytes([1] + [0] * 255)
+
+
+def random_draws(rng: random.Random, count: int) -> bytes:
+    """
+    count random 32-bit numbers from rng as little-endian bytes
+
+    Drawing a, then b numbers gives the same bytes as drawing a + b at once.
+    """
+    return rng.getrandbits(32 * count).to_bytes(4 * count, "little") if count else b""
+
+
 # If your layout has its "blank" keys to the left,
 # add it to this list
 # Layout names (including filenames) should be lower-case
@@ -141,23 +421,69 @@ REVERSE_LAYOUTS: List[str] = [
     "dvorak",
 ]
 
+LAYOUT_DIR: str = os.path.join(os.path.dirname(__file__), "layouts")
+
+
+def layout_options(layout: str, reverse: bool = None) -> Tuple[str, bool]:
+    """
+    Normalizes a layout name and fills in the default for reverse
+    in the same way as Cipher.__init__
+    """
+    layout = layout.lower().strip()
+    if not layout:
+        layout = "qwerty"
+    if reverse is None:
+        reverse = layout in REVERSE_LAYOUTS  # the symbol keys are on the left on Dvorak
+    return layout, bool(reverse)
+
+
+def available_layouts() -> List[str]:
+    """Lists the names of the layout files (hidden files are skipped)"""
+    return sorted(
+        f
+        for f in os.listdir(LAYOUT_DIR)
+        if not f.startswith(".") and os.path.isfile(os.path.join(LAYOUT_DIR, f))
+    )
+
 
 class Cipher:
     def __init__(
         self, layout: str = "QWERTY", alphabet_check: int = 26, reverse: bool = None
     ):
-        layout = layout.lower().strip()
-        if not layout:
-            layout = "qwerty"
-        if reverse is None and layout in REVERSE_LAYOUTS:
-            reverse = True  # the symbol keys are on the left on Dvorak
+        layout, reverse = layout_options(layout, reverse)
+        with open(os.path.join(LAYOUT_DIR, layout)) as f:
+            rows = f.read().splitlines()
+        self._build(layout, rows, alphabet_check, reverse)
+
+    @classmethod
+    def from_rows(
+        cls,
+        rows: Sequence[str],
+        name: str = "custom",
+        alphabet_check: int = 26,
+        reverse: bool = False,
+    ) -> "Cipher":
+        """
+        Builds a Cipher from the rows of a layout held in memory, exactly
+        as if they had been read from a file called name in the layouts
+        directory (which is never looked at)
+        """
+        c: Cipher = cls.__new__(cls)
+        c._build(name.lower().strip() or "custom", rows, alphabet_check, bool(reverse))
+        return c
+
+    def _build(
+        self, layout: str, rows: Iterable[str], alphabet_check: int, reverse: bool
+    ) -> None:
+        self.layout: str = layout
+        self.reverse: bool = reverse
 
         # Load the layout
         self.alphabet: str = ""
         self.letter_index: Dict[chr, Keycap] = {}
         self.grid: List[List[Keycap]] = []
         self.height: int = 0
-        for row in open(os.path.join(os.path.dirname(__file__), f"layouts/{layout}")):
+        for row in rows:
             row = row.lower().strip()
             self.alphabet += row
             self.grid.append([])
@@ -168,18 +494,8 @@ class Cipher:
             self.height += 1
         self.row_lengths: List[int] = [len(r) for r in self.grid]
         max_len = max(self.row_lengths)
-
-        # Validity checks
-        assert len(self.alphabet) == len(
-            self.letter_index.keys()
-        ), f"Layout has at least one repeated letter"
-        if alphabet_check > 0:
-            dif: int = len(self.alphabet) - alphabet_check
-            if dif > 0:
-                e(f"Layout contains {dif} more letters than the alphabet, continuing.")
-            assert (
-                dif >= 0
-            ), f"Layout is missing {-dif} letter{'s' if dif < -1 else ''} of the alphabet"
+        self._validate(alphabet_check)
+        self._number_keys()
 
         # Arrange the keycaps to a grid
         for r in range(self.height):
@@ -232,7 +548,65 @@ class Cipher:
         for k1 in self.letter_index.values():
             for k2 in k1.deciphers_to:
                 k2.encrypts_to.append(k1)
-        [(key, key.bake_surround(), key.surround) for key in self.letter_index.values()]
+        for key in self.letter_index.values():
+            key.bake_surround()  # see Cipher.irreversible for what it throws out
+
+        self._compile()
+
+    def _validate(self, alphabet_check: int) -> None:
+        """Validity checks"""
+        assert len(self.alphabet) == len(
+            self.letter_index.keys()
+        ), f"Layout has at least one repeated letter"
+        if alphabet_check > 0:
+            dif: int = len(self.alphabet) - alphabet_check
+            if dif > 0:
+                e(f"Layout contains {dif} more letters than the alphabet, continuing.")
+            assert (
+                dif >= 0
+            ), f"Layout is missing {-dif} letter{'s' if dif < -1 else ''} of the alphabet"
+
+    def _number_keys(self) -> None:
+        """Gives each letter's Keycap its own bit, in the order of self.letter_index"""
+        for i, k in enumerate(self.letter_index.values()):
+            k.bit = 1 << i
+
+    @property
+    def irreversible(self) -> Dict[chr, int]:
+        """
+        How many of each letter's neighbors are not reversible (left out of
+        --reversible but kept by --decipher), as Keycap.bake_surround counts them
+        """
+        reversible = self.tables["R"].neighbors
+        return {
+            ch: len(options) - len(reversible[ch])
+            for ch, options in self.tables["D"].neighbors.items()
+        }
+
+    def linked(self, letter: chr, other: chr, direction: chr = "R") -> bool:
+        """
+        Whether other is one of letter's possibilities in direction,
+        as a bit test rather than a search through the list
+        """
+        k = self.letter_index.get(letter)
+        o = self.letter_index.get(other)
+        return k is not None and o is not None and k.links(o, direction.upper())
+
+    def _compile(self) -> None:
+        """Builds the fixed-order lookups for each direction from the baked keycaps"""
+        self.tables: Dict[chr, NeighborTable] = {
+            d: NeighborTable(
+                {
+                    ch: cap_list_str(k.__getattribute__(direction_methods[d]))
+                    for ch, k in self.letter_index.items()
+                }
+            )
+            for d in "RED"
+        }
+        # ASCII characters that are not part of the layout, for dropping
+        self._ascii_drop: bytes = bytes(
+            b for b in range(128) if chr(b) not in self.letter_index
+        )
 
     def surround(self, letter: chr, full: bool = False) -> List[chr]:
         """
@@ -246,24 +620,49 @@ class Cipher:
         ]
 
     def encode_chr(
-        self, ch: chr, direction: chr = "R", drop: bool = True, rnd: bool = False
+        self,
+        ch: chr,
+        direction: chr = "R",
+        drop: bool = True,
+        rnd: bool = False,
+        rng: random.Random = None,
     ) -> str:
         """
         Encodes a single character and returns the output possibilities
         Params drop and direction are the same as in Cipher.encode_text
             except direction also has option '0' to echo back the input character if it was found
+        Param rng is the random.Random to shuffle with (default: the random module)
         """
         direction = direction.upper().strip()[0]
         letter: Keycap = self.letter_index.get(ch)
         if letter:
-            s = letter.__getattribute__(direction_methods[direction])
-            if rnd:
-                random.shuffle(s)
-            return cap_list_str(s)
+            if direction == "0":
+                return letter.name
+            s: str = self.tables[direction].neighbors[ch]
+            if rnd:  # shuffle a copy so the cipher itself never changes
+                s = "".join((rng or random).sample(s, len(s)))
+            return s
         if drop:
             return ""
         return ch
 
+    def normalize(self, text: str, drop: bool = True, strip: bool = True) -> str:
+        """
+        Returns text stripped and lower-cased, as it appears in row 0 of
+        Cipher.encode_text, with the characters outside the layout removed
+        when drop is set
+
+        Pass strip=False for pieces from the middle of a line.
+        """
+        if strip:
+            text = text.strip()
+        text = text.lower()
+        if not drop:
+            return text
+        if text.isascii():
+            return text.encode("ascii").translate(None, self._ascii_drop).decode()
+        return "".join(filter(self.letter_index.__contains__, text))
+
     def encode_text(
         self,
         text: str,
@@ -273,6 +672,8 @@ class Cipher:
         limit_possibilities: int = 8,
         start: int = 0,
         jump: int = 1,
+        rng: random.Random = None,
+        seed: Any = None,
     ) -> List[str]:
         """
         This is where the magic occurs.  Encode or decode the text.
@@ -284,6 +685,8 @@ class Cipher:
         limit_possibilities: how many possibilities are returned
         start: start index for which possibility is chosen
         jump: how much to jump—set to 0 to always choose the start possibility
+        rng: the random.Random that rnd draws from (default: the random module)
+        seed: seeds a new random.Random for this call when rng is not given
 
         :returns:
         A list:
@@ -293,31 +696,128 @@ class Cipher:
         The output will look grid-like if each row is separated by \n
         """
         # prep work
-        results: List[str] = [
-            "".join([self.encode_chr(c, "0", drop) for c in text.strip().lower()])
-        ]
+        if rng is None and seed is not None:
+            rng = random.Random(seed)
+        results: List[str] = [self.normalize(text, drop)]
         if direction == "0":  # echo the input
             return results * 2  # ensures that the results[1] is a valid index
+        return results + self.possibilities(
+            results[0], direction, rnd, limit_possibilities, start, jump, rng
+        )
 
-        # get possibilities for each character
-        possibilities: List[str] = [
-            self.encode_chr(c, direction, drop, rnd) for c in results[0]
-        ]
+    def possibilities(
+        self,
+        text: str,
+        direction: chr = "r",
+        rnd: bool = True,
+        limit_possibilities: int = 8,
+        start: int = 0,
+        jump: int = 1,
+        rng: random.Random = None,
+    ) -> List[str]:
+        """
+        The possibility rows of Cipher.encode_text (everything after row 0)
+        for text that has already been through Cipher.normalize
+
+        Characters outside the layout are passed through unchanged.
+        Encoding a long text in pieces gives the same rows as encoding it
+        whole as long as each piece's start is moved on by jump for every
+        character before it.
 
-        return results + [
-            "".join(  # create string for each possible result
-                [
-                    possibilities[char_no][
-                        (start + offset + (char_no * jump))
-                        % len(possibilities[char_no])
-                    ]
-                    for char_no in range(
-                        len(results[0])
-                    )  # each character in stripped input phrase
-                ]
+        Nothing about the Cipher is changed by rnd, so one Cipher can be
+        shared between threads as long as each one passes its own rng.
+        """
+        return list(
+            self.iter_possibilities(
+                text, direction, rnd, limit_possibilities, start, jump, rng
             )
+        )
+
+    def iter_possibilities(
+        self,
+        text: str,
+        direction: chr = "r",
+        rnd: bool = True,
+        limit_possibilities: int = 8,
+        start: int = 0,
+        jump: int = 1,
+        rng: random.Random = None,
+    ) -> Iterator[str]:
+        """
+        Cipher.possibilities one row at a time, each worked out only when it
+        is asked for (with rnd, the randomness is still drawn right away)
+        """
+        if direction == "0":
+            return iter([text])
+
+        table: NeighborTable = self.tables[direction.upper().strip()[0]]
+        if rnd:
+            return table.iter_random_rows(text, rng or random, limit_possibilities)
+        # use the compiled tables
+        return (
+            table.row(text, start + offset, jump)
             for offset in range(limit_possibilities)
-        ]
+        )
+
+    def verify(
+        self, cleartext: str, ciphertext: str, direction: chr = "r"
+    ) -> List[int]:
+        """
+        Returns the positions where cleartext could not have come out of
+        decoding ciphertext in direction (the '!' marks in the fence)
+
+        Both are compared as they appear in row 0 of Cipher.encode_text,
+        so normalize them first.  An empty list means every letter fits.
+        """
+        if direction == "0":
+            return [i for i, (x, y) in enumerate(zip(cleartext, ciphertext)) if x != y]
+        table: NeighborTable = self.tables[direction.upper().strip()[0]]
+        return table.mismatches(cleartext, ciphertext)
+
+    def invert(
+        self,
+        rows: Union[str, Sequence[str]],
+        direction: chr = "r",
+        start: int = 0,
+        jump: int = 1,
+    ) -> List[str]:
+        """
+        Undoes --fixed output: the candidate cleartext letters for each
+        position of ciphertext made with the same direction, start, and jump
+
+        rows is one row of Cipher.possibilities (what --only-one prints) or
+        several consecutive rows starting with the first; each extra row
+        narrows the candidates, since row k was made with start + k.
+        Different letters can share a possibility at the same phase, so a
+        position may keep more than one candidate; the cleartext letter is
+        always among them.
+        """
+        if isinstance(rows, str):
+            rows = [rows]
+        table: NeighborTable = self.tables[direction.upper().strip()[0]]
+        candidates: List[str] = table.invert(rows[0], start, jump)
+        for offset, row in enumerate(rows[1:], 1):
+            candidates = [
+                "".join(ch for ch in a if ch in b)
+                for a, b in zip(candidates, table.invert(row, start + offset, jump))
+            ]
+        return candidates
+
+    def decode_fixed(
+        self,
+        rows: Union[str, Sequence[str]],
+        direction: chr = "r",
+        start: int = 0,
+        jump: int = 1,
+    ) -> str:
+        """
+        Cipher.invert as text: positions with a single candidate are
+        decoded and the rest are shown as [candidates]
+        """
+        return "".join(
+            ch if len(ch) == 1 else f"[{ch}]"
+            for ch in self.invert(rows, direction, start, jump)
+        )
 
     def draw_keyboard(self) -> None:
         """
@@ -334,22 +834,95 @@ class Cipher:
             p("\n")
 
 
+# Ciphers shared by load_cipher, keyed by (layout, reverse, alphabet_check)
+_registry: Dict[Tuple[str, bool, int], Cipher] = {}
+_registry_lock = _thread.allocate_lock()
+
+
+def load_cipher(
+    layout: str = "QWERTY",
+    alphabet_check: int = 26,
+    reverse: bool = None,
+) -> Cipher:
+    """
+    Returns a shared Cipher for the layout, building it only on first use
+
+    Linking a layout from its file takes well under a millisecond, so each
+    process builds it once rather than keeping a copy on disk.
+    """
+    layout, reverse = layout_options(layout, reverse)
+    key = (layout, reverse, alphabet_check)
+    c = _registry.get(key)
+    if c is None:
+        with _registry_lock:
+            c = _registry.get(key)
+            if c is None:
+                c = _registry[key] = Cipher(layout, alphabet_check, reverse)
+    return c
+
+
 def display_possibilities(
-    possibilities: List[str], only_one: bool = False, separator: str = "-"
+    possibilities: List[str],
+    only_one: bool = False,
+    separator: str = "-",
+    cleartext: str = None,
+    mismatches: Iterable[int] = (),
 ) -> str:
-    if only_one:
-        return possibilities[
-            1
-        ]  # return the first possibility (index 0 is the input phrase)
-    inp: str = possibilities[0]
-    possibilities.append(inp)  # repeat the input at the end for human-readable output
-    if s := separator.replace("\n", "").replace("\t", ""):
-        s = (s * (len(inp) // len(s) + 1))[: len(inp)]
-        possibilities.insert(1, s)
-        possibilities.insert(
-            -1, s
-        )  # this has counter-intuitive behavior but it works for this usage
-    return "\n".join(possibilities)
+    """
+    Lays out the rows of Cipher.encode_text for printing
+
+    With cleartext (the expected result) it is shown next to the input, and
+    the positions in mismatches (see Cipher.verify) are marked with ! in
+    the fence.
+    """
+    return "\n".join(
+        display_lines(possibilities, only_one, separator, cleartext, mismatches)
+    )
+
+
+def fence_line(
+    separator: str, width: int, mismatches: Iterable[int] = ()
+) -> Optional[str]:
+    """
+    separator repeated out to width with a ! at each mismatch, or None when
+    there is no separator to draw (line breaks and tabs are left out of it)
+    """
+    s = separator.replace("\n", "").replace("\t", "")
+    if not s:
+        return None
+    fence = list((s * (width // len(s) + 1))[:width])
+    for i in mismatches:
+        fence[i] = "!"
+    return "".join(fence)
+
+
+def display_lines(
+    possibilities: Iterable[str],
+    only_one: bool = False,
+    separator: str = "-",
+    cleartext: str = None,
+    mismatches: Iterable[int] = (),
+) -> Iterator[str]:
+    """
+    display_possibilities a line at a time, taking the rows as they come,
+    so a grid can be written out without all of it being in memory at once
+    (possibilities may be Cipher.iter_possibilities after the input)
+    """
+    rows: Iterator[str] = iter(possibilities)
+    inp: str = next(rows)
+    if only_one:  # the first possibility (index 0 is the input phrase)
+        yield next(rows)
+        return
+    # the input, cleartext, and fence go above and (mirrored) below the rows
+    top: List[str] = [inp]
+    if cleartext is not None:
+        top.append(cleartext)
+    s = fence_line(separator, max(len(inp), len(cleartext or "")), mismatches)
+    if s is not None:  # even when the line is empty and so is the fence
+        top.append(s)
+    yield from top
+    yield from rows
+    yield from reversed(top)
 
 
 nav_guide = ("❇", ["➡️", "↗️", "⬆️", "↖️", "⬅️", "↙️", "⬇️", "↘️"])
@@ -359,6 +932,12 @@ direction_methods: Dict[chr, str] = {
     "D": "deciphers_to",
     "0": "name",
 }
+# the shark flag for each direction
+direction_flags: Dict[chr, str] = {
+    "R": "--reversible",
+    "E": "--encrypt",
+    "D": "--decipher",
+}
 
 
 def letter_test_grid(c: Cipher, l: chr) -> str:  # noqa ignore short variable name 'l'
@@ -386,139 +965,7 @@ def letter_test_grid(c: Cipher, l: chr) -> str:  # noqa ignore short variable na
     return "\n".join(o)
 
 
-@click.command()
-@click.argument("text", type=click.File(), nargs=1)
-@click.option(
-    "-k",
-    "--layout",
-    default="QWERTY",
-    type=click.STRING,
-    help="""
-        The layout of the keyboard you use for the cipher.
-
-        Technically, this is the name of a file in the layouts directory.
-
-        The -k shortname stands for keyboard and defaults to QWERTY.
-        """,
-)
-@click.option(
-    "--only-one",
-    is_flag=True,
-    help="""
-        Limit the output to a single substitution.
-        If this flag is not set, then a grid of possibilities will be displayed
-        (setting this flag negates the usefulness of setting --barrier).
-        """,
-)
-@click.option(
-    "-sep",
-    "--barrier",
-    type=click.STRING,
-    default="-",
-    help="""
-        Separate input from output with the character(s) supplied here.  
-        Default is a fence of hyphens.
-        """,
-)
-@click.option(
-    "--random/--fixed",
-    "rnd",
-    default=True,
-    help="""
-        Pass --fixed to always order the output possibilities in a consistent order.
-        Otherwise, the possible substitutions for each letter are presented in a random order.
-        If the step parameter is changed with random output order, the results may be
-        less random than expected.
-        """,
-)
-@click.option(
-    "--direction",
-    "-j",  # stands for jump
-    "skip",
-    type=click.INT,
-    default=1,
-    help="""
-        How many positions to rotate between each subsequent letter.
-        Negative values move clockwise and positive count clockwise.
-        This one in particular will reduce randomness if it is set to
-        values other than 1 or -1.
-
-        A value of 0 here where --fixed is true will return the key that
-        is at a constant offset from the right.
-
-        (The j stands for jump)
-        """,
-)
-@click.option(
-    "--offset",
-    "--start",
-    "start",
-    type=click.INT,
-    default=0,
-    help="""
-        When --fixed is set, this controls the offset of the first
-        letter of the output by moving it n spaces from the key directly
-        to the right.  Use a negative number to move clockwise or, to move
-        counter-clockwise, use a positive number.
-        0 starts directly to the right.
-        """,
-)
-@click.option(
-    "--strip/--include",
-    default=True,
-    help="""
-        Strip out [default] or pass through characters that are not in the cipher.
-        Passing them through provides hints that make manual decoding easier. 
-        """,
-)
-# These are placed at the end of the options so the --help output is prettier
-@click.option(
-    "--encrypt",
-    "direction",
-    flag_value="E",
-    help="""Generate possibilities that can decipher to TEXT""",
-)
-@click.option(
-    "--reversible",
-    "direction",
-    flag_value="R",
-    default=True,
-    help="""[DEFAULT] Generate fully-reversible options""",
-)
-@click.option(
-    "--decipher",
-    "direction",
-    flag_value="D",
-    help="""Display possible cleartext letters for TEXT""",
-)
-def shark(
-    text,
-    layout: str = "QWERTY",
-    only_one: bool = False,
-    barrier: str = "*",
-    direction: chr = "R",
-    rnd: bool = True,
-    skip: int = 1,
-    start: int = 0,
-    strip: bool = False,
-):
-    """
-    Runs TEXT through the shark cipher and displays the result to stdout
-
-    To read from stdin rather than a specific TEXT file, use - for TEXT.
-
-    For specific recipes on CLI usage, see the readme.
-    """
-    c = Cipher(layout)
-    for line in text:
-        p(
-            display_possibilities(
-                c.encode_text(line, strip, direction, rnd, start=start, jump=skip),
-                only_one,
-                barrier,
-            )
-        )
-
-
 if __name__ == "__main__":
+    from cli import shark
+
     shark()
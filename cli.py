@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+
+from contextlib import nullcontext
+from itertools import chain
+from typing import *
+
+import click
+
+from cipher import *
+
+"""
+The shark command: the command-line interface to cipher.py.
+
+It lives apart from the cipher so that importing the cipher for library use
+does not import Click.  ./cipher.py runs it.
+"""
+
+
+@click.command()
+@click.argument("text", type=click.File(), nargs=1)
+@click.option(
+    "-k",
+    "--layout",
+    default="QWERTY",
+    type=click.STRING,
+    help="""
+        The layout of the keyboard you use for the cipher.
+
+        Technically, this is the name of a file in the layouts directory.
+
+        The -k shortname stands for keyboard and defaults to QWERTY.
+
+        Pass auto to guess the layout (and, unless one is given, the direction
+        to decode with) from TEXT itself; the guess is reported to stderr.
+        """,
+)
+@click.option(
+    "--only-one",
+    is_flag=True,
+    help="""
+        Limit the output to a single substitution.
+        If this flag is not set, then a grid of possibilities will be displayed
+        (with this flag, --barrier is only drawn as the --against fence).
+        """,
+)
+@click.option(
+    "-sep",
+    "--barrier",
+    type=click.STRING,
+    default="-",
+    help="""
+        Separate input from output with the character(s) supplied here.  
+        Default is a fence of hyphens.
+        """,
+)
+@click.option(
+    "--random/--fixed",
+    "rnd",
+    default=True,
+    help="""
+        Pass --fixed to always order the output possibilities in a consistent order.
+        Otherwise, each letter's possible substitutions are shuffled on their
+        own, in an order that --seed makes reproducible
+        (--offset and -j only apply to --fixed).
+        """,
+)
+@click.option(
+    "--direction",
+    "-j",  # stands for jump
+    "skip",
+    type=click.INT,
+    default=1,
+    help="""
+        How many positions to rotate between each subsequent letter.
+        Negative values move clockwise and positive count clockwise.
+        This one in particular will reduce randomness if it is set to
+        values other than 1 or -1.
+
+        A value of 0 here where --fixed is true will return the key that
+        is at a constant offset from the right.
+
+        (The j stands for jump)
+        """,
+)
+@click.option(
+    "--offset",
+    "--start",
+    "start",
+    type=click.INT,
+    default=0,
+    help="""
+        When --fixed is set, this controls the offset of the first
+        letter of the output by moving it n spaces from the key directly
+        to the right.  Use a negative number to move clockwise or, to move
+        counter-clockwise, use a positive number.
+        0 starts directly to the right.
+        """,
+)
+@click.option(
+    "--strip/--include",
+    default=True,
+    help="""
+        Strip out [default] or pass through characters that are not in the cipher.
+        Passing them through provides hints that make manual decoding easier. 
+        """,
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="""
+        Read TEXT in fixed-size chunks (memory-mapping regular files) and buffer
+        the output, so memory use stays flat however long the lines are.
+        Lines longer than --chunk-size get one grid per chunk;
+        --only-one output is unchanged.
+        """,
+)
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=1 << 20,
+    show_default=True,
+    help="""Characters per chunk for --stream.""",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=0),
+    default=1,
+    show_default=True,
+    help="""
+        Encode chunks of TEXT with this many processes (0 for one per CPU).
+        Output stays in input order.  Implies --stream.
+        """,
+)
+@click.option(
+    "--seed",
+    type=click.INT,
+    help="""
+        Seed the --random choices so the output can be reproduced.
+        Each chunk is seeded separately, so the result does not depend on --jobs.
+        Implies --stream.
+        """,
+)
+@click.option(
+    "--against",
+    type=click.File(),
+    help="""
+        The cleartext TEXT should decode to, one line per line of TEXT.
+        It is shown under the input, and each position where its letter
+        is not among the options is marked with ! in the fence.
+        """,
+)
+@click.option(
+    "--invert",
+    is_flag=True,
+    help="""
+        Undo --fixed output instead: TEXT holds --only-one lines made with the
+        same layout, direction, --offset, and -j, and the cleartext is printed.
+        Letters that more than one cleartext letter could have given are shown
+        as [candidates].
+        """,
+)
+@click.option(
+    "--best",
+    is_flag=True,
+    help="""
+        Decode TEXT as ciphertext: in place of the grid, show the most
+        probable cleartexts (among the grid's letters) under a character
+        n-gram model, best first.  With --only-one, just the best.
+        """,
+)
+@click.option(
+    "--readings",
+    type=click.IntRange(min=1),
+    default=3,
+    show_default=True,
+    help="""How many cleartexts --best shows for each line.""",
+)
+@click.option(
+    "--corpus",
+    type=click.Path(exists=True, dir_okay=False),
+    help="""
+        Train the --best model on this text file
+        (default: the Python documentation that comes with Python).
+        """,
+)
+@click.option(
+    "--order",
+    type=click.IntRange(2, 4),
+    default=3,
+    show_default=True,
+    help="""
+        The length of the n-grams --best counts.  4 is more accurate
+        but several times slower.
+        """,
+)
+@click.option(
+    "--lattice",
+    "write_lattice",
+    is_flag=True,
+    help="""
+        Write every position's full set of candidates to stdout in binary,
+        one bitmask per letter, for other tools to read (see lattice.py)
+        instead of the grid.
+        """,
+)
+@click.option(
+    "--follow",
+    is_flag=True,
+    help="""
+        Keep TEXT (a file) open and encode lines as they are appended to it,
+        like tail -f, until interrupted.  Implies --stream.
+        """,
+)
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False, writable=True),
+    help="""
+        Save how far --follow got to this file, and carry on from there
+        (rather than the start of TEXT) when it already exists.
+        """,
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0),
+    default=0.5,
+    show_default=True,
+    help="""Seconds --follow waits before looking for more of TEXT.""",
+)
+@click.option(
+    "--cache",
+    is_flag=True,
+    help="""
+        With --fixed, remember the rows of each line and of the words in
+        long lines, so repeated text is looked up rather than encoded again.
+        """,
+)
+@click.option(
+    "--stats",
+    "show_stats",
+    is_flag=True,
+    help="""
+        Report time spent in each phase (load, normalize, possibilities,
+        display, output), lines and characters in and out, dropped
+        characters, and throughput to stderr when done.
+        """,
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="""Write the --stats report to this file as JSON.""",
+)
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="""
+        Run under cProfile and dump the results to this file
+        (read it with python -m pstats).
+        """,
+)
+# These are placed at the end of the options so the --help output is prettier
+@click.option(
+    "--encrypt",
+    "direction",
+    flag_value="E",
+    help="""Generate possibilities that can decipher to TEXT""",
+)
+@click.option(
+    "--reversible",
+    "direction",
+    flag_value="R",
+    default=True,
+    help="""[DEFAULT] Generate fully-reversible options""",
+)
+@click.option(
+    "--decipher",
+    "direction",
+    flag_value="D",
+    help="""Display possible cleartext letters for TEXT""",
+)
+def shark(
+    text,
+    layout: str = "QWERTY",
+    only_one: bool = False,
+    barrier: str = "*",
+    direction: chr = "R",
+    rnd: bool = True,
+    skip: int = 1,
+    start: int = 0,
+    strip: bool = False,
+    stream: bool = False,
+    chunk_size: int = 1 << 20,
+    jobs: int = 1,
+    seed: int = None,
+    invert: bool = False,
+    against=None,
+    best: bool = False,
+    readings: int = 3,
+    corpus: str = None,
+    order: int = 3,
+    write_lattice: bool = False,
+    follow: bool = False,
+    checkpoint: str = None,
+    interval: float = 0.5,
+    cache: bool = False,
+    show_stats: bool = False,
+    stats_json: str = None,
+    profile: str = None,
+):
+    """
+    Runs TEXT through the shark cipher and displays the result to stdout
+
+    To read from stdin rather than a specific TEXT file, use - for TEXT.
+
+    For specific recipes on CLI usage, see the readme.
+    """
+    stats = None
+    if show_stats or stats_json:
+        from stats import Stats
+
+        stats = Stats()
+    profiler = None
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if given_direction(click.get_current_context()) is None:
+        direction = None  # left to run_shark (and -k auto) to decide
+    try:
+        run_shark(
+            text,
+            layout,
+            only_one,
+            barrier,
+            direction,
+            rnd,
+            skip,
+            start,
+            strip,
+            stream,
+            chunk_size,
+            jobs,
+            seed,
+            invert,
+            against,
+            best,
+            readings,
+            corpus,
+            order,
+            write_lattice,
+            follow,
+            checkpoint,
+            interval,
+            cache,
+            stats,
+        )
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if stats is not None:
+            stats.finish()
+            if show_stats:
+                e(str(stats))
+            if stats_json:
+                with open(stats_json, "w") as f:
+                    f.write(stats.json())
+
+
+def given_direction(ctx: click.Context) -> Optional[chr]:
+    """The direction the shark command was given, or None if it was left out"""
+    if ctx.get_parameter_source("direction") == click.core.ParameterSource.DEFAULT:
+        return None
+    return ctx.params["direction"]
+
+
+def run_shark(
+    text,
+    layout: str = "QWERTY",
+    only_one: bool = False,
+    barrier: str = "-",
+    direction: chr = None,
+    rnd: bool = True,
+    skip: int = 1,
+    start: int = 0,
+    strip: bool = True,
+    stream: bool = False,
+    chunk_size: int = 1 << 20,
+    jobs: int = 1,
+    seed: int = None,
+    invert: bool = False,
+    against=None,
+    best: bool = False,
+    readings: int = 3,
+    corpus: str = None,
+    order: int = 3,
+    write_lattice: bool = False,
+    follow: bool = False,
+    checkpoint: str = None,
+    interval: float = 0.5,
+    cache: bool = False,
+    stats=None,
+    out: TextIO = None,
+    err: Callable[[str], Any] = e,
+) -> None:
+    """
+    The body of the shark command, with the same arguments
+
+    direction None means --reversible, or whatever -k auto detects.
+
+    stats, if given, is a stats.Stats that collects the time spent in each
+    phase and counts of what went through; None skips all the timing.
+    With cache, the hits and misses of the memo.RowCache are counted too.
+    Output goes to stdout unless out is given, and messages go to err.
+    """
+    echo: Callable[[str], Any] = p if out is None else lambda s: out.write(f"{s}\n")
+    if layout.lower().strip() == "auto":
+        from detect import DECODE_WITH, detect
+
+        content: str = text.read()
+        text = io.StringIO(content)
+        guess = detect(content)
+        layout = guess.layout
+        if direction is None:
+            direction = DECODE_WITH[guess.direction] if not invert else guess.direction
+        err(
+            f"Detected -k {layout} {direction_flags[guess.direction]} ciphertext "
+            f"({guess.confidence:.0%} confidence)"
+        )
+    direction = direction or "R"
+    if stats is None:
+        c = load_cipher(layout)
+    else:
+        with stats.phase("load"):
+            c = load_cipher(layout)
+    if invert:
+        for line in text:
+            echo(c.decode_fixed(c.normalize(line, False), direction, start, skip))
+        return
+    if cache and (
+        rnd
+        or stream
+        or jobs != 1
+        or seed is not None
+        or follow
+        or best
+        or write_lattice
+    ):
+        raise click.UsageError("--cache goes with --fixed, one line at a time")
+    if checkpoint is not None and not follow:
+        raise click.UsageError("--checkpoint only goes with --follow")
+    if follow:
+        if best or write_lattice or against is not None or jobs != 1:
+            raise click.UsageError("--follow encodes one line at a time, by itself")
+        if getattr(text, "name", "<stdin>").startswith("<"):
+            raise click.UsageError("--follow needs TEXT to be a file")
+        from follow import Follower, follow_shark
+        from stream import BufferedOutput
+
+        try:
+            follower = Follower(
+                c,
+                text.name,
+                checkpoint,
+                strip,
+                direction,
+                rnd,
+                start,
+                skip,
+                only_one,
+                barrier,
+                chunk_size,
+                seed,
+            )
+        except ValueError as x:
+            raise click.BadParameter(str(x), param_hint="--checkpoint")
+        with (
+            BufferedOutput(sys.stdout.buffer, chunk_size)
+            if out is None
+            else nullcontext(out)
+        ) as sink:
+            try:
+                follow_shark(follower, sink, interval)
+            except KeyboardInterrupt:
+                pass  # the checkpoint is already saved
+        return
+    if write_lattice:
+        if best or against is not None or stream or jobs != 1 or seed is not None:
+            raise click.UsageError("--lattice works on whole lines, by itself")
+        from lattice import LatticeWriter
+
+        binary = sys.stdout.buffer if out is None else getattr(out, "buffer", None)
+        if binary is None:
+            raise click.UsageError("--lattice writes binary, so run it locally")
+        LatticeWriter(c, binary, direction, strip).write_all(text)
+        binary.flush()
+        return
+    if best:
+        if against is not None or stream or jobs != 1 or seed is not None:
+            raise click.UsageError("--best works on whole lines, by itself")
+        return best_shark(
+            c, text, echo, strip, direction, only_one, barrier, readings, corpus, order
+        )
+    if against is not None and (stream or jobs != 1 or seed is not None):
+        raise click.UsageError("--against works line by line, without --stream")
+    if stream or jobs != 1 or seed is not None:
+        from stream import BufferedOutput, stream_shark
+
+        with (
+            BufferedOutput(sys.stdout.buffer, chunk_size)
+            if out is None
+            else nullcontext(out)
+        ) as sink:
+            stream_shark(
+                c,
+                text,
+                sink,
+                strip,
+                direction,
+                rnd,
+                start,
+                skip,
+                only_one,
+                barrier,
+                chunk_size,
+                jobs or os.cpu_count(),
+                seed,
+                stats,
+            )
+        return
+    memo = None
+    if cache:
+        from memo import RowCache
+
+        memo = RowCache()
+    limit: int = 1 if only_one else 8  # only work out the rows that are shown
+    if stats is not None:
+        for line in text:
+            with stats.phase("normalize"):
+                rows = [c.normalize(line, strip)]
+            with stats.phase("possibilities"):
+                if memo is None:
+                    rows += c.possibilities(rows[0], direction, rnd, limit, start, skip)
+                else:
+                    rows += memo.possibilities(
+                        c, rows[0], direction, limit, start, skip
+                    )
+            with stats.phase("display"):
+                text_out = shark_display(
+                    c, rows, only_one, barrier, direction, against, strip
+                )
+            with stats.phase("output"):
+                echo(text_out)
+            stats.count(
+                lines=1,
+                chars_in=len(line),
+                chars_out=len(text_out) + 1,
+                dropped=len(line.strip()) - len(rows[0]),
+            )
+        if memo is not None:
+            for name, counters in memo.counters().items():
+                stats.count(
+                    **{
+                        f"{name}_hits": counters.hits,
+                        f"{name}_misses": counters.misses,
+                        f"{name}_evictions": counters.evictions,
+                    }
+                )
+        return
+    write: Callable[[str], Any] = sys.stdout.write if out is None else out.write
+    for line in text:
+        normalized = c.normalize(line, strip)
+        if memo is None:
+            rows = c.iter_possibilities(normalized, direction, rnd, limit, start, skip)
+        else:
+            rows = memo.possibilities(c, normalized, direction, limit, start, skip)
+        if against is not None:
+            echo(
+                shark_display(
+                    c, [normalized, *rows], only_one, barrier, direction, against, strip
+                )
+            )
+            continue
+        # a row at a time, so a long line's grid is never all in memory
+        for shown in display_lines(chain([normalized], rows), only_one, barrier):
+            write(shown)
+            write("\n")
+
+
+def best_shark(
+    c: Cipher,
+    text: Iterable[str],
+    echo: Callable[[str], Any],
+    strip: bool = True,
+    direction: chr = "R",
+    only_one: bool = False,
+    barrier: str = "-",
+    readings: int = 3,
+    corpus: str = None,
+    order: int = 3,
+) -> None:
+    """
+    The shark command with --best: the likeliest cleartexts of each line
+    (see ngram.py), laid out like the grid
+    """
+    from ngram import Decoder, lattice, load_model
+
+    # stripped ciphertext has no spaces, so the model should not expect any
+    decoder = Decoder(load_model(corpus, order, spaces=not strip))
+    lines = [c.normalize(line, strip) for line in text]
+    lattices = [lattice(c, line, direction) for line in lines]
+    for line, found in zip(lines, decoder.decode_many(lattices, readings)):
+        rows = [line] + [reading.text for reading in found]
+        echo(display_possibilities(rows, only_one, barrier))
+
+
+def shark_display(
+    c: Cipher,
+    rows: List[str],
+    only_one: bool = False,
+    barrier: str = "-",
+    direction: chr = "R",
+    against=None,
+    strip: bool = True,
+) -> str:
+    """
+    What the shark command prints for the rows of one line, checked against
+    the next line of the file against if there is one
+    """
+    if against is None:
+        return display_possibilities(rows, only_one, barrier)
+    cleartext = c.normalize(against.readline(), strip)
+    mismatches = c.verify(cleartext, rows[0], direction)
+    if only_one:  # the output with the fence under it
+        fence = fence_line(barrier, max(len(rows[1]), len(cleartext)), mismatches)
+        return rows[1] if fence is None else f"{rows[1]}\n{fence}"
+    return display_possibilities(rows, False, barrier, cleartext, mismatches)
+
+
+if __name__ == "__main__":
+    shark()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+import math
+import multiprocessing
+import random
+import time
+from collections import Counter
+from typing import *
+
+from cipher import *
+
+"""
+Searches for keyboard layouts that make good (or bad) shark ciphers.
+
+A layout is scored from where its keys are linked, weighted by how common
+each letter is:
+
+* reversible: the average number of --reversible options a letter has, so
+  the most reversible layouts come out on top;
+* ambiguous: how uncertain the cleartext letter is once its ciphertext
+  letter is known (the conditional entropy in bits), so the hardest layouts
+  to crack come out on top;
+* clear: the opposite of ambiguous.
+
+The search is simulated annealing over two moves: swapping two letters, and
+moving the last letter of one row to the end of another.  The links depend
+only on the shape (the row lengths), so each shape is linked once by
+Cipher.from_rows and kept.  A swap leaves the shape alone and changes only
+the scores of the ciphertext letters next to the two keys, so it is scored
+from those alone.  Independent chains run on a process pool.
+"""
+
+OBJECTIVES: Tuple[str, ...] = ("reversible", "ambiguous", "clear")
+# the shortest a row can get (the grid needs a left and a right neighbor)
+SHORTEST_ROW: int = 2
+
+
+class Geometry:
+    """
+    Which positions are linked in a layout of a given shape
+
+    Positions number the keys row by row, as they are written in the layout
+    file.  out[q] lists the positions that q's letter can encode to in the
+    direction, with repeats, into[x] the (q, share) pairs for the positions
+    that can encode to x, where share is the chance that q gives x, and
+    reversible[q] is how many --reversible options q has.
+    """
+
+    def __init__(self, lengths: Tuple[int, ...], reverse: bool, direction: chr):
+        size = sum(lengths)
+        # stand-in letters that no layout row would change (no case, no spaces)
+        keys = "".join(chr(0x3400 + i) for i in range(size))
+        c = Cipher.from_rows(
+            split_rows(keys, lengths), "shape", alphabet_check=0, reverse=reverse
+        )
+        where = {ch: i for i, ch in enumerate(keys)}
+        neighbors = c.tables[direction].neighbors
+        self.lengths: Tuple[int, ...] = lengths
+        self.out: List[Tuple[int, ...]] = [
+            tuple(where[ch] for ch in neighbors[key]) for key in keys
+        ]
+        self.reversible: List[int] = [len(c.tables["R"].neighbors[key]) for key in keys]
+        into: List[Dict[int, float]] = [{} for _ in keys]
+        for q, targets in enumerate(self.out):
+            for x in targets:
+                into[x][q] = into[x].get(q, 0.0) + 1 / len(targets)
+        self.into: List[Tuple[Tuple[int, float], ...]] = [
+            tuple(shares.items()) for shares in into
+        ]
+
+
+class Design(NamedTuple):
+    """A layout found by the search, its score, and how many were scored"""
+
+    score: float
+    rows: Tuple[str, ...]
+    evaluated: int
+
+    def __str__(self) -> str:
+        return f"{self.score:.4f}\t{' '.join(self.rows)}"
+
+
+def letter_frequencies(text: str, alphabet: str) -> Dict[chr, float]:
+    """How often each letter of alphabet appears in text (add-one smoothed)"""
+    counts = Counter(ch for ch in text.lower() if ch in alphabet)
+    total = sum(counts.values()) + len(alphabet)
+    return {ch: (counts[ch] + 1) / total for ch in alphabet}
+
+
+def split_rows(letters: Sequence[chr], lengths: Sequence[int]) -> Tuple[str, ...]:
+    rows, at = [], 0
+    for length in lengths:
+        rows.append("".join(letters[at : at + length]))
+        at += length
+    return tuple(rows)
+
+
+class Scorer:
+    """
+    Scores layouts for an objective (see OBJECTIVES), higher being better
+
+    frequencies weights each letter (every letter the same if None).
+    Geometries are built on first use and kept, so a chain that returns
+    to a shape does not link it again.
+    """
+
+    def __init__(
+        self,
+        objective: str = "reversible",
+        frequencies: Dict[chr, float] = None,
+        direction: chr = "R",
+        reverse: bool = False,
+    ):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"objective must be one of {', '.join(OBJECTIVES)}")
+        self.objective: str = objective
+        self.frequencies: Optional[Dict[chr, float]] = frequencies
+        self.direction: chr = direction.upper().strip()[0]
+        self.reverse: bool = reverse
+        self._shapes: Dict[Tuple[int, ...], Optional[Geometry]] = {}
+
+    def geometry(self, lengths: Sequence[int]) -> Optional[Geometry]:
+        """The Geometry of a shape, or None if the grid cannot be linked"""
+        lengths = tuple(lengths)
+        if lengths not in self._shapes:
+            try:
+                shape = Geometry(lengths, self.reverse, self.direction)
+            except (AssertionError, AttributeError, IndexError):
+                shape = None
+            self._shapes[lengths] = shape
+        return self._shapes[lengths]
+
+    def weights(self, letters: Sequence[chr]) -> List[float]:
+        if self.frequencies is None:
+            return [1 / len(letters)] * len(letters)
+        total = sum(self.frequencies.get(ch, 0.0) for ch in letters) or 1.0
+        return [self.frequencies.get(ch, 0.0) / total for ch in letters]
+
+    def term(self, shape: Geometry, f: Sequence[float], x: int) -> float:
+        """Ciphertext position x's part of the conditional entropy, in nats"""
+        joint = [f[q] * share for q, share in shape.into[x] if f[q]]
+        seen = sum(joint)
+        if not seen:
+            return 0.0
+        return seen * math.log(seen) - sum(p * math.log(p) for p in joint)
+
+    def terms(self, shape: Geometry, f: Sequence[float]) -> List[float]:
+        """Each position's part of the score"""
+        if self.objective == "reversible":
+            return [w * n for w, n in zip(f, shape.reversible)]
+        return [self.term(shape, f, x) for x in range(len(f))]
+
+    @property
+    def scale(self) -> float:
+        """What the sum of the terms is multiplied by to give the score"""
+        if self.objective == "reversible":
+            return 1.0
+        bits = 1 / math.log(2)
+        return bits if self.objective == "ambiguous" else -bits
+
+    def total(self, terms: Sequence[float]) -> float:
+        return self.scale * sum(terms)
+
+    def score(self, rows: Sequence[str]) -> float:
+        """The score of a layout, or -inf if it cannot be linked"""
+        rows = [row.lower().strip() for row in rows]
+        shape = self.geometry([len(row) for row in rows])
+        if shape is None:
+            return -math.inf
+        return self.total(self.terms(shape, self.weights("".join(rows))))
+
+    def swap(self, shape: Geometry, f: List[float], i: int, j: int) -> Dict[int, float]:
+        """
+        The new values of the terms that change when the letters at i and j
+        trade places (f is left as it was)
+        """
+        if self.objective == "reversible":
+            return {i: f[j] * shape.reversible[i], j: f[i] * shape.reversible[j]}
+        f[i], f[j] = f[j], f[i]
+        try:
+            return {
+                x: self.term(shape, f, x) for x in set(shape.out[i]).union(shape.out[j])
+            }
+        finally:
+            f[i], f[j] = f[j], f[i]
+
+
+def anneal(
+    rows: Sequence[str],
+    scorer: Scorer,
+    steps: int = 100_000,
+    seed: int = None,
+    hot: float = 0.02,
+    cold: float = 0.0001,
+    reshape: float = 0.1,
+) -> Design:
+    """
+    The best layout one chain of simulated annealing finds, starting from
+    rows and taking steps moves while the temperature falls from hot to
+    cold; reshape is the share of moves that change the shape
+    """
+    rng = random.Random(seed)
+    letters: List[chr] = list("".join(row.lower().strip() for row in rows))
+    lengths: List[int] = [len(row.strip()) for row in rows]
+    shape = scorer.geometry(lengths)
+    assert shape is not None, "The starting layout cannot be linked"
+    f = scorer.weights(letters)
+    terms = scorer.terms(shape, f)
+    score = scorer.total(terms)
+    best = Design(score, split_rows(letters, lengths), 0)
+    cooling = (cold / hot) ** (1 / max(steps - 1, 1))
+    temperature = hot
+    for step in range(steps):
+        if rng.random() < reshape and len(lengths) > 1:
+            # move the last letter of one row to the end of another
+            a, b = rng.sample(range(len(lengths)), 2)
+            if lengths[a] <= SHORTEST_ROW:
+                temperature *= cooling
+                continue
+            new_lengths = list(lengths)
+            new_lengths[a] -= 1
+            new_lengths[b] += 1
+            new_shape = scorer.geometry(new_lengths)
+            if new_shape is None:
+                temperature *= cooling
+                continue
+            moved = list(letters)
+            ends = [sum(lengths[: r + 1]) for r in range(len(lengths))]
+            letter = moved.pop(ends[a] - 1)
+            moved.insert(ends[b] - (1 if b > a else 0), letter)
+            new_f = scorer.weights(moved)
+            new_terms = scorer.terms(new_shape, new_f)
+            new_score = scorer.total(new_terms)
+            if new_score >= score or rng.random() < math.exp(
+                (new_score - score) / temperature
+            ):
+                letters, lengths, shape = moved, new_lengths, new_shape
+                f, terms, score = new_f, new_terms, new_score
+        else:
+            i, j = rng.sample(range(len(letters)), 2)
+            changed = scorer.swap(shape, f, i, j)
+            new_score = score + scorer.scale * sum(
+                t - terms[x] for x, t in changed.items()
+            )
+            if new_score >= score or rng.random() < math.exp(
+                (new_score - score) / temperature
+            ):
+                letters[i], letters[j] = letters[j], letters[i]
+                f[i], f[j] = f[j], f[i]
+                for x, t in changed.items():
+                    terms[x] = t
+                score = new_score
+        if score > best.score:
+            best = Design(score, split_rows(letters, lengths), 0)
+        temperature *= cooling
+    # add up the terms again so rounding over many steps does not creep in
+    return best._replace(score=scorer.score(best.rows), evaluated=steps)
+
+
+def _anneal(args: Tuple) -> Design:
+    rows, scorer, steps, seed, reshape = args
+    return anneal(rows, scorer, steps, seed, reshape=reshape)
+
+
+def search(
+    rows: Sequence[str],
+    scorer: Scorer,
+    chains: int = 1,
+    steps: int = 100_000,
+    seed: int = None,
+    reshape: float = 0.1,
+    jobs: int = 1,
+) -> List[Design]:
+    """
+    Runs chains independent annealing chains from rows (shared out among
+    jobs processes) and returns what each found, best first
+    """
+    base = random.Random(seed)
+    work = [
+        (tuple(rows), scorer, steps, base.getrandbits(64), reshape)
+        for _ in range(chains)
+    ]
+    if jobs <= 1:
+        found = list(map(_anneal, work))
+    else:
+        with multiprocessing.Pool(min(jobs, chains)) as pool:
+            found = pool.map(_anneal, work)
+    return sorted(found, reverse=True)
+
+
+def score_layouts(
+    layouts: Sequence[Sequence[str]], scorer: Scorer, jobs: int = 1
+) -> List[float]:
+    """Scorer.score for each of many layouts, shared out among jobs processes"""
+    if jobs <= 1:
+        return [scorer.score(rows) for rows in layouts]
+    with multiprocessing.Pool(jobs) as pool:
+        return pool.map(scorer.score, layouts, chunksize=256)
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.option(
+        "-k",
+        "--layout",
+        default="QWERTY",
+        type=click.STRING,
+        help="The layout to start from (its letters and number of rows are kept).",
+    )
+    @click.option(
+        "--objective",
+        type=click.Choice(OBJECTIVES),
+        default="reversible",
+        show_default=True,
+        help="What to make as large as possible.",
+    )
+    @click.option(
+        "--steps",
+        type=click.IntRange(min=1),
+        default=100_000,
+        show_default=True,
+        help="Layouts each chain tries.",
+    )
+    @click.option(
+        "--chains",
+        type=click.IntRange(min=1),
+        help="Independent searches to run (default: one per job).",
+    )
+    @click.option(
+        "--jobs",
+        type=click.IntRange(min=0),
+        default=0,
+        show_default=True,
+        help="Search with this many processes (0 for one per CPU).",
+    )
+    @click.option("--seed", type=click.INT, help="Seed the search to repeat it.")
+    @click.option(
+        "--keep-shape",
+        is_flag=True,
+        help="Only swap letters, keeping the starting layout's row lengths.",
+    )
+    @click.option(
+        "--corpus",
+        type=click.Path(exists=True, dir_okay=False),
+        help="""
+            Weight letters by how common they are in this text file
+            (default: the Python documentation that comes with Python).
+            """,
+    )
+    @click.option(
+        "--uniform",
+        is_flag=True,
+        help="Weight every letter the same instead.",
+    )
+    @click.option(
+        "-o",
+        "--output",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the best layout here (put it in layouts/ to use it with -k).",
+    )
+    @click.option(
+        "--reversible",
+        "direction",
+        flag_value="R",
+        default=True,
+        help="""[DEFAULT] Score ciphertext made with --reversible""",
+    )
+    @click.option(
+        "--encrypt",
+        "direction",
+        flag_value="E",
+        help="""Score ciphertext made with --encrypt""",
+    )
+    @click.option(
+        "--decipher",
+        "direction",
+        flag_value="D",
+        help="""Score ciphertext made with --decipher""",
+    )
+    def design(
+        layout: str,
+        objective: str,
+        steps: int,
+        chains: int,
+        jobs: int,
+        seed: int,
+        keep_shape: bool,
+        corpus: str,
+        uniform: bool,
+        output: str,
+        direction: chr,
+    ) -> None:
+        """
+        Searches for the layout with the best score for --objective
+        """
+        c = load_cipher(layout)
+        rows = split_rows(c.alphabet, c.row_lengths)
+        frequencies = None
+        if not uniform:
+            if corpus is None:
+                from ngram import default_corpus
+
+                text = default_corpus()
+            else:
+                with open(corpus, encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            frequencies = letter_frequencies(text, c.alphabet)
+        scorer = Scorer(objective, frequencies, direction, c.reverse)
+        jobs = jobs or os.cpu_count()
+        t0 = time.perf_counter()
+        found = search(
+            rows, scorer, chains or jobs, steps, seed, 0 if keep_shape else 0.1, jobs
+        )
+        elapsed = time.perf_counter() - t0
+        evaluated = sum(d.evaluated for d in found)
+        p(f"{scorer.score(rows):.4f}\t{' '.join(rows)}\t(-k {c.layout})")
+        for d in found:
+            p(str(d))
+        e(
+            f"{evaluated} layouts in {elapsed:.1f}s "
+            f"({evaluated / elapsed * 60:,.0f} a minute)"
+        )
+        if output:
+            with open(output, "w") as f:
+                f.write("\n".join(found[0].rows) + "\n")
+
+    design()
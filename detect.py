@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import math
+import time
+from collections import Counter
+from typing import *
+
+from cipher import *
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see bigram_scores
+    np = None
+
+"""
+Guesses the layout and direction of shark ciphertext from the ciphertext alone.
+
+For every layout and direction, the chance of each ciphertext letter
+following each other one is worked out in advance from English bigram counts
+and the layout's adjacency matrix: with A[x, y] the chance that cleartext x
+becomes y (one over the number of x's possibilities, for each of them), the
+ciphertext bigrams are distributed as A.T @ B @ A for the cleartext bigrams
+B.  Scoring a message is then one count of its letters and bigrams and a
+sum over each 26x26 table, which takes a few milliseconds for all the
+layouts together.
+"""
+
+# English bigram counts, rows for the first letter and columns for the
+# second, as round(2 * log2(count + 1)) in base 36
+BIGRAMS: str = """
+0jkh8cf2j0enko0h4nnoigbeh7
+h6d9k000gk0j53ga0ed8j000i0
+l0g6m00ki0hl76ma3hami00090
+fc7em000k20d24g006hah622c0
+jemnikgcf23klo7kioom5hgmi0
+h302gf50k05e20l70h3fi000b0
+d670k4cfg00f9ga60ffdh20000
+l000p203k007a3k00e5d800080
+hikiiki0a0cjjpng6hnn0h0c0e
+5030k000000000600000a00000
+9050i272d005072b07c2a08000
+l48hng60l23l65ka08iijab0j0
+lg34n200g035f8jk08ech00090
+l8lmlcmbi36geela06lnhf52f5
+dkikdld0e0ehkpgj0nhlkgi767
+k06dl50ag06k57ji0lcjc020g2
+00000000000000000000i00000
+mbehobi5m2abijkd0ikihad4h0
+g0h6na2hl3ag99ii72mnk080g0
+m8fao80qo00fd7ma0lkkj6e3j0
+hggdk9f0i03kjkai0jkk000000
+k000k000h00080d00022200000
+g005f00jk0090cg00cc0006003
+e0i4g005e000208i008f003960
+4690a000d0079fci00fg03e000
+a000f400800000400020000020
+"""
+
+# the direction that undoes ciphertext made in each direction
+DECODE_WITH: Dict[chr, chr] = {"R": "R", "E": "D", "D": "E"}
+
+
+def english_bigrams() -> List[List[float]]:
+    """The joint probability of each pair of letters in English, smoothed"""
+    counts = [[2 ** (int(v, 36) / 2) - 1 + 0.5 for v in row] for row in BIGRAMS.split()]
+    total = sum(map(sum, counts))
+    return [[v / total for v in row] for row in counts]
+
+
+def adjacency(table: NeighborTable) -> List[List[float]]:
+    """
+    A[x][y]: the chance that cleartext letter x (by index in ALPHABET)
+    becomes ciphertext letter y, choosing uniformly among its possibilities
+    """
+    a = [[0.0] * len(ALPHABET) for _ in ALPHABET]
+    for x, ring in table.neighbors.items():
+        if x in ALPHABET and ring:
+            for y in ring:
+                if y in ALPHABET:
+                    a[ALPHABET.index(x)][ALPHABET.index(y)] += 1 / len(ring)
+    return a
+
+
+def bigram_scores(table: NeighborTable) -> Tuple[List[float], List[List[float]]]:
+    """
+    Log probabilities for ciphertext made with table: one per letter, and
+    for each pair of letters how much more (or less) likely they are
+    together than apart
+    """
+    a, b = adjacency(table), english_bigrams()
+    if np is not None:
+        a, b = np.array(a), np.array(b)
+        pairs = (a.T @ b @ a).tolist()
+    else:  # A is sparse, so only walk its nonzero entries
+        links = [[(y, w) for y, w in enumerate(row) if w] for row in a]
+        pairs = [[0.0] * len(ALPHABET) for _ in ALPHABET]
+        for x1, row in enumerate(b):
+            for y1, w1 in links[x1]:
+                out = pairs[y1]
+                for x2, joint in enumerate(row):
+                    for y2, w2 in links[x2]:
+                        out[y2] += w1 * joint * w2
+    singles = [sum(row) for row in pairs]
+    tiny = 1e-12
+    letters = [math.log(s + tiny) for s in singles]
+    together = [
+        [
+            math.log(pairs[y1][y2] + tiny) - letters[y1] - letters[y2]
+            for y2 in range(len(ALPHABET))
+        ]
+        for y1 in range(len(ALPHABET))
+    ]
+    return letters, together
+
+
+class Guess(NamedTuple):
+    """
+    One layout and direction with its score for a message
+
+    direction is the one the ciphertext was made with; decode with
+    DECODE_WITH[direction].  confidence is the share of the probability
+    among all the guesses scored together.
+    """
+
+    layout: str
+    direction: chr
+    score: float  # log likelihood of the ciphertext
+    confidence: float
+
+    def __str__(self) -> str:
+        return f"{self.layout} {self.direction} {self.confidence:.1%}"
+
+
+class Detector:
+    """
+    Scores ciphertext against every layout and direction
+
+    The tables are built once per layout and direction, so keep a
+    Detector around to score many messages.
+    """
+
+    def __init__(self, layouts: Sequence[str] = None):
+        self.tables: Dict[Tuple[str, chr], Tuple[List[float], List[List[float]]]] = {}
+        for layout in layouts or available_layouts():
+            try:
+                c = load_cipher(layout)
+            except (AssertionError, ValueError, OSError):
+                continue  # not a complete layout
+            for direction in "RED":
+                self.tables[c.layout, direction] = bigram_scores(c.tables[direction])
+
+    def rank(self, ciphertext: str) -> List[Guess]:
+        """Every layout and direction for the ciphertext, most likely first"""
+        text = ciphertext.lower()
+        index = {ch: i for i, ch in enumerate(ALPHABET)}
+        codes = [index.get(ch, -1) for ch in text]
+        singles = Counter(i for i in codes if i >= 0)
+        pairs = Counter((a, b) for a, b in zip(codes, codes[1:]) if a >= 0 and b >= 0)
+        scores: Dict[Tuple[str, chr], float] = {
+            key: sum(letters[i] * n for i, n in singles.items())
+            + sum(together[a][b] * n for (a, b), n in pairs.items())
+            for key, (letters, together) in self.tables.items()
+        }
+        best = max(scores.values(), default=0.0)
+        total = sum(math.exp(s - best) for s in scores.values())
+        return sorted(
+            (
+                Guess(layout, direction, s, math.exp(s - best) / total)
+                for (layout, direction), s in scores.items()
+            ),
+            key=lambda g: -g.score,
+        )
+
+    def detect(self, ciphertext: str) -> Guess:
+        """The most likely layout and direction for the ciphertext"""
+        return self.rank(ciphertext)[0]
+
+
+_detector: Optional[Detector] = None
+
+
+def detect(ciphertext: str) -> Guess:
+    """Detector.detect with a Detector for every layout, built on first use"""
+    global _detector
+    if _detector is None:
+        _detector = Detector()
+    return _detector.detect(ciphertext)
+
+
+if __name__ == "__main__":
+    # cli.py imports this module for -k auto, which should not need Click
+    import click
+
+    @click.command()
+    @click.argument("text", type=click.File(), nargs=1)
+    @click.option(
+        "-n",
+        "--results",
+        type=click.IntRange(min=1),
+        default=5,
+        show_default=True,
+        help="How many guesses to list.",
+    )
+    def detect_cli(text, results: int) -> None:
+        """
+        Lists the most likely layouts and directions for the ciphertext in TEXT
+        """
+        content = text.read()
+        t0 = time.perf_counter()
+        detector = Detector()
+        t1 = time.perf_counter()
+        guesses = detector.rank(content)
+        t2 = time.perf_counter()
+        for g in guesses[:results]:
+            p(
+                f"{g.confidence:7.1%}  -k {g.layout} {direction_flags[g.direction]}"
+                f"  (decode with {direction_flags[DECODE_WITH[g.direction]]})"
+            )
+        e(f"tables {t1 - t0:.3f}s, scoring {t2 - t1:.4f}s")
+
+    detect_cli()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import click
+
 from cipher import *
 
 """
@@ -9,15 +11,18 @@ ensure proper linking
 
 
 @click.command()
-@click.argument(
-    "layout",
-    type=click.Choice(
-        os.listdir(os.path.join(os.path.dirname(__file__), "layouts")),
-        case_sensitive=False,
-    ),
-    nargs=1,
-)
+@click.argument("layout", nargs=1)
 def draw(layout) -> None:
+    """
+    Draws LAYOUT, one of the files in the layouts directory
+    """
+    # checked here rather than with a click.Choice, which would list the
+    # layouts directory on every import
+    layouts = available_layouts()
+    if layout.lower() not in [name.lower() for name in layouts]:
+        raise click.BadParameter(
+            f"{layout!r} is not one of {', '.join(layouts)}.", param_hint="LAYOUT"
+        )
     c = Cipher(layout)
     c.draw_keyboard()
 
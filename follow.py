@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from typing import *
+
+from cipher import *
+from stream import CHUNK_SIZE, LineCutter, Segment, encode_batch
+
+"""
+Follows a growing file (like tail -f) and encodes what is appended to it.
+
+Only whole lines are encoded, unless the unfinished line at the end of the
+file grows past chunk_size bytes, in which case it is encoded a chunk at a
+time just like --stream does.  After each block of output, the Follower's
+state can be saved to a checkpoint file:
+
+* offset: how many bytes of the file have been encoded;
+* position and line_start: the LineCutter's place in an unfinished line, so
+  --fixed picks up at the right point in the rotation;
+* segments: how many Segments have been encoded, which numbers the
+  generators --seed gives each of them;
+* device and inode: which file it was, to notice when a log is rotated.
+
+Starting again from the checkpoint carries on exactly where it stopped, and
+nothing before offset is read again.  Output is written before the
+checkpoint is, so a crash in between repeats a block rather than losing it.
+"""
+
+CHECKPOINT_VERSION: int = 1
+# how long to wait for more of the file, in seconds
+INTERVAL: float = 0.5
+
+
+class Follower:
+    """
+    The state of following one file with one set of shark settings
+
+    Pass checkpoint, the path of a checkpoint file, to start from (and save
+    to) it; one made with other settings is refused with a ValueError.
+    """
+
+    def __init__(
+        self,
+        c: Cipher,
+        path: str,
+        checkpoint: str = None,
+        drop: bool = True,
+        direction: chr = "R",
+        rnd: bool = True,
+        start: int = 0,
+        jump: int = 1,
+        only_one: bool = False,
+        barrier: str = "-",
+        chunk_size: int = CHUNK_SIZE,
+        seed: Optional[int] = None,
+    ):
+        self.cipher: Cipher = c
+        self.path: str = os.path.abspath(path)
+        self.checkpoint: Optional[str] = checkpoint
+        self.chunk_size: int = chunk_size
+        self.seed: Optional[int] = seed
+        self.options: Tuple = (direction, rnd, start, jump, only_one, barrier)
+        self.settings: Dict[str, Any] = {
+            "path": self.path,
+            "layout": c.layout,
+            "reverse": c.reverse,
+            "drop": drop,
+            "options": list(self.options),
+            "chunk_size": chunk_size,
+            "seed": seed,
+        }
+        self.cutter: LineCutter = LineCutter(c, drop)
+        self.offset: int = 0
+        self.segments: int = 0
+        self.file_id: Optional[Tuple[int, int]] = None
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.load()
+
+    def load(self) -> None:
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise ValueError(f"{self.checkpoint} is not a checkpoint this can read")
+        if state["settings"] != self.settings:
+            raise ValueError(
+                f"{self.checkpoint} was made following {state['settings']['path']} "
+                f"with other settings"
+            )
+        self.offset = state["offset"]
+        self.cutter.position = state["position"]
+        self.cutter.line_start = state["line_start"]
+        self.segments = state["segments"]
+        self.file_id = (state["device"], state["inode"])
+
+    def save(self) -> None:
+        """Writes the state to the checkpoint file, if there is one"""
+        if self.checkpoint is None:
+            return
+        device, inode = self.file_id or (0, 0)
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "settings": self.settings,
+            "offset": self.offset,
+            "position": self.cutter.position,
+            "line_start": self.cutter.line_start,
+            "segments": self.segments,
+            "device": device,
+            "inode": inode,
+        }
+        tmp = f"{self.checkpoint}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.checkpoint)  # atomic, so a crash leaves the old one
+
+    def _restart(self, reason: str) -> None:
+        e(f"{self.path} {reason}, so starting again from its beginning")
+        self.offset = 0
+        self.cutter.position, self.cutter.line_start = 0, True
+
+    def poll(self) -> Iterator[str]:
+        """
+        Yields the output for everything appended since the last poll, a
+        block at a time; the state has moved past each block when it is
+        yielded (so save after writing it out)
+        """
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return  # rotated away and not created again yet
+        file_id = (st.st_dev, st.st_ino)
+        if self.file_id is not None and file_id != self.file_id:
+            self._restart("was replaced")
+        elif st.st_size < self.offset:
+            self._restart("got shorter")
+        self.file_id = file_id
+        block = max(4 * self.chunk_size, 1 << 20)
+        with open(self.path, "rb") as f:
+            while True:
+                f.seek(self.offset)
+                data = f.read(block)
+                segs, consumed = self._segments(data)
+                if not consumed:
+                    return
+                self.offset += consumed
+                output = self._encode(segs)
+                if output:
+                    yield output
+
+    def _segments(self, data: bytes) -> Tuple[List[Segment], int]:
+        """The Segments in data and how many of its bytes they used"""
+        cut = self.cutter.cut
+        segs: List[Segment] = []
+        consumed = 0
+        while (end := data.find(b"\n", consumed)) >= 0:
+            segs.append(cut(data[consumed:end].decode("utf-8", "replace"), True))
+            consumed = end + 1
+        rest = data[consumed:]
+        if len(rest) >= self.chunk_size:
+            # a long unfinished line: send what is there, but not a partial
+            # character or trailing whitespace (which may yet end the line)
+            for size in range(len(rest), len(rest) - 4, -1):
+                try:  # the last character may be cut short
+                    piece = rest[:size].decode("utf-8").rstrip()
+                    size = len(piece.encode("utf-8"))
+                    break
+                except UnicodeDecodeError:
+                    continue
+            else:  # not UTF-8 at all, so take it as it is
+                piece, size = rest.decode("utf-8", "replace"), len(rest)
+            if piece:
+                seg = cut(piece, False)
+                consumed += size
+                if seg.text:
+                    segs.append(seg)
+        return segs, consumed
+
+    def _encode(self, segs: List[Segment]) -> str:
+        if not segs:
+            return ""
+        first, self.segments = self.segments, self.segments + len(segs)
+        if self.seed is None:
+            return encode_batch(self.cipher, first, segs, self.options)
+        # one generator per Segment, so the output does not depend on how
+        # many lines each poll happened to find
+        return "".join(
+            encode_batch(self.cipher, first + i, [seg], self.options, self.seed)
+            for i, seg in enumerate(segs)
+        )
+
+
+def follow_shark(
+    follower: Follower,
+    out: TextIO,
+    interval: float = INTERVAL,
+    stop: Callable[[], bool] = None,
+) -> None:
+    """
+    Writes the output for the file as it grows, until stop() (checked after
+    each poll) says otherwise or the process is interrupted
+    """
+    while True:
+        for block in follower.poll():
+            out.write(block)
+            out.flush()
+            follower.save()
+        if stop is not None and stop():
+            return
+        time.sleep(interval)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+from typing import *
+
+from cipher import *
+from stream import CHUNK_SIZE, read_blocks
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see PatternSet.search
+    np = None
+
+"""
+Finds where cleartext patterns could be hiding in ciphertext, without
+decoding it.
+
+A pattern could be at a position when every letter of it could have turned
+into the ciphertext character it lines up with, which is to say that it is
+among that character's candidates when the grid is decoded (see
+ngram.lattice).  Like recover.py, this is a shift-and search: every
+ciphertext character has a bitmask of the pattern positions it could stand
+in, and all the patterns are packed into one bitmask so that a single pass
+finds every one of them.
+
+Files are read a block at a time (memory-mapped when they are regular
+files).  With NumPy and an ASCII layout, each block is searched with the
+same masks turned around: one pattern letter at a time across every
+position of the block, starting from the pickiest letter and only looking
+further at the positions that are still in the running.
+"""
+
+
+class Hit(NamedTuple):
+    """
+    A place where a pattern could be the cleartext
+
+    line and column are counted from 0; column and offset are in bytes, from
+    the start of the line and of the file.  text is the ciphertext there.
+    """
+
+    path: str
+    line: int
+    column: int
+    offset: int
+    pattern: str
+    text: str
+
+    def __str__(self) -> str:
+        return (
+            f"{self.path}:{self.line + 1}:{self.column + 1}:{self.pattern}:{self.text}"
+        )
+
+
+class PatternSet:
+    """
+    The shift-and masks for finding any of some cleartext patterns in
+    ciphertext that was made with direction
+
+    masks[y] has a bit set for every pattern position whose letter could be
+    under ciphertext character y; each pattern has a run of bits of its own,
+    starting at the bit in starts and ending at the one in ends.  Patterns
+    are normalized like the ciphertext they are compared with, so pass drop
+    for ciphertext made with --strip.
+    """
+
+    def __init__(
+        self,
+        c: Cipher,
+        patterns: Sequence[str],
+        direction: chr = "R",
+        drop: bool = False,
+    ):
+        self.direction: chr = direction.upper().strip()[0]
+        table: NeighborTable = c.tables[self.direction]
+        self.patterns: List[str] = [c.normalize(pattern, drop) for pattern in patterns]
+        if not all(self.patterns):
+            raise ValueError("A pattern has nothing left to look for")
+        # a cleartext letter could be under any letter it could have turned
+        # into (the ones whose deciphers_to, or surround, it is in)
+        n = table.neighbors
+        self.masks: Dict[chr, int] = {}
+        self.starts: int = 0
+        self.ends: int = 0
+        # the first bit of each pattern, and which pattern ends at each end bit
+        self.offsets: List[int] = []
+        self._ending: Dict[int, int] = {}
+        bit = 0
+        for k, pattern in enumerate(self.patterns):
+            self.offsets.append(bit)
+            self.starts |= 1 << bit
+            for x in pattern:
+                for y in set(n.get(x) or x):
+                    # the ciphertext is compared before it is lower-cased
+                    for case in {y, y.upper()} if len(y.upper()) == 1 else {y}:
+                        self.masks[case] = self.masks.get(case, 0) | 1 << bit
+                bit += 1
+            self.ends |= 1 << (bit - 1)
+            self._ending[bit - 1] = k
+        self.longest: int = max(map(len, self.patterns))
+        self._bytes = None
+        if np is not None and table.ascii and all(p.isascii() for p in self.patterns):
+            # per pattern, which bytes each of its letters could be under
+            self._bytes = []
+            for k, pattern in enumerate(self.patterns):
+                allowed = np.zeros((len(pattern), 256), dtype=bool)
+                for y, mask in self.masks.items():
+                    if ord(y) < 128:
+                        for i in range(len(pattern)):
+                            allowed[i, ord(y)] = mask >> (self.offsets[k] + i) & 1
+                # the pickiest letters first, so the fewest positions survive
+                order = np.argsort(allowed.sum(axis=1), kind="stable")
+                self._bytes.append((allowed, order))
+
+    def scan(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yields (position, pattern number) for every match in text as it ends"""
+        get = self.masks.get
+        starts, ends = self.starts, self.ends
+        state = 0
+        for j, y in enumerate(text):
+            state = ((state << 1) | starts) & get(y, 0)
+            if state & ends:
+                done = state & ends
+                while done:
+                    low = done & -done
+                    k = self._ending[low.bit_length() - 1]
+                    yield j - len(self.patterns[k]) + 1, k
+                    done ^= low
+
+    def _block(self, buf: "np.ndarray", upto: int) -> Tuple["np.ndarray", ...]:
+        """
+        The positions and pattern numbers of the matches in buf that start
+        before upto, in order
+        """
+        positions, numbers = [], []
+        for k, (allowed, order) in enumerate(self._bytes):
+            n = min(upto, len(buf) - len(allowed) + 1)
+            if n <= 0:
+                continue
+            first = order[0]
+            at = np.flatnonzero(allowed[first][buf[first : first + n]])
+            for i in order[1:]:
+                if not at.size:
+                    break
+                at = at[allowed[i][buf[at + i]]]
+            positions.append(at)
+            numbers.append(np.full(len(at), k))
+        if not positions:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        positions, numbers = np.concatenate(positions), np.concatenate(numbers)
+        ordered = np.lexsort((numbers, positions))
+        return positions[ordered], numbers[ordered]
+
+    def _blocks(
+        self, binary: BinaryIO, chunk_size: int
+    ) -> Iterator[Tuple[bytes, int, int]]:
+        """
+        Yields (data, base, upto) for each block of binary: data starts base
+        bytes into the file, and the matches starting before upto belong to
+        this block (any after it might go on into the next one)
+        """
+        keep = self.longest - 1
+        base, data = 0, b""
+        for block in read_blocks(binary, chunk_size):
+            data += block
+            upto = max(len(data) - keep, 0)
+            yield data, base, upto
+            base, data = base + upto, data[upto:]
+        if data:
+            yield data, base, len(data)
+
+    def count(self, binary: BinaryIO, chunk_size: int = CHUNK_SIZE) -> int:
+        """How many matches there are in a binary file"""
+        if self._bytes is None:
+            return sum(1 for _ in self._search_lines(binary, "-"))
+        found = 0
+        for data, base, upto in self._blocks(binary, chunk_size):
+            found += len(self._block(np.frombuffer(data, dtype=np.uint8), upto)[0])
+        return found
+
+    def search(
+        self, binary: BinaryIO, path: str = "-", chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[Hit]:
+        """Yields a Hit for every match in a binary file, in order"""
+        if self._bytes is None:
+            yield from self._search_lines(binary, path)
+            return
+        line, start = 0, 0  # the line that base is in, and where it starts
+        for data, base, upto in self._blocks(binary, chunk_size):
+            buf = np.frombuffer(data, dtype=np.uint8)
+            newlines = np.flatnonzero(buf[:upto] == 10)
+            positions, numbers = self._block(buf, upto)
+            if len(positions):
+                before = np.searchsorted(newlines, positions)
+                # where the line of each match starts (-1 for the line of base)
+                starts = np.concatenate(([-1], newlines))[before] + 1
+                for j, k, n, s in zip(
+                    positions.tolist(),
+                    numbers.tolist(),
+                    before.tolist(),
+                    starts.tolist(),
+                ):
+                    pattern = self.patterns[k]
+                    text = data[j : j + len(pattern)].decode("ascii", "replace")
+                    column = j - s if n else base + j - start
+                    yield Hit(path, line + n, column, base + j, pattern, text)
+            if len(newlines):
+                line, start = line + len(newlines), base + int(newlines[-1]) + 1
+
+    def _search_lines(self, binary: BinaryIO, path: str) -> Iterator[Hit]:
+        offset = 0
+        for number, raw in enumerate(binary):
+            line = raw.decode("utf-8", "replace")
+            for j, k in sorted(self.scan(line)):
+                pattern = self.patterns[k]
+                column = len(line[:j].encode("utf-8"))
+                text = line[j : j + len(pattern)]
+                yield Hit(path, number, column, offset + column, pattern, text)
+            offset += len(raw)
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.argument("pattern", type=click.STRING)
+    @click.argument("files", type=click.File("rb"), nargs=-1)
+    @click.option(
+        "-e",
+        "--pattern",
+        "more",
+        multiple=True,
+        help=(
+            "Another pattern to look for at the same time "
+            "(can be given more than once)."
+        ),
+    )
+    @click.option(
+        "-k",
+        "--layout",
+        default="QWERTY",
+        type=click.STRING,
+        show_default=True,
+        help="The layout the ciphertext was made with.",
+    )
+    @click.option(
+        "--strip",
+        is_flag=True,
+        help="""
+            The ciphertext was made with --strip, so leave everything outside the
+            layout (such as spaces) out of the patterns.
+            """,
+    )
+    @click.option(
+        "-c",
+        "--count",
+        is_flag=True,
+        help="Only print how many matches each file has.",
+    )
+    @click.option(
+        "--reversible",
+        "direction",
+        flag_value="R",
+        default=True,
+        help="""[DEFAULT] Search ciphertext made with --reversible""",
+    )
+    @click.option(
+        "--encrypt",
+        "direction",
+        flag_value="E",
+        help="""Search ciphertext made with --encrypt""",
+    )
+    @click.option(
+        "--decipher",
+        "direction",
+        flag_value="D",
+        help="""Search ciphertext made with --decipher""",
+    )
+    def grep(
+        pattern: str,
+        files: Tuple[BinaryIO, ...],
+        more: Tuple[str, ...],
+        layout: str,
+        strip: bool,
+        count: bool,
+        direction: chr,
+    ) -> None:
+        """
+        Prints every place in FILES (or stdin) where PATTERN could be the
+        cleartext, as file:line:column:pattern:ciphertext
+
+        FILES are --only-one ciphertext, --fixed or --random: it does not matter
+        which possibility each letter took.  Give the direction it was made
+        with.
+        """
+        try:
+            patterns = PatternSet(
+                load_cipher(layout), (pattern,) + more, direction, strip
+            )
+        except ValueError as x:
+            raise click.BadParameter(str(x), param_hint="PATTERN")
+        for binary in files or (click.open_file("-", "rb"),):
+            path = getattr(binary, "name", "-")
+            path = "-" if not isinstance(path, str) or path.startswith("<") else path
+            if count:
+                p(f"{path}:{patterns.count(binary)}")
+                continue
+            for hit in patterns.search(binary, path):
+                p(str(hit))
+
+    grep()
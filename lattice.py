@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import stat
+import struct
+from typing import *
+
+from cipher import *
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see LatticeWriter and LatticeLine
+    np = None
+
+"""
+A compact binary form of the shark grid for other tools to read.
+
+Rather than up to eight rows of text per line, every position gets one
+bitmask of all its candidates: bit i is set when the header's alphabet[i] is
+one of the letters the ciphertext letter there could stand for.  Characters
+outside the layout (kept with --include) have a mask of 0 and stand for
+themselves.  The file is written a line at a time, so it can be streamed,
+and every column is aligned, so a memory-mapped file can be read in place:
+
+    MAGIC, header size (uint32), JSON header (layout, reverse, direction,
+    alphabet, width), then for each line of input:
+        positions (uint32), text bytes (uint32),
+        masks (width bytes each, little-endian),
+        the ciphertext as UTF-8, padded with zeros to a multiple of 4 bytes
+
+width is 4 for layouts of up to 32 letters and 8 above that.
+"""
+
+MAGIC: bytes = b"SHRKLAT1"
+RECORD: struct.Struct = struct.Struct("<II")
+
+
+def _padding(size: int) -> int:
+    return -size % 4
+
+
+def _letter_mask(bits: Dict[chr, int], letters: str) -> int:
+    mask: int = 0
+    for ch in letters:
+        mask |= bits.get(ch, 0)
+    return mask
+
+
+class LatticeLine(NamedTuple):
+    """One line of a lattice file: its ciphertext and a mask per position"""
+
+    text: str
+    masks: Sequence[int]
+    alphabet: str
+
+    def candidates(self) -> List[str]:
+        """
+        The candidate letters at each position, in alphabet order, as
+        ngram.lattice gives them (a character outside the layout is its
+        own only candidate)
+        """
+        letters = self.alphabet
+        found: List[str] = []
+        for ch, mask in zip(self.text, self.masks):
+            mask = int(mask)
+            if not mask:
+                found.append(ch)
+                continue
+            options = []
+            while mask:
+                low = mask & -mask
+                options.append(letters[low.bit_length() - 1])
+                mask ^= low
+            found.append("".join(options))
+        return found
+
+
+class LatticeWriter:
+    """
+    Writes the lattice of each line of ciphertext to a binary file
+
+    The masks come from the Cipher's neighbors in direction, the same
+    letters the grid would show for that direction.
+    """
+
+    def __init__(
+        self, c: Cipher, binary: BinaryIO, direction: chr = "R", strip: bool = True
+    ):
+        self.cipher: Cipher = c
+        self.binary: BinaryIO = binary
+        self.strip: bool = strip
+        self.direction: chr = direction.upper().strip()[0]
+        neighbors: Dict[chr, str] = c.tables[self.direction].neighbors
+        self.alphabet: str = "".join(c.letter_index)
+        bits: Dict[chr, int] = {ch: 1 << i for i, ch in enumerate(self.alphabet)}
+        self.masks: Dict[chr, int] = {
+            ch: _letter_mask(bits, options) for ch, options in neighbors.items()
+        }
+        self.width: int = 4 if len(self.alphabet) <= 32 else 8
+        assert len(self.alphabet) <= 64, "Too many letters for a lattice file"
+        self._format: chr = "I" if self.width == 4 else "Q"
+        self._table = None
+        if np is not None and all(ord(ch) < 256 for ch in self.masks):
+            # masks by byte value, for turning ASCII text into masks in one go
+            self._table = np.zeros(256, dtype=f"<u{self.width}")
+            for ch, mask in self.masks.items():
+                self._table[ord(ch)] = mask
+        header = {
+            "layout": c.layout,
+            "reverse": c.reverse,
+            "direction": self.direction,
+            "alphabet": self.alphabet,
+            "width": self.width,
+        }
+        encoded = json.dumps(header).encode()
+        # pad the header so that every record starts 4-byte aligned
+        encoded += b" " * _padding(len(MAGIC) + 4 + len(encoded))
+        binary.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+
+    def write(self, line: str) -> None:
+        """Writes the lattice of one line of ciphertext (normalized here)"""
+        text = self.cipher.normalize(line, self.strip)
+        raw = text.encode("utf-8")
+        if self._table is not None and text.isascii():
+            masks = self._table[np.frombuffer(raw, dtype=np.uint8)].tobytes()
+        else:
+            get = self.masks.get
+            masks = struct.pack(
+                f"<{len(text)}{self._format}", *(get(ch, 0) for ch in text)
+            )
+        self.binary.write(
+            RECORD.pack(len(text), len(raw)) + masks + raw + b"\0" * _padding(len(raw))
+        )
+
+    def write_all(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+
+class LatticeReader:
+    """
+    Reads a lattice file back, one LatticeLine per line of the input
+
+    Regular files are memory-mapped and, with NumPy, each line's masks are
+    an array over the mapped bytes rather than a copy; anything else (a
+    pipe, stdin) is read through in order.
+    """
+
+    def __init__(self, binary: BinaryIO):
+        self.binary: BinaryIO = binary
+        self.map: Optional[mmap.mmap] = None
+        try:
+            fileno = binary.fileno()
+            if stat.S_ISREG(os.fstat(fileno).st_mode) and os.fstat(fileno).st_size:
+                self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass  # not a file that can be mapped
+        magic = self._read(0, len(MAGIC) + 4)
+        assert magic[: len(MAGIC)] == MAGIC, "Not a lattice file"
+        (size,) = struct.unpack_from("<I", magic, len(MAGIC))
+        self.header: Dict[str, Any] = json.loads(self._read(len(magic), size))
+        self.alphabet: str = self.header["alphabet"]
+        self.width: int = self.header["width"]
+        self._start: int = len(magic) + size
+
+    @classmethod
+    def open(cls, path: str) -> "LatticeReader":
+        return cls(open(path, "rb"))
+
+    def __enter__(self) -> "LatticeReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # masks still in use keep the mapping open until they go
+        self.binary.close()
+
+    def _read(self, at: int, size: int) -> bytes:
+        if self.map is not None:
+            return self.map[at : at + size]
+        data = self.binary.read(size)
+        if len(data) < size:
+            raise EOFError("The lattice file ends in the middle of a line")
+        return data
+
+    def _masks(self, at: int, positions: int) -> Sequence[int]:
+        kind = f"<u{self.width}"
+        if self.map is not None and np is not None:
+            return np.frombuffer(self.map, dtype=kind, count=positions, offset=at)
+        data = self._read(at, positions * self.width)
+        if np is not None:
+            return np.frombuffer(data, dtype=kind)
+        return struct.unpack(f"<{positions}{'I' if self.width == 4 else 'Q'}", data)
+
+    def __iter__(self) -> Iterator[LatticeLine]:
+        at = self._start
+        while True:
+            if self.map is not None:
+                if at >= len(self.map):
+                    return
+                head = self.map[at : at + RECORD.size]
+            else:
+                head = self.binary.read(RECORD.size)
+                if not head:
+                    return
+            if len(head) < RECORD.size:
+                raise EOFError("The lattice file ends in the middle of a line")
+            positions, size = RECORD.unpack(head)
+            at += RECORD.size
+            masks = self._masks(at, positions)
+            at += positions * self.width
+            text = self._read(at, size + _padding(size))[:size].decode("utf-8")
+            at += size + _padding(size)
+            yield LatticeLine(text, masks, self.alphabet)
+
+
+if __name__ == "__main__":
+    # tools reading lattices with LatticeReader should not need Click
+    import click
+
+    @click.command()
+    @click.argument("lattice", type=click.File("rb"))
+    def show(lattice: BinaryIO) -> None:
+        """
+        Prints each line of a LATTICE file (made with ./cipher.py --lattice) with
+        the candidates for each letter
+        """
+        with LatticeReader(lattice) as reader:
+            p(json.dumps(reader.header))
+            for line in reader:
+                p(" ".join(f"[{options}]" for options in line.candidates()))
+
+    show()
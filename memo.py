@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+from typing import *
+
+from cipher import *
+
+"""
+Remembers --fixed rows, so repeated input is looked up rather than encoded.
+
+Log files and other templated text say the same lines and the same words
+over and over.  A --fixed row depends only on the letters, the Cipher's
+table for the direction, and start and jump (both only modulo the table's
+period), so a RowCache keys the rows of each normalized line on exactly
+that.  Lines longer than long_line are put together from the rows of their
+words (split on spaces), each cached at the phase it lands on modulo the
+lcm of its own letters' ring sizes, so a long line made of familiar words
+is mostly lookups even the first time it is seen.
+
+Both caches are LRUs bounded by how many characters of rows they hold and
+count their hits, misses, and evictions for the caller to read.
+"""
+
+
+def _period(table: NeighborTable, word: str) -> int:
+    """The lcm of the ring sizes of the letters of word"""
+    period = 1
+    for ch in set(word):
+        size = len(table.neighbors.get(ch) or "") or 1
+        period = period * size // gcd(period, size)
+    return period
+
+
+class CacheCounters(NamedTuple):
+    """How one LRU has done so far"""
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int  # in characters of rows held
+
+
+class LRU:
+    """
+    A least-recently-used cache bounded by the total cost of its values
+
+    Values that cost more than the whole capacity are never kept.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        found = self.entries.get(key)
+        if found is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return found[0]
+
+    def put(self, key: Hashable, value: Any, cost: int) -> None:
+        if cost > self.capacity:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        while self.entries and self.size + cost > self.capacity:
+            _, (_, freed) = self.entries.popitem(last=False)
+            self.size -= freed
+            self.evictions += 1
+        self.entries[key] = (value, cost)
+        self.size += cost
+
+    def counters(self) -> CacheCounters:
+        return CacheCounters(
+            self.hits, self.misses, self.evictions, len(self.entries), self.size
+        )
+
+
+class RowCache:
+    """
+    Cached Cipher.encode_text for --fixed output
+
+    lines and words are the capacities, in characters of rows, of the cache
+    of whole lines and of the cache of words within long lines.  One
+    RowCache can be shared by any number of Ciphers and settings, since
+    they are all part of the keys (the Cipher's table for the direction
+    stands for its layout, reversal, and direction).  The normalized text
+    already shows whether non-letters were dropped, so drop is not.
+    """
+
+    def __init__(
+        self, lines: int = 1 << 24, words: int = 1 << 22, long_line: int = 256
+    ):
+        self.lines: LRU = LRU(lines)
+        self.words: LRU = LRU(words)
+        self.long_line: int = long_line
+
+    def encode_text(
+        self,
+        c: Cipher,
+        text: str,
+        drop: bool = True,
+        direction: chr = "r",
+        limit_possibilities: int = 8,
+        start: int = 0,
+        jump: int = 1,
+    ) -> List[str]:
+        """The same as c.encode_text(text, drop, direction, False, ...)"""
+        line = c.normalize(text, drop)
+        return [line] + self.possibilities(
+            c, line, direction, limit_possibilities, start, jump
+        )
+
+    def possibilities(
+        self,
+        c: Cipher,
+        text: str,
+        direction: chr = "r",
+        limit_possibilities: int = 8,
+        start: int = 0,
+        jump: int = 1,
+    ) -> List[str]:
+        """The same as c.possibilities(text, direction, False, ...)"""
+        if direction == "0":
+            return [text]
+        table: NeighborTable = c.tables[direction.upper().strip()[0]]
+        start, jump = start % table.period, jump % table.period
+        key = (table, start, jump, limit_possibilities, text)
+        rows = self.lines.get(key)
+        if rows is None:
+            if len(text) > self.long_line and " " not in table.neighbors:
+                rows = self._from_words(table, text, limit_possibilities, start, jump)
+            else:
+                rows = [
+                    table.row(text, start + r, jump) for r in range(limit_possibilities)
+                ]
+            self.lines.put(key, rows, len(text) * limit_possibilities)
+        return list(rows)
+
+    def _from_words(
+        self, table: NeighborTable, text: str, limit: int, start: int, jump: int
+    ) -> List[str]:
+        pieces: List[List[str]] = [[] for _ in range(limit)]
+        periods: Dict[str, int] = {}
+        at = 0
+        for word in text.split(" "):
+            period = periods.get(word)
+            if period is None:
+                period = periods[word] = _period(table, word)
+            # the first letter of word gets possibility start + at * jump,
+            # and only that modulo the period of its own letters matters
+            phase = (start + at * jump) % period
+            key = (table, phase, jump, limit, word)
+            rows = self.words.get(key)
+            if rows is None:
+                rows = [table.row(word, phase + r, jump) for r in range(limit)]
+                self.words.put(key, rows, len(word) * limit)
+            for row, piece in zip(pieces, rows):
+                row.append(piece)
+            at += len(word) + 1
+        return [" ".join(row) for row in pieces]
+
+    def counters(self) -> Dict[str, CacheCounters]:
+        """The counters of the line cache and the word cache"""
+        return {"lines": self.lines.counters(), "words": self.words.counters()}
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import *
+
+from cipher import *
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, see Decoder
+    np = None
+
+"""
+Decodes shark ciphertext letter by letter with a character n-gram model.
+
+Every ciphertext position could have come from any letter in its
+possibilities (the lattice), so the most probable cleartext is a path
+through the lattice.  Unlike the dictionary solver in unshark.py, nothing
+has to be a known word, which suits names, typos, and jargon.
+
+The model counts n-grams of letters and spaces in a corpus (the Python
+documentation that ships with Python unless another file is given) and
+smooths them with Witten-Bell interpolation.  The Decoder runs Viterbi over
+the lattice keeping the k best paths into every state (the last n - 1
+choices).  With NumPy, the scores of every transition for a block of
+positions are gathered in one go, and each step is a handful of array
+operations over the states.
+"""
+
+SYMBOLS: int = len(ALPHABET) + 1  # the letters and a space
+SPACE: int = len(ALPHABET)
+MAX_ORDER: int = 4
+
+
+def symbol(ch: chr) -> int:
+    """The model's symbol for a character: its letter, or a space"""
+    i = ord(ch) - ord("a")
+    return i if 0 <= i < len(ALPHABET) else SPACE
+
+
+def default_corpus() -> str:
+    """English text that comes with Python: the topics of its help()"""
+    from pydoc_data.topics import topics
+
+    return "\n".join(topics.values())
+
+
+class Reading(NamedTuple):
+    """One decoding of a line and its log probability under the model"""
+
+    score: float
+    text: str
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class CharModel:
+    """
+    A character n-gram model over the letters and a space
+
+    Anything that is not a letter counts as a space, and runs of them as
+    one.  With spaces=False the spaces are left out altogether, which is
+    what ciphertext made with --strip looks like.  logprobs[g] is the log
+    probability of the last symbol of n-gram g given the ones before it,
+    where g numbers the n-gram in base SYMBOLS.
+    """
+
+    def __init__(self, text: str, order: int = 3, spaces: bool = True):
+        if not 2 <= order <= MAX_ORDER:
+            raise ValueError(f"order must be from 2 to {MAX_ORDER}")
+        self.order: int = order
+        self.spaces: bool = spaces
+        ids = self.encode(text)
+        # counts[j][g]: how often the (j + 1)-gram numbered g appears
+        counts: List[Counter] = []
+        grams: List[int] = ids
+        for j in range(order):
+            if j:  # extend each j-gram by the symbol after it
+                grams = [g * SYMBOLS + s for g, s in zip(grams, ids[j:])]
+            counts.append(Counter(grams))
+        # the unigrams, with add-one smoothing
+        total = sum(counts[0].values())
+        probs: List[float] = [
+            (counts[0].get(x, 0) + 1) / (total + SYMBOLS) for x in range(SYMBOLS)
+        ]
+        for j in range(1, order):
+            probs = self._interpolate(counts[j], probs, j)
+        self.logprobs: List[float] = [math.log(v) for v in probs]
+
+    @staticmethod
+    def _interpolate(grams: Counter, lower: List[float], j: int) -> List[float]:
+        """
+        Witten-Bell: P(x | h) = (c(h x) + t(h) P(x | h')) / (c(h) + t(h)),
+        where t(h) is how many different symbols follow h and h' is h
+        without its first symbol
+        """
+        contexts = SYMBOLS**j
+        seen: Counter = Counter()
+        types: Counter = Counter()
+        for g, n in grams.items():
+            seen[g // SYMBOLS] += n
+            types[g // SYMBOLS] += 1
+        shorter = SYMBOLS ** (j - 1)
+        probs: List[float] = []
+        for h in range(contexts):
+            back = (h % shorter) * SYMBOLS
+            c, t = seen.get(h, 0), types.get(h, 0)
+            for x in range(SYMBOLS):
+                p = lower[back + x]
+                if c:
+                    p = (grams.get(h * SYMBOLS + x, 0) + t * p) / (c + t)
+                probs.append(p)
+        return probs
+
+    def encode(self, text: str) -> List[int]:
+        """text as symbols, the way the model was trained"""
+        text = re.sub(r"[^a-z]+", " " if self.spaces else "", text.lower())
+        return [symbol(ch) for ch in text]
+
+    def score(self, text: str) -> float:
+        """The log probability of text, starting after a space"""
+        ids = [SPACE] * (self.order - 1) + self.encode(text)
+        n = self.order
+        return sum(
+            self.logprobs[sum(s * SYMBOLS ** (n - 1 - o) for o, s in enumerate(g))]
+            for g in zip(*(ids[o:] for o in range(n)))
+        )
+
+
+_models: Dict[Tuple[Optional[str], int, bool], CharModel] = {}
+
+
+def load_model(corpus: str = None, order: int = 3, spaces: bool = True) -> CharModel:
+    """A CharModel trained on the file at corpus (or default_corpus), kept for reuse"""
+    key = (corpus, order, spaces)
+    if key not in _models:
+        if corpus is None:
+            text = default_corpus()
+        else:
+            with open(corpus, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        _models[key] = CharModel(text, order, spaces)
+    return _models[key]
+
+
+def lattice(c: Cipher, ciphertext: str, direction: chr = "R") -> List[str]:
+    """
+    The candidate cleartext letters for each position of ciphertext that
+    has been through Cipher.normalize; characters outside the layout are
+    their own only candidate
+    """
+    neighbors = c.tables[direction.upper().strip()[0]].neighbors
+    return ["".join(dict.fromkeys(neighbors.get(ch) or ch)) for ch in ciphertext]
+
+
+class Decoder:
+    """
+    Finds the most probable paths through a lattice under a CharModel
+
+    A path's score is the model's log probability of its letters, starting
+    after a space.  Viterbi keeps the k best paths into each state, the
+    last order - 1 choices, so the k best paths overall are exact.
+    """
+
+    # how many transition scores to gather at once, which bounds the
+    # temporary arrays
+    cells: int = 1 << 21
+    # how many positions (lines times the longest of them) to decode together
+    positions: int = 1 << 16
+
+    def __init__(self, model: CharModel):
+        self.model: CharModel = model
+        if np is not None:
+            # logprobs with one more symbol (SYMBOLS itself) for padding,
+            # which is never a likely next symbol
+            n = model.order
+            table = np.full((SYMBOLS + 1,) * n, -np.inf)
+            table[(slice(0, SYMBOLS),) * n] = np.array(model.logprobs).reshape(
+                (SYMBOLS,) * n
+            )
+            self.table = table.ravel()
+
+    def decode(self, candidates: Sequence[str], k: int = 1) -> List[Reading]:
+        """
+        The k best readings of a lattice (a string of candidate letters
+        for each position), best first
+        """
+        return self.decode_many([candidates], k)[0]
+
+    def decode_many(
+        self, lattices: Sequence[Sequence[str]], k: int = 1
+    ) -> List[List[Reading]]:
+        """
+        Decoder.decode for each of several lattices
+
+        With NumPy, lattices of similar lengths are decoded side by side, so
+        many short lines take about as many steps as the longest of them.
+        """
+        results: List[List[Reading]] = [[Reading(0.0, "")] for _ in lattices]
+        waiting = sorted(
+            (i for i, l in enumerate(lattices) if l), key=lambda i: len(lattices[i])
+        )
+        if np is None:
+            for i in waiting:
+                results[i] = self._decode_python(lattices[i], k)
+            return results
+        group: List[int] = []
+        for i in waiting:
+            if group and (len(group) + 1) * len(lattices[i]) > self.positions:
+                for j, readings in zip(
+                    group, self._decode_numpy([lattices[j] for j in group], k)
+                ):
+                    results[j] = readings
+                group = []
+            group.append(i)
+        if group:
+            for j, readings in zip(
+                group, self._decode_numpy([lattices[j] for j in group], k)
+            ):
+                results[j] = readings
+        return results
+
+    def _decode_numpy(
+        self, lattices: Sequence[Sequence[str]], k: int
+    ) -> List[List[Reading]]:
+        n = self.model.order
+        pad = SYMBOLS
+        lines = len(lattices)
+        lengths = np.array([len(l) for l in lattices])
+        longest = int(lengths.max())
+        width = max(len(options) for l in lattices for options in l)
+        states = width ** (n - 1)
+        inner = width ** (n - 2)
+        # symbols for each position's candidates, after n - 1 leading spaces
+        # (padded out with pad, which nothing can follow, past each line's end)
+        codes = np.frombuffer(
+            "".join(
+                options.ljust(width, "\0")
+                for l in lattices
+                for options in list(l) + [""] * (longest - len(l))
+            ).encode("utf-32-le"),
+            dtype=np.uint32,
+        ).reshape(lines, longest, width)
+        grid = np.full((lines, longest + n - 1, width), pad, dtype=np.int64)
+        grid[:, : n - 1, 0] = SPACE
+        letters = np.where(
+            (codes >= ord("a")) & (codes <= ord("z")), codes - ord("a"), SPACE
+        )
+        letters[codes == 0] = pad
+        grid[:, n - 1 :] = letters
+
+        # scores[line, oldest, middle, rank], the state being the last
+        # n - 1 choices
+        scores = np.full((lines, width, inner, k), -np.inf)
+        scores[:, 0, 0, 0] = 0.0  # all spaces so far
+        finals = np.empty((lines, states, k))
+        kind = np.uint8 if width * k <= 256 else np.uint32
+        back = np.empty((longest, lines, states, k), dtype=kind)
+        block = max(1, self.cells // (lines * width**n))
+        for a in range(0, longest, block):
+            b = min(a + block, longest)
+            # flat[line, t, w_0, …, w_n-1]: the n-gram for those choices at a + t
+            flat = grid[:, a:b]
+            for o in range(1, n):
+                nxt = grid[:, a + o : b + o]
+                flat = flat[..., None] * (SYMBOLS + 1) + nxt.reshape(
+                    (lines, b - a) + (1,) * o + (width,)
+                )
+            # steps[line, t, oldest, middle, newest]
+            steps = self.table[flat].reshape(lines, b - a, width, inner, width)
+            for t in range(b - a):
+                if k == 1:
+                    # the new state (middle, newest) is the next (oldest, middle)
+                    x = steps[:, t] + scores
+                    back[a + t, :, :, 0] = x.argmax(axis=1).reshape(lines, states)
+                    scores = x.max(axis=1).reshape(lines, width, inner, 1)
+                else:
+                    x = steps[:, t, ..., None] + scores[:, :, :, None, :]
+                    x = x.transpose(0, 2, 3, 1, 4).reshape(lines, states, width * k)
+                    best = np.argsort(x, axis=2)[:, :, : -k - 1 : -1]
+                    back[a + t] = best
+                    scores = np.take_along_axis(x, best, 2).reshape(
+                        lines, width, inner, k
+                    )
+                ending = lengths == a + t + 1
+                if ending.any():
+                    finals[ending] = scores[ending].reshape(-1, states, k)
+
+        results: List[List[Reading]] = []
+        step = back.item
+        for line, l in enumerate(lattices):
+            readings: List[Reading] = []
+            for end in np.argsort(-finals[line], axis=None)[:k].tolist():
+                state, rank = divmod(end, k)
+                score = float(finals[line, state, rank])
+                if score == -np.inf:
+                    break
+                text = [""] * len(l)
+                for i in range(len(l) - 1, -1, -1):
+                    text[i] = l[i][state % width]
+                    oldest, rank = divmod(step(i, line, state, rank), k)
+                    state = oldest * inner + state // width
+                readings.append(Reading(score, "".join(text)))
+            results.append(readings)
+        return results
+
+    def _decode_python(self, candidates: Sequence[str], k: int) -> List[Reading]:
+        """The same search one state at a time, for when NumPy is missing"""
+        n = self.model.order
+        logprobs = self.model.logprobs
+        # a state is the last n - 1 symbols, which is all the future depends on;
+        # beams[state] holds the k best (score, previous state, rank there, letter)
+        beams: Dict[Tuple[int, ...], List[Tuple]] = {
+            (SPACE,) * (n - 1): [(0.0, None, 0, "")]
+        }
+        history: List[Dict[Tuple[int, ...], List[Tuple]]] = []
+        for options in candidates:
+            following: Dict[Tuple[int, ...], List[Tuple]] = {}
+            for state, entries in beams.items():
+                context = sum(s * SYMBOLS ** (n - 2 - o) for o, s in enumerate(state))
+                for ch in options:
+                    x = symbol(ch)
+                    step = logprobs[context * SYMBOLS + x]
+                    following.setdefault(state[1:] + (x,), []).extend(
+                        (score + step, state, rank, ch)
+                        for rank, (score, *_) in enumerate(entries)
+                    )
+            beams = {
+                state: heapq.nlargest(k, entries, key=lambda e: e[0])
+                for state, entries in following.items()
+            }
+            history.append(beams)
+        ends = heapq.nlargest(
+            k,
+            (
+                (entries[rank][0], state, rank)
+                for state, entries in beams.items()
+                for rank in range(len(entries))
+            ),
+            key=lambda e: e[0],
+        )
+        readings: List[Reading] = []
+        for score, state, rank in ends:
+            letters: List[str] = []
+            for beams in reversed(history):
+                _, state, rank, ch = beams[state][rank]
+                letters.append(ch)
+            readings.append(Reading(score, "".join(reversed(letters))))
+        return readings
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import os
+import sys
+
+from cipher import load_cipher
+
+"""
+A quick entry point for the most common use: one substitution per line.
+
+    python -m oneline [-k LAYOUT] [--fixed] [--offset N] [-j N] [--include]
+                      [--encrypt | --decipher | --reversible] TEXT
+
+prints exactly what ./cipher.py --only-one does with the same arguments,
+without importing Click (or anything else beyond the cipher), so a short
+call is mostly the time it takes to start Python.  Any other option, a
+--seed, or a mistake in the arguments hands everything over to the full
+shark command, which handles it (and reports errors) as usual.
+"""
+
+# the most time importing this module may take; test.py enforces it
+IMPORT_BUDGET: float = 0.025
+
+# option -> (setting, value); None takes the value from the next argument
+OPTIONS: Dict[str, Tuple[str, Any]] = {
+    "-k": ("layout", None),
+    "--layout": ("layout", None),
+    "--only-one": ("only_one", True),
+    "--random": ("rnd", True),
+    "--fixed": ("rnd", False),
+    "-j": ("jump", None),
+    "--direction": ("jump", None),
+    "--offset": ("start", None),
+    "--start": ("start", None),
+    "--strip": ("strip", True),
+    "--include": ("strip", False),
+    "--reversible": ("direction", "R"),
+    "--encrypt": ("direction", "E"),
+    "--decipher": ("direction", "D"),
+}
+
+
+def parse(args: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    The settings for args, or None for anything the quick path does not
+    handle the same way as the shark command
+    """
+    settings = {"layout": "QWERTY", "rnd": True, "jump": 1, "start": 0}
+    settings.update({"strip": True, "direction": "R", "text": None})
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == "-" or not arg.startswith("-"):
+            if settings["text"] is not None:
+                return None
+            settings["text"] = arg
+            continue
+        # Click only splits --name=value; -j=2 would give -j the value "=2"
+        name, equals, value = (
+            arg.partition("=") if arg.startswith("--") else (arg, "", "")
+        )
+        option = OPTIONS.get(name)
+        if option is None:
+            return None
+        key, constant = option
+        if constant is not None:
+            if equals:
+                return None
+            settings[key] = constant
+            continue
+        if not equals:
+            if not args:
+                return None
+            value = args.pop(0)
+        if key in ("jump", "start"):
+            try:
+                value = int(value)
+            except ValueError:
+                return None
+        settings[key] = value
+    if settings["text"] is None or settings["layout"].lower().strip() == "auto":
+        return None
+    return settings
+
+
+def run(settings: Dict[str, Any]) -> None:
+    """Prints one substitution for each line of the text"""
+    c = load_cipher(settings["layout"])
+    text = settings["text"]
+    lines = sys.stdin if text == "-" else open(text)
+    strip, direction, rnd = settings["strip"], settings["direction"], settings["rnd"]
+    start, jump = settings["start"], settings["jump"]
+    write = sys.stdout.write
+    with lines:
+        for line in lines:
+            cleartext = c.normalize(line, strip)
+            write(c.possibilities(cleartext, direction, rnd, 1, start, jump)[0])
+            write("\n")
+
+
+def can_open(settings: Dict[str, Any]) -> bool:
+    """Whether the layout and text exist (if not, the shark command says so)"""
+    layout = settings["layout"]
+    try:
+        load_cipher(layout)
+    except (OSError, ValueError, AssertionError):
+        return False
+    return settings["text"] == "-" or os.path.isfile(settings["text"])
+
+
+def main(args: List[str] = None) -> None:
+    args = sys.argv[1:] if args is None else args
+    settings = parse(args)
+    if settings is not None and can_open(settings):
+        return run(settings)
+    from cli import shark
+
+    shark(["--only-one", *args])
+
+
+if __name__ == "__main__":
+    main()
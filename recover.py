@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import multiprocessing
+import time
+from functools import reduce
+from typing import *
+
+from cipher import *
+
+"""
+Known-plaintext recovery of the settings behind --fixed ciphertext.
+
+Given ciphertext and a crib (a piece of the cleartext), every layout in the
+layouts directory, both reverse settings, and all three directions are
+tried.  For each one:
+
+* an adjacency bitmask for every ciphertext character says which crib
+  positions it could stand in, so one shift-and pass over each line finds
+  every place the crib could line up;
+* at each of those places, every jump (mod the period of the crib's letters)
+  is tried, ANDing together one bitmask of the starts that fit each crib
+  letter and stopping as soon as none are left.
+
+Every setting that survives is reported with the number of (start, jump)
+pairs that fit and the simplest few of them.
+"""
+
+
+class Match(NamedTuple):
+    """
+    A setting and alignment that the crib is consistent with
+
+    line and position locate the crib in the ciphertext.  The pairs are
+    counted modulo period: start and start + period (or jump and
+    jump + period) give the same ciphertext.
+    """
+
+    layout: str
+    reverse: bool
+    direction: chr
+    line: int
+    position: int
+    period: int
+    count: int
+    examples: Tuple[Tuple[int, int], ...]  # (start, jump), simplest first
+
+    def __str__(self) -> str:
+        settings = ", ".join(f"--offset {s} -j {j}" for s, j in self.examples)
+        more = f" (+{self.count - len(self.examples)} more)" if self.count > 3 else ""
+        flipped = self.reverse != layout_options(self.layout)[1]
+        return (
+            f"{self.layout}{f' (reverse={self.reverse})' if flipped else ''} "
+            f"{direction_flags[self.direction]} "
+            f"line {self.line + 1} column {self.position + 1}: {settings}{more}"
+        )
+
+
+class CribTable:
+    """
+    The bitmasks for finding one crib in ciphertext made with one
+    NeighborTable
+
+    outputs[x] is the set of characters x can turn into (just x itself for
+    characters outside the layout).  shifts[y] has bit i set when crib
+    letter i could have turned into ciphertext character y.
+    """
+
+    def __init__(self, table: NeighborTable, crib: str):
+        self.table: NeighborTable = table
+        self.crib: str = crib
+        n = table.neighbors
+        self.outputs: Dict[chr, str] = {x: n.get(x) or x for x in set(crib)}
+        self.shifts: Dict[chr, int] = {}
+        for i, x in enumerate(crib):
+            for y in set(self.outputs[x]):
+                self.shifts[y] = self.shifts.get(y, 0) | 1 << i
+        # start and jump only matter modulo the crib letters' ring sizes
+        self.period: int = reduce(
+            lambda a, b: a * b // gcd(a, b),
+            [len(n[x]) for x in set(crib) if n.get(x)],
+            1,
+        )
+        self.full: int = (1 << self.period) - 1
+        # the crib letters that constrain start and jump, rarest match first
+        self.checked: List[Tuple[int, chr, int]] = sorted(
+            ((i, x, len(n[x])) for i, x in enumerate(crib) if n.get(x)),
+            key=lambda ixl: -ixl[2],
+        )
+        self._masks: Dict[Tuple[chr, chr, int], int] = {}
+
+    def alignments(self, line: str) -> Iterator[int]:
+        """Yields every position in line where the crib could start"""
+        m = len(self.crib)
+        if not m:
+            return
+        done = 1 << (m - 1)
+        state = 0
+        shifts = self.shifts
+        for j, y in enumerate(line):
+            state = ((state << 1) | 1) & shifts.get(y, 0)
+            if state & done:
+                yield j - m + 1
+
+    def mask(self, x: chr, y: chr, shift: int) -> int:
+        """
+        The starts s (as bits of a period-wide mask) for which letter x
+        turns into y when its possibility index is s + shift
+        """
+        ring = self.table.neighbors[x]
+        size = len(ring)
+        key = (x, y, shift % size)
+        mask = self._masks.get(key)
+        if mask is None:
+            unit = sum(1 << k for k in range(size) if ring[(k + shift) % size] == y)
+            # repeat the size-bit pattern across the whole period
+            mask = unit * (self.full // ((1 << size) - 1))
+            self._masks[key] = mask
+        return mask
+
+    def settings(self, line: str, position: int) -> Tuple[int, List[Tuple[int, int]]]:
+        """
+        Returns how many (start, jump) pairs (mod self.period) make the
+        crib turn into line at position, and the simplest few of them
+        """
+        period = self.period
+        count = 0
+        examples: List[Tuple[int, int]] = []
+        # 0, 1, -1, 2, -2, … so the simplest jumps come first
+        jumps = [0] + [j for k in range(1, period // 2 + 1) for j in (k, -k)]
+        for jump in jumps[:period]:
+            starts = self.full
+            for i, x, size in self.checked:
+                p = position + i
+                starts &= self.mask(x, line[p], p * jump)
+                if not starts:
+                    break
+            if starts:
+                count += bin(starts).count("1")
+                while starts and len(examples) < 3:
+                    low = starts & -starts
+                    examples.append((low.bit_length() - 1, jump))
+                    starts ^= low
+        return count, examples
+
+
+def configurations(layouts: Sequence[str] = None) -> List[Tuple[str, bool, chr]]:
+    """Every (layout, reverse, direction) to try, for every loadable layout"""
+    found = []
+    for layout in layouts or available_layouts():
+        for reverse in (False, True):
+            try:
+                load_cipher(layout, 0, reverse)
+            except (AssertionError, ValueError, OSError):
+                continue  # broken on purpose, or not a layout at all
+            found.extend((layout, reverse, d) for d in "RED")
+    return found
+
+
+def search(
+    configuration: Tuple[str, bool, chr], lines: Sequence[str], crib: str
+) -> List[Match]:
+    """All the Matches for one (layout, reverse, direction)"""
+    layout, reverse, direction = configuration
+    c = load_cipher(layout, 0, reverse)
+    matches: List[Match] = []
+    tables: Dict[bool, CribTable] = {}
+    for number, line in enumerate(lines):
+        line = c.normalize(line, False)
+        # ciphertext made with --strip has nothing outside the layout
+        drop = all(ch in c.letter_index for ch in line)
+        if drop not in tables:
+            tables[drop] = CribTable(c.tables[direction], c.normalize(crib, drop))
+        t = tables[drop]
+        for position in t.alignments(line):
+            count, examples = t.settings(line, position)
+            if count:
+                matches.append(
+                    Match(
+                        layout,
+                        reverse,
+                        direction,
+                        number,
+                        position,
+                        t.period,
+                        count,
+                        tuple(examples),
+                    )
+                )
+    return matches
+
+
+def _search(args: Tuple) -> List[Match]:
+    return search(*args)
+
+
+def recover(
+    lines: Sequence[str],
+    crib: str,
+    layouts: Sequence[str] = None,
+    jobs: int = 1,
+) -> List[Match]:
+    """
+    Returns every Match for the crib in the lines of ciphertext
+
+    Each line is taken to be one --only-one line of output, with its
+    positions counted from 0.  With jobs > 1 the settings are shared out
+    among that many processes.
+    """
+    work = [(conf, list(lines), crib) for conf in configurations(layouts)]
+    if jobs <= 1:
+        found = map(_search, work)
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            found = pool.map(_search, work)
+    return [m for matches in found for m in matches]
+
+
+if __name__ == "__main__":
+    import click
+
+    @click.command()
+    @click.argument("text", type=click.File(), nargs=1)
+    @click.argument("crib", type=click.STRING)
+    @click.option(
+        "-k",
+        "--layout",
+        "layouts",
+        multiple=True,
+        help="Only try this layout (can be given more than once).",
+    )
+    @click.option(
+        "--jobs",
+        type=click.IntRange(min=0),
+        default=0,
+        show_default=True,
+        help="Search with this many processes (0 for one per CPU).",
+    )
+    def recover_cli(text, crib: str, layouts: Tuple[str, ...], jobs: int) -> None:
+        """
+        Finds the settings that could have turned CRIB into part of TEXT
+
+        TEXT is --fixed --only-one ciphertext (use - for stdin).  Every layout,
+        direction, --offset, and -j is tried; the settings that fit are listed
+        with where CRIB lines up.
+        """
+        t0 = time.perf_counter()
+        matches = recover(
+            [line.rstrip("\n") for line in text],
+            crib,
+            layouts,
+            jobs or os.cpu_count(),
+        )
+        for match in matches:
+            p(str(match))
+        e(f"{len(matches)} matches in {time.perf_counter() - t0:.3f}s")
+
+    recover_cli()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import signal
+import stat
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import *
+
+import click
+
+from batch import BatchEngine, batch_engine
+from cipher import *
+from cli import given_direction, run_shark, shark
+from sharkc import parse_address
+
+"""
+A long-running shark service that keeps every layout's Cipher warm.
+
+The server speaks a small subset of HTTP/1.1 with JSON bodies, over a Unix
+socket or localhost TCP (see sharkc.parse_address for the addresses):
+
+* POST /encode {layout, text, direction, random, start, jump, limit, strip,
+  seed} returns {"rows": [...]}, the rows of Cipher.encode_text;
+* POST /decode {layout, text, direction, start, jump} undoes --fixed
+  output: {"text": ..., "candidates": [...]} as Cipher.decode_fixed and
+  Cipher.invert give them;
+* POST /verify {layout, cleartext, ciphertext, direction, strip} returns
+  {"mismatches": [...]}, the positions Cipher.verify rejects;
+* POST /shark {args, cwd, stdin} runs the shark command with those
+  arguments and returns {"stdout", "stderr", "exit"} (what sharkc.py uses);
+* GET /health lists the warm layouts and counts requests and batches.
+
+Requests are read on one asyncio event loop and the work is done on a
+thread pool.  Small --fixed encodes that arrive close together with the
+same layout, direction, jump, and limit are collected for batch_delay
+seconds and encoded in one BatchEngine.encode_many call.
+"""
+
+# the longest text (in characters) that is batched with others
+SMALL: int = 4096
+REASONS: Dict[int, str] = {200: "OK", 400: "Bad Request", 404: "Not Found"}
+# shark options that cannot be run on the server (sharkc.py runs them locally)
+LOCAL_PARAMS: Tuple[str, ...] = (
+    "show_stats",
+    "stats_json",
+    "profile",
+    "write_lattice",
+    "follow",
+)
+
+
+class SharkServer:
+    """
+    Answers encode, decode, verify, and shark requests from warm Ciphers
+
+    layouts (every layout by default) are loaded up front; any other
+    layout is loaded on first use and stays loaded.
+    """
+
+    def __init__(
+        self,
+        layouts: Sequence[str] = None,
+        batch_delay: float = 0.002,
+        batch_size: int = 256,
+        workers: int = None,
+    ):
+        self.batch_delay: float = batch_delay
+        self.batch_size: int = batch_size
+        self.pool = ThreadPoolExecutor(workers)
+        self.layouts: List[str] = []
+        for layout in layouts or available_layouts():
+            try:
+                c = load_cipher(layout)
+            except (AssertionError, ValueError, OSError):
+                continue  # broken on purpose, or not a layout at all
+            for direction in "RED":
+                batch_engine(c, direction)
+            self.layouts.append(c.layout)
+        self.requests: int = 0
+        self.batches: int = 0
+        # (layout, direction, jump, limit) -> [(text, start, future), …]
+        self._pending: Dict[Tuple, List[Tuple[str, int, asyncio.Future]]] = {}
+        # os.chdir is process-wide, so /shark parses its arguments one at a time
+        self._cwd_lock = threading.Lock()
+
+    # --- the operations ---
+
+    async def encode(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        c = load_cipher(body.get("layout", "QWERTY"))
+        direction = body.get("direction", "R").upper()
+        rnd = body.get("random", True)
+        start, jump = body.get("start", 0), body.get("jump", 1)
+        limit = body.get("limit", 8)
+        text = c.normalize(body["text"], body.get("strip", True))
+        if rnd or direction == "0" or len(text) > SMALL:
+            rows = await self._run(
+                c.possibilities,
+                text,
+                direction,
+                rnd,
+                limit,
+                start,
+                jump,
+                random.Random(body["seed"]) if body.get("seed") is not None else None,
+            )
+        else:
+            rows = await self.batched(c, direction, text, start, jump, limit)
+        return {"rows": [text] + rows}
+
+    async def decode(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        c = load_cipher(body.get("layout", "QWERTY"))
+        args = (
+            c.normalize(body["text"], False),
+            body.get("direction", "R").upper(),
+            body.get("start", 0),
+            body.get("jump", 1),
+        )
+        candidates = await self._run(c.invert, *args)
+        return {
+            "text": "".join(ch if len(ch) == 1 else f"[{ch}]" for ch in candidates),
+            "candidates": candidates,
+        }
+
+    async def verify(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        c = load_cipher(body.get("layout", "QWERTY"))
+        strip = body.get("strip", True)
+        mismatches = await self._run(
+            c.verify,
+            c.normalize(body["cleartext"], strip),
+            c.normalize(body["ciphertext"], strip),
+            body.get("direction", "R").upper(),
+        )
+        return {"mismatches": mismatches}
+
+    async def shark(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return await self._run(
+            self.run_cli, body.get("args", []), body.get("cwd"), body.get("stdin", "")
+        )
+
+    async def health(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "layouts": self.layouts,
+            "requests": self.requests,
+            "batches": self.batches,
+        }
+
+    def run_cli(self, args: List[str], cwd: str = None, stdin: str = "") -> Dict:
+        """
+        The shark command run with args (relative paths in them taken from
+        cwd) and its output captured; - reads stdin from the request
+
+        The files are opened by the server, so over TCP any local user who
+        can reach the port can have it read whatever files the server's user
+        can; serve on a Unix socket to keep to the socket's permissions.
+        """
+        out, err = io.StringIO(), io.StringIO()
+        code = 0
+        try:
+            with self._cwd_lock:
+                here = os.getcwd()
+                try:
+                    os.chdir(cwd or here)
+                    ctx = shark.make_context("shark", list(args))
+                    # paths are only opened later, so pin them to cwd now
+                    for param in ctx.command.params:
+                        value = ctx.params.get(param.name)
+                        if isinstance(param.type, click.Path) and value:
+                            ctx.params[param.name] = os.path.abspath(value)
+                finally:
+                    os.chdir(here)
+            with ctx:
+                params = dict(ctx.params, direction=given_direction(ctx))
+                if any([params.pop(name) for name in LOCAL_PARAMS]):
+                    raise click.UsageError(
+                        "run --stats, --profile, --lattice, and --follow locally", ctx
+                    )
+                for name in ("text", "against"):
+                    if getattr(params[name], "name", None) == "<stdin>":
+                        params[name] = io.StringIO(stdin)
+                run_shark(**params, out=out, err=lambda s: err.write(f"{s}\n"))
+        except click.ClickException as x:
+            x.show(err)
+            code = x.exit_code
+        except click.exceptions.Exit as x:
+            code = x.exit_code
+        except OSError as x:
+            err.write(f"Error: {x}\n")
+            code = 1
+        return {"stdout": out.getvalue(), "stderr": err.getvalue(), "exit": code}
+
+    # --- batching ---
+
+    async def batched(
+        self, c: Cipher, direction: chr, text: str, start: int, jump: int, limit: int
+    ) -> List[str]:
+        """
+        Cipher.possibilities for normalized text with --fixed, encoded
+        together with whatever else comes in during the next batch_delay
+        """
+        loop = asyncio.get_running_loop()
+        key = (c.layout, direction, jump, limit)
+        future = loop.create_future()
+        queue = self._pending.setdefault(key, [])
+        queue.append((text, start, future))
+        if len(queue) >= self.batch_size:
+            self._flush(key, c)
+        elif len(queue) == 1:
+            loop.call_later(self.batch_delay, self._flush, key, c)
+        return await future
+
+    def _flush(self, key: Tuple, c: Cipher) -> None:
+        items = self._pending.pop(key, None)
+        if not items:
+            return  # already sent off because the batch filled up
+        self.batches += 1
+        _, direction, jump, limit = key
+        engine = batch_engine(c, direction) or BatchEngine(c, direction)
+        work = asyncio.get_running_loop().run_in_executor(
+            self.pool,
+            partial(
+                engine.encode_many,
+                [text for text, _, _ in items],
+                limit,
+                jump=jump,
+                starts=[start for _, start, _ in items],
+            ),
+        )
+        work.add_done_callback(partial(self._deliver, items))
+
+    @staticmethod
+    def _deliver(items: List[Tuple], work: asyncio.Future) -> None:
+        for i, (_, _, future) in enumerate(items):
+            if future.done():
+                continue  # the client went away
+            if work.exception() is not None:
+                future.set_exception(work.exception())
+            else:
+                future.set_result(work.result()[i])
+
+    async def _run(self, f: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(
+            self.pool, partial(f, *args)
+        )
+
+    # --- HTTP ---
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        """The status and JSON reply for one request"""
+        routes = {
+            ("POST", "/encode"): self.encode,
+            ("POST", "/decode"): self.decode,
+            ("POST", "/verify"): self.verify,
+            ("POST", "/shark"): self.shark,
+            ("GET", "/health"): self.health,
+        }
+        handler = routes.get((method, path))
+        if handler is None:
+            return 404, {"error": f"no {method} {path}"}
+        self.requests += 1
+        try:
+            return 200, await handler(json.loads(body or b"{}"))
+        except (ValueError, KeyError, TypeError, OSError, AssertionError) as x:
+            return 400, {"error": f"{type(x).__name__}: {x}"}
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answers requests on one connection until the client closes it"""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+                headers: Dict[str, str] = {}
+                while (header := await reader.readline()).strip():
+                    name, _, value = header.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, reply = await self.dispatch(method, target.split("?")[0], body)
+                payload = json.dumps(reply).encode()
+                keep = headers.get("connection", "").lower() != "close"
+                head = [
+                    f"HTTP/1.1 {status} {REASONS[status]}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(payload)}",
+                ] + ([] if keep else ["Connection: close"])
+                writer.write("\r\n".join(head + ["", ""]).encode() + payload)
+                await writer.drain()
+                if not keep:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # a broken or malformed request ends the connection
+        finally:
+            writer.close()
+
+    async def start(self, address: str = None) -> asyncio.AbstractServer:
+        """Starts listening at address (see sharkc.parse_address)"""
+        where = parse_address(address)
+        if isinstance(where, tuple):
+            return await asyncio.start_server(self.handle, *where)
+        if os.path.exists(where) and stat.S_ISSOCK(os.stat(where).st_mode):
+            os.unlink(where)  # left behind by a server that did not shut down
+        return await asyncio.start_unix_server(self.handle, where)
+
+    async def serve_forever(self, address: str = None) -> None:
+        server = await self.start(address)
+        async with server:
+            await server.serve_forever()
+
+    @contextmanager
+    def running(self, address: str = None) -> Iterator["SharkServer"]:
+        """Serves from a background thread for the body of a with block"""
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(self.start(address))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+
+@click.command()
+@click.option(
+    "--listen",
+    "address",
+    help="""
+        A Unix socket path, or host:port to serve HTTP over TCP
+        (default: $SHARK_SERVER, or a socket in the temporary directory).
+        """,
+)
+@click.option(
+    "-k",
+    "--layout",
+    "layouts",
+    multiple=True,
+    help="Only load these layouts up front (can be given more than once).",
+)
+@click.option(
+    "--batch-delay",
+    type=click.FloatRange(min=0),
+    default=0.002,
+    show_default=True,
+    help="Seconds to collect small --fixed encodes into one batch.",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    help="Threads doing the encoding (default: the thread pool's own choice).",
+)
+def serve(
+    address: str, layouts: Tuple[str, ...], batch_delay: float, workers: int
+) -> None:
+    """
+    Keeps the cipher warm and answers requests from ./sharkc.py
+    """
+    server = SharkServer(layouts, batch_delay, workers=workers)
+    where = parse_address(address)
+    e(f"Serving {', '.join(server.layouts)} on {where}")
+    # exit through the finally below (removing the socket) on kill as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        asyncio.run(server.serve_forever(address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(where, str) and os.path.exists(where):
+            os.unlink(where)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import sys
+from typing import *
+
+"""
+A thin client for ./serve.py that is a drop-in replacement for ./cipher.py.
+
+It takes exactly the same arguments as the shark command, sends them (with
+stdin, when TEXT or --against is -) to a running server, and prints what
+comes back.  Nothing beyond the standard library is imported and the
+Cipher is already built on the other end, so a call costs little more than
+starting Python.  If no server is listening, or for the options that only
+make sense in-process (--help, --stats, --stats-json, --profile, --lattice,
+which writes binary, and --follow, which never finishes), it runs
+./cipher.py itself instead.
+
+The server is found through the SHARK_SERVER environment variable: the path
+of a Unix socket, or host:port for HTTP over TCP (DEFAULT_SOCKET if unset).
+"""
+
+DEFAULT_SOCKET: str = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp",
+    f"shark-{os.getuid()}.sock",
+)
+# options the server does not handle, so cipher.py runs locally for them
+LOCAL_OPTIONS: Tuple[str, ...] = (
+    "--help",
+    "--stats",
+    "--stats-json",
+    "--profile",
+    "--lattice",
+    "--follow",
+)
+CIPHER: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cipher.py")
+
+
+class ServerError(Exception):
+    """The server turned a request down (its reply had an error)"""
+
+
+def parse_address(address: str = None) -> Union[str, Tuple[str, int]]:
+    """
+    A Unix socket path, or (host, port) for an address like 127.0.0.1:8741
+    (or http://127.0.0.1:8741); defaults to $SHARK_SERVER or DEFAULT_SOCKET
+    """
+    address = address or os.environ.get("SHARK_SERVER") or DEFAULT_SOCKET
+    if address.startswith("http://"):
+        address = address[len("http://") :].rstrip("/")
+    host, colon, port = address.rpartition(":")
+    if colon and port.isdigit() and "/" not in address:
+        return host or "127.0.0.1", int(port)
+    return address
+
+
+def connect(address: str = None) -> socket.socket:
+    """
+    A connection to the server at address (see parse_address)
+
+    Raises OSError if nothing is listening there.
+    """
+    where = parse_address(address)
+    if isinstance(where, tuple):
+        return socket.create_connection(where)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(where)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def request(
+    path: str,
+    body: Dict[str, Any] = None,
+    address: str = None,
+    sock: socket.socket = None,
+) -> Dict[str, Any]:
+    """
+    Sends one request (a POST of body as JSON, or a GET without one) and
+    returns the JSON reply
+
+    Raises OSError if the server cannot be reached and ServerError if it
+    answers with an error.  Pass sock to reuse an open connection.
+    (http.client would do, but importing it takes longer than the request.)
+    """
+    owned = sock is None
+    sock = sock or connect(address)
+    try:
+        payload = b"" if body is None else json.dumps(body).encode()
+        head = [
+            f"{'GET' if body is None else 'POST'} {path} HTTP/1.1",
+            "Host: localhost",
+            "Content-Type: application/json",
+            f"Content-Length: {len(payload)}",
+        ]
+        sock.sendall("\r\n".join(head + ["", ""]).encode() + payload)
+        with sock.makefile("rb") as reader:
+            status = int(reader.readline().split()[1])
+            length = 0
+            while (line := reader.readline()).strip():
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+            reply = json.loads(reader.read(length) or b"{}")
+    finally:
+        if owned:
+            sock.close()
+    if status != 200:
+        raise ServerError(reply.get("error", status))
+    return reply
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs the shark command on the server, or locally if that fails"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not any(arg.split("=")[0] in LOCAL_OPTIONS for arg in argv):
+        try:
+            sock = connect()
+        except OSError:
+            sock = None  # no server, so run locally
+        if sock is not None:
+            body: Dict[str, Any] = {"args": argv, "cwd": os.getcwd()}
+            if "-" in argv:
+                body["stdin"] = sys.stdin.read()
+            try:
+                reply = request("/shark", body, sock=sock)
+            except ServerError as x:
+                sys.stderr.write(f"Error: {x}\n")
+                return 1
+            finally:
+                sock.close()
+            sys.stdout.write(reply["stdout"])
+            sys.stderr.write(reply["stderr"])
+            return reply["exit"]
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, CIPHER, *argv])
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+import json
+import time
+from contextlib import contextmanager
+from typing import *
+
+"""
+Timing and counting for the shark CLI's --stats option.
+
+Code that supports stats takes an optional Stats and does nothing extra
+when it is None, so leaving --stats off costs one comparison per line.
+Subclass Stats and override record and count to send the numbers somewhere
+else (a metrics client, a log, …); that is the whole hook interface.
+"""
+
+
+class Stats:
+    """
+    Collects the wall time spent in each phase of a run and counters such as
+    lines and characters
+
+    Phases used by the shark CLI, in order: load (building or loading the
+    Cipher), read (only for --stream), normalize, possibilities, display,
+    and output.  Counters: lines, chars_in, chars_out, and dropped
+    (characters removed by --strip, not counting line ends), and with
+    --cache the hits, misses, and evictions of the line and word caches.
+    """
+
+    def __init__(self):
+        self.times: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.started: float = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Times the body of a with block as part of phase name"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name: str, seconds: float) -> None:
+        """Adds seconds to phase name (a hook: override to forward timings)"""
+        self.times[name] = self.times.get(name, 0.0) + seconds
+
+    def count(self, **counts: int) -> None:
+        """Adds to counters by name (a hook: override to forward counts)"""
+        for name, n in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def finish(self) -> None:
+        """Stops the overall clock"""
+        self.finished = time.perf_counter()
+
+    @property
+    def wall(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def report(self) -> Dict[str, Any]:
+        """Everything collected, with throughput in characters per second"""
+        wall = self.wall
+        return {
+            "wall_seconds": wall,
+            "phases": dict(self.times),
+            "counts": dict(self.counts),
+            "chars_in_per_second": self.counts.get("chars_in", 0) / wall if wall else 0,
+            "chars_out_per_second": (
+                self.counts.get("chars_out", 0) / wall if wall else 0
+            ),
+        }
+
+    def json(self) -> str:
+        return json.dumps(self.report(), indent=2)
+
+    def __str__(self) -> str:
+        r = self.report()
+        wall = r["wall_seconds"]
+        lines = [f"{'phase':16}{'seconds':>10}{'share':>8}"]
+        for name, seconds in r["phases"].items():
+            share = seconds / wall if wall else 0
+            lines.append(f"{name:16}{seconds:10.4f}{share:8.1%}")
+        lines.append(f"{'total':16}{wall:10.4f}")
+        lines += [f"{name:16}{n:10,}" for name, n in r["counts"].items()]
+        lines.append(f"{'chars in/s':16}{r['chars_in_per_second']:10,.0f}")
+        lines.append(f"{'chars out/s':16}{r['chars_out_per_second']:10,.0f}")
+        return "\n".join(lines)
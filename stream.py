@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+
+import codecs
+import io
+import mmap
+import multiprocessing
+import stat
+import time
+from collections import deque
+from typing import *
+
+from cipher import *
+
+"""
+Chunked input and buffered output for the shark CLI's --stream mode.
+
+Lines of any length are encoded in pieces of at most CHUNK_SIZE characters
+so the memory used stays the same no matter how big the input is.
+The same pieces are what --jobs hands out to worker processes.
+"""
+
+CHUNK_SIZE: int = 1 << 20
+
+
+class Segment(NamedTuple):
+    """
+    A normalized piece of one line of input
+
+    position is how many (normalized) characters of the same line came
+    before it, so --fixed output can carry on where the previous piece
+    stopped.  line_end is set on the last piece of each line.
+    """
+
+    text: str
+    position: int
+    line_end: bool
+
+
+def read_blocks(binary: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields blocks of a binary file, memory-mapping it if it is a regular file
+    and reading it chunk_size bytes at a time otherwise (pipes, stdin, …)
+    """
+    try:
+        fileno = binary.fileno()
+        regular = stat.S_ISREG(os.fstat(fileno).st_mode) and os.fstat(fileno).st_size
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        regular = False
+    if regular:
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mm:
+            for i in range(binary.tell(), len(mm), chunk_size):
+                yield mm[i : i + chunk_size]
+        return
+    while block := binary.read(chunk_size):
+        yield block
+
+
+def read_text(text: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yields a text file in decoded pieces of about chunk_size characters
+    with newlines translated to \\n, the same way iterating over it would
+    """
+    binary = getattr(text, "buffer", None)
+    if binary is None:  # already text all the way down
+        while piece := text.read(chunk_size):
+            yield piece
+        return
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(text.encoding or "utf-8")(text.errors or "strict"),
+        translate=True,
+    )
+    for block in read_blocks(binary, chunk_size):
+        if piece := decoder.decode(block):
+            yield piece
+    if piece := decoder.decode(b"", final=True):
+        yield piece
+
+
+class LineCutter:
+    """
+    Normalizes a line that arrives in pieces into Segments
+
+    position counts the normalized characters already sent for the current
+    line and line_start says whether nothing but whitespace has been sent
+    yet; together they are all that has to be kept to carry on with a line
+    later (see follow.py).
+    """
+
+    def __init__(
+        self, c: Cipher, drop: bool = True, position: int = 0, line_start: bool = True
+    ):
+        self.cipher: Cipher = c
+        self.drop: bool = drop
+        self.position: int = position
+        self.line_start: bool = line_start
+
+    def cut(self, piece: str, line_end: bool) -> Segment:
+        """The Segment for the next piece of the line (the last if line_end)"""
+        if self.line_start:
+            piece = piece.lstrip()
+        if line_end:
+            piece = piece.rstrip()
+        seg = Segment(
+            self.cipher.normalize(piece, self.drop, strip=False),
+            self.position,
+            line_end,
+        )
+        if line_end:
+            self.position, self.line_start = 0, True
+        else:
+            self.position += len(seg.text)
+            self.line_start = self.line_start and not piece
+        return seg
+
+
+def segments(
+    pieces: Iterable[str], c: Cipher, drop: bool = True, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Segment]:
+    """
+    Splits decoded text into normalized Segments
+
+    A line shorter than chunk_size always comes out as a single Segment,
+    normalized exactly like Cipher.encode_text would normalize it.  Longer
+    lines are cut about every chunk_size characters, never straight after
+    whitespace, so that only whitespace at the real ends of the line is
+    stripped.
+    """
+    buffer: str = ""  # the unfinished end of the current line
+    line_open: bool = False  # part of this line has been read
+    cut = LineCutter(c, drop).cut
+
+    for piece in pieces:
+        lines: List[str] = (buffer + piece).split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield cut(line, True)
+        line_open = bool(buffer) or (line_open and not lines)
+        while len(buffer) >= chunk_size:
+            end: int = chunk_size
+            if not drop and buffer[end - 1].isspace():
+                # only cut after whitespace once it is known not to end the line
+                rest: str = buffer[end:].lstrip()
+                if not rest:
+                    break
+                end = len(buffer) - len(rest) + 1
+            seg = cut(buffer[:end], False)
+            buffer = buffer[end:]
+            if seg.text:
+                yield seg
+    if buffer or line_open:
+        yield cut(buffer, True)
+
+
+class BufferedOutput:
+    """
+    Collects text and writes it to a binary stream in large blocks
+    rather than one small write per line
+    """
+
+    def __init__(
+        self, stream: BinaryIO, size: int = CHUNK_SIZE, encoding: str = "utf-8"
+    ):
+        self.stream: BinaryIO = stream
+        self.size: int = size
+        self.encoding: str = encoding
+        self.pending: List[str] = []
+        self.pending_size: int = 0
+
+    def write(self, content: str) -> None:
+        self.pending.append(content)
+        self.pending_size += len(content)
+        if self.pending_size >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.pending:
+            self.stream.write("".join(self.pending).encode(self.encoding))
+            self.pending, self.pending_size = [], 0
+        self.stream.flush()
+
+    def __enter__(self) -> "BufferedOutput":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+
+def batches(segs: Iterable[Segment], size: int = CHUNK_SIZE) -> Iterator[List[Segment]]:
+    """Groups Segments into lists of roughly size characters"""
+    batch: List[Segment] = []
+    filled: int = 0
+    for seg in segs:
+        batch.append(seg)
+        filled += len(seg.text) + 1  # so empty lines count for something
+        if filled >= size:
+            yield batch
+            batch, filled = [], 0
+    if batch:
+        yield batch
+
+
+def encode_segment(
+    c: Cipher,
+    seg: Segment,
+    direction: chr = "R",
+    rnd: bool = True,
+    start: int = 0,
+    jump: int = 1,
+    only_one: bool = False,
+    barrier: str = "-",
+    rng: random.Random = None,
+) -> str:
+    """Returns the CLI output for one Segment, including any line break"""
+    rows: List[str] = c.possibilities(
+        seg.text,
+        direction,
+        rnd,
+        1 if only_one else 8,
+        start + seg.position * jump,
+        jump,
+        rng,
+    )
+    if only_one:
+        return rows[0] + ("\n" if seg.line_end else "")
+    return display_possibilities([seg.text] + rows, False, barrier) + "\n"
+
+
+def batch_rng(seed: Optional[int], index: int) -> random.Random:
+    """
+    The random number generator for batch number index
+
+    Every batch gets its own generator so that a seeded run gives the
+    same output whichever process encodes which batch.  Without a seed,
+    each one is seeded by the operating system.
+    """
+    return random.Random(None if seed is None else f"{seed}/{index}")
+
+
+def encode_batch(
+    c: Cipher,
+    index: int,
+    batch: List[Segment],
+    options: Tuple,
+    seed: Optional[int] = None,
+) -> str:
+    """
+    Encodes a batch of Segments with encode_segment
+
+    options are the direction, rnd, start, jump, only_one, and barrier
+    arguments of encode_segment in that order.  Batches go through
+    batch.BatchEngine when NumPy is installed.
+    """
+    direction, rnd, start, jump, only_one, barrier = options
+    rng = batch_rng(seed, index) if rnd else None
+    if direction != "0":
+        from batch import batch_engine
+
+        engine = batch_engine(c, direction)
+        if engine is not None:  # every row of every Segment in one go
+            texts = [seg.text for seg in batch]
+            limit = 1 if only_one else 8
+            if rnd:
+                grids = engine.random_many(texts, rng, limit)
+            else:
+                starts = [start + seg.position * jump for seg in batch]
+                grids = engine.encode_many(texts, limit, jump=jump, starts=starts)
+            if only_one:
+                return "".join(
+                    rows[0] + ("\n" if seg.line_end else "")
+                    for seg, rows in zip(batch, grids)
+                )
+            return "".join(
+                display_possibilities([seg.text] + rows, False, barrier) + "\n"
+                for seg, rows in zip(batch, grids)
+            )
+    return "".join(encode_segment(c, seg, *options, rng) for seg in batch)
+
+
+# The Cipher each worker process encodes with, set by _start_worker
+_worker_cipher: Optional[Cipher] = None
+
+
+def _start_worker(c: Cipher) -> None:
+    global _worker_cipher
+    _worker_cipher = c
+
+
+def _encode_in_worker(
+    index: int, batch: List[Segment], options: Tuple, seed: Optional[int]
+) -> str:
+    return encode_batch(_worker_cipher, index, batch, options, seed)
+
+
+def shark_stream(
+    c: Cipher,
+    pieces: Iterable[str],
+    drop: bool = True,
+    direction: chr = "R",
+    rnd: bool = True,
+    start: int = 0,
+    jump: int = 1,
+    only_one: bool = False,
+    barrier: str = "-",
+    chunk_size: int = CHUNK_SIZE,
+    jobs: int = 1,
+    seed: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Yields the shark output for the text in pieces, in input order
+
+    With jobs > 1, batches of about chunk_size characters are encoded by a
+    pool of that many processes (each one gets a copy of c when it starts,
+    which costs nothing extra when processes are forked).
+    A few batches per process are kept in flight so memory stays bounded.
+
+    With --random, passing a seed makes the output reproducible and the
+    same for any number of jobs (and whether or not NumPy is installed).
+    """
+    options = (direction, rnd, start, jump, only_one, barrier)
+    work = enumerate(batches(segments(pieces, c, drop, chunk_size), chunk_size))
+    if jobs <= 1:
+        for index, batch in work:
+            yield encode_batch(c, index, batch, options, seed)
+        return
+    with multiprocessing.Pool(jobs, _start_worker, (c,)) as pool:
+        pending = deque()
+        for index, batch in work:
+            pending.append(
+                pool.apply_async(_encode_in_worker, (index, batch, options, seed))
+            )
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def stream_shark(
+    c: Cipher,
+    text: TextIO,
+    out: BufferedOutput,
+    drop: bool = True,
+    direction: chr = "R",
+    rnd: bool = True,
+    start: int = 0,
+    jump: int = 1,
+    only_one: bool = False,
+    barrier: str = "-",
+    chunk_size: int = CHUNK_SIZE,
+    jobs: int = 1,
+    seed: Optional[int] = None,
+    stats=None,
+) -> None:
+    """
+    The --stream (and --jobs) version of the shark command
+
+    --only-one output is identical to the line-by-line mode.  The grid
+    is identical for lines shorter than chunk_size; longer lines get one
+    grid per chunk_size characters, with --fixed positions carried over.
+
+    stats, if given, is a stats.Stats; chunks are encoded a batch at a time,
+    so the phases are just read, encode (everything between reading and
+    writing), and output.
+    """
+    pieces: Iterable[str] = read_text(text, chunk_size)
+    if stats is not None:
+        pieces = counted(pieces, stats)
+    blocks = shark_stream(
+        c,
+        pieces,
+        drop,
+        direction,
+        rnd,
+        start,
+        jump,
+        only_one,
+        barrier,
+        chunk_size,
+        jobs,
+        seed,
+    )
+    if stats is None:
+        for block in blocks:
+            out.write(block)
+        return
+    while True:
+        t0, reading = time.perf_counter(), stats.times.get("read", 0.0)
+        block = next(blocks, None)
+        # reading happens inside the generator, so take it back out
+        elapsed = time.perf_counter() - t0
+        stats.record("encode", elapsed - (stats.times.get("read", 0.0) - reading))
+        if block is None:
+            break
+        with stats.phase("output"):
+            out.write(block)
+        stats.count(chars_out=len(block))
+
+
+def counted(pieces: Iterable[str], stats) -> Iterator[str]:
+    """Passes pieces through, timing how long each takes to read and counting it"""
+    it = iter(pieces)
+    while True:
+        with stats.phase("read"):
+            piece = next(it, None)
+        if piece is None:
+            return
+        stats.count(chars_in=len(piece), lines=piece.count("\n"))
+        yield piece
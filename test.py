@@ -1,6 +1,34 @@
 #!/usr/bin/env python3
 
+import gc
+import json
+import subprocess
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import *
+
+import click
+from click.testing import CliRunner
+
 from cipher import *
+from cli import run_shark, shark
+from oneline import IMPORT_BUDGET
+from stream import *
+from batch import BatchEngine, batch_engine
+from bench import Result, compare, parse_size, sample_text
+from design import OBJECTIVES, Scorer, anneal, search
+from detect import Detector
+from follow import Follower
+from grep import PatternSet
+import ngram
+from lattice import LatticeReader, LatticeWriter
+from memo import RowCache
+from recover import recover
+from serve import SharkServer
+from sharkc import ServerError, connect, request
+from unshark import Dictionary, Session, Solver, session
+from wordindex import WordIndex
 
 """
 
@@ -38,16 +66,992 @@ def reverse(layout: str, phrase: str, directed: bool = False) -> bool:
     )
     if directed:  # drop invalid characters from the input phrase to make the test pass
         phrase = c.encode_text(phrase, drop=True, direction="0")[0]
-    passed: bool = all(
-        phrase[x] in c.encode_chr(ch, direction="D" if directed else "R", drop=directed)
-        for x, ch in enumerate(crypt)
-    )
+    passed: bool = not c.verify(phrase, crypt, "D" if directed else "R")
     if passed:
         return True
     e(f"\t\tFAILED")
     return False
 
 
+def verify_check(layout: str, phrase: str) -> bool:
+    """
+    Checks Cipher.verify against a letter-by-letter comparison, on text with
+    characters outside the layout and on texts of different lengths
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tVerify check")
+    rng = random.Random(phrase)
+    for direction in "RED":
+        for trial in range(20):
+            extra = " ,!é" if trial % 2 else " ,!"  # odd trials are not ASCII
+            clear = "".join(rng.choices(ALPHABET + extra, k=rng.randint(0, 200)))
+            crypt = c.possibilities(clear, direction, True, 1, rng=rng)[0]
+            crypt = "".join(  # damage a few of the letters
+                rng.choice(ALPHABET) if rng.random() < 0.1 else ch for ch in crypt
+            )[: len(crypt) - trial % 3]
+            back = {"R": "R", "E": "D", "D": "E"}[direction]
+            expected = [
+                i
+                for i in range(max(len(clear), len(crypt)))
+                if i >= len(clear)
+                or i >= len(crypt)
+                or clear[i] not in c.encode_chr(crypt[i], back, False, False)
+            ]
+            if c.verify(clear, crypt, back) != expected:
+                e(f"\t\tFAILED for {clear!r} ({direction})")
+                return False
+    return True
+
+
+def fixed_check(layout: str, phrase: str) -> bool:
+    """
+    Checks that the compiled --fixed rows match picking each character's
+    possibility one at a time with encode_chr, for short and long inputs
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tFixed table check")
+    for text in [phrase, phrase * 300]:
+        for direction in "RED":
+            for start, jump in [(0, 1), (5, -3), (-2, 0)]:
+                rows = c.encode_text(text, False, direction, False, 8, start, jump)
+                for offset, row in enumerate(rows[1:]):
+                    expected = "".join(
+                        (s := c.encode_chr(ch, direction, False))[
+                            (start + offset + i * jump) % len(s)
+                        ]
+                        for i, ch in enumerate(rows[0])
+                    )
+                    if row != expected:
+                        e(f"\t\tFAILED {direction} start={start} jump={jump}")
+                        return False
+    return True
+
+
+def batch_check(layout: str, phrase: str) -> bool:
+    """
+    Checks that the NumPy batch engine (or its fallback) gives the same
+    rows as Cipher.possibilities for several texts at once
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tBatch engine check")
+    texts = [c.normalize(t, drop) for t in (phrase, phrase * 40, "") for drop in (1, 0)]
+    for direction in "RED":
+        engine = BatchEngine(c, direction)
+        for start, jump in [(0, 1), (4, -7), (-1, 0)]:
+            expected = [
+                c.possibilities(t, direction, False, 8, start, jump) for t in texts
+            ]
+            if engine.encode_many(texts, 8, start, jump) != expected:
+                e(f"\t\tFAILED {direction} start={start} jump={jump}")
+                return False
+        rng = random.Random(3)
+        expected = [c.possibilities(t, direction, True, 8, rng=rng) for t in texts]
+        if engine.random_many(texts, random.Random(3), 8) != expected:
+            e(f"\t\tFAILED {direction} --random")
+            return False
+        engine.shuffles = False  # as for letters with too many possibilities
+        if engine.random_many(texts, random.Random(3), 8) != expected:
+            e(f"\t\tFAILED {direction} --random without the NumPy shuffle")
+            return False
+    # the shared engines do not keep their Cipher alive
+    shared = Cipher(layout)
+    if batch_engine(shared, "E") is not batch_engine(shared, "e"):
+        e(f"\t\tFAILED to share the engine for {layout}")
+        return False
+    gone = weakref.ref(shared)
+    del shared
+    gc.collect()
+    if gone() is not None:
+        e(f"\t\tFAILED: batch_engine kept its Cipher alive")
+        return False
+    return True
+
+
+def random_check(layout: str, phrase: str) -> bool:
+    """
+    Checks that --random output leaves the cipher untouched, is reproducible
+    with a seed (also from several threads at once), and only ever picks
+    among each character's possibilities, showing all of them when there
+    are enough rows
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tRandom check")
+    before = [cap_list_str(k.surround) for k in c.letter_index.values()]
+    fixed = c.encode_text(phrase, direction="R", rnd=False)
+    runs = [c.encode_text(phrase, direction=d, seed=s) for d in "RED" for s in range(3)]
+    if before != [cap_list_str(k.surround) for k in c.letter_index.values()]:
+        e(f"\t\tFAILED: --random changed the keycaps")
+        return False
+    if fixed != c.encode_text(phrase, direction="R", rnd=False):
+        e(f"\t\tFAILED: --random changed the --fixed output")
+        return False
+    with ThreadPoolExecutor(4) as pool:
+        threaded = list(
+            pool.map(
+                lambda args: c.encode_text(phrase, direction=args[0], seed=args[1]),
+                [(d, s) for d in "RED" for s in range(3)],
+            )
+        )
+    if threaded != runs:
+        e(f"\t\tFAILED: seeded output was not reproducible")
+        return False
+    for rows, direction in zip(runs, "RRREEEDDD"):
+        for i, ch in enumerate(rows[0]):
+            options = c.encode_chr(ch, direction)
+            column = [row[i] for row in rows[1:]]
+            if set(column) - set(options) or (
+                len(options) <= len(column) and set(column) != set(options)
+            ):
+                e(f"\t\tFAILED: bad column {column} for '{ch}' ({options})")
+                return False
+    # a real shuffle, not a walk round the ring from a random starting point
+    walks = shuffles = 0
+    for rows, direction in zip(runs, "RRREEEDDD"):
+        for i, ch in enumerate(rows[0]):
+            options = c.encode_chr(ch, direction)
+            if len(options) < 4:
+                continue
+            column = "".join(row[i] for row in rows[1 : len(options) + 1])
+            rings = (options * 2, options[::-1] * 2)
+            if len(column) == len(options):
+                shuffles += 1
+                walks += any(column in ring for ring in rings)
+    if shuffles and walks == shuffles:
+        e(f"\t\tFAILED: every --random column went round its ring in order")
+        return False
+    return True
+
+
+def invert_check(phrase: str, trials: int = 20) -> bool:
+    """
+    Round-trips random texts through --fixed output and Cipher.invert for
+    every layout in the layouts directory that can be loaded: the cleartext
+    letter is always a candidate, and the whole grid leaves only it
+    """
+    p(f"Invert check")
+    rng = random.Random(phrase)
+    for layout in available_layouts():
+        try:
+            c = Cipher(layout, 0)
+        except (AssertionError, ValueError):
+            continue  # broken on purpose, or not a usable layout
+        letters = "".join(c.letter_index) + " ,.!"
+        for _ in range(trials):
+            text = c.normalize(
+                "".join(rng.choices(letters, k=rng.randint(0, 300))), False
+            )
+            start, jump = rng.randint(-5000, 5000), rng.randint(-50, 50)
+            for direction in "RED":
+                rows = c.possibilities(text, direction, False, 8, start, jump)
+                single = c.invert(rows[0], direction, start, jump)
+                if not all(ch in options for ch, options in zip(text, single)):
+                    e(f"\tFAILED for {layout} {direction} start={start} jump={jump}")
+                    return False
+                if c.invert(rows, direction, start, jump) != list(text):
+                    e(f"\tFAILED to pin down {text} in {layout} {direction}")
+                    return False
+    return True
+
+
+def recover_check(phrase: str) -> bool:
+    """
+    Hides the phrase in --fixed ciphertext and checks that known-plaintext
+    recovery finds the settings it was made with
+    """
+    p(f"Recover check")
+    rng = random.Random(phrase)
+    for layout, direction, drop in [("Dvorak", "E", True), ("Colemak", "R", False)]:
+        c = Cipher(layout)
+        filler = "".join(rng.choices(ALPHABET + " ", k=200))
+        text = c.normalize(f"{filler} {phrase} {filler}", drop)
+        start, jump = rng.randint(-1000, 1000), rng.randint(-20, 20)
+        ct = c.possibilities(text, direction, False, 1, start, jump)[0]
+        found = [
+            m
+            for m in recover(["", ct], phrase)
+            if (m.layout, m.reverse, m.direction) == (c.layout, c.reverse, direction)
+            and m.line == 1
+            and m.position == text.index(c.normalize(phrase, drop))
+        ]
+        if not found:
+            e(f"\tFAILED to find {layout} {direction}")
+            return False
+        m, crib = found[0], c.normalize(phrase, drop)
+        piece = ct[m.position : m.position + len(crib)]
+        for s, j in m.examples:  # every reported setting makes the ciphertext
+            if (
+                c.possibilities(crib, direction, False, 1, s + m.position * j, j)[0]
+                != piece
+            ):
+                e(f"\tFAILED with --offset {s} -j {j} for {layout}")
+                return False
+    return True
+
+
+def detect_check() -> bool:
+    """
+    Checks that --layout auto picks the right layout for a few kilobytes of
+    English (this readme) encoded with each real layout and direction
+    """
+    p(f"Detect check")
+    with open(os.path.join(os.path.dirname(__file__), "readme.md")) as f:
+        text = f.read()[:4000].splitlines()
+    layouts = ["QWERTY", "Colemak", "Workman", "Dvorak"]
+    detector = Detector(layouts + ["test-colemak"])
+    for layout in layouts:
+        c = Cipher(layout)
+        for direction in "RED":
+            for rnd in (True, False):
+                ct = "\n".join(
+                    c.encode_text(line, False, direction, rnd, 1, 3, seed=1)[1]
+                    for line in text
+                )
+                guess = detector.detect(ct)
+                if guess.layout != c.layout:
+                    e(f"\tFAILED: {layout} {direction} taken for {guess}")
+                    return False
+    # run_shark works without a Click context, and a given direction is kept
+    for direction, flags in [(None, []), ("D", ["--decipher"])]:
+        out, messages = io.StringIO(), []
+        run_shark(
+            io.StringIO(ct),
+            "auto",
+            True,
+            "-",
+            direction,
+            False,
+            out=out,
+            err=messages.append,
+        )
+        args = ["-k", "auto", "--only-one", "--fixed", *flags, "-"]
+        if out.getvalue() != CliRunner().invoke(shark, args, input=ct).stdout:
+            e(f"\tFAILED: run_shark -k auto {flags} differs from the command")
+            return False
+    return True
+
+
+def stats_check(phrase: str) -> bool:
+    """
+    Checks that --stats leaves the output alone and counts what went
+    through, with and without --stream
+    """
+    p(f"Stats check")
+    text = f"{phrase}\n  {phrase.upper()}  \n\n{phrase}\n"
+    expected_dropped = sum(
+        len(line.strip()) - len(Cipher().normalize(line)) for line in text.splitlines()
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        report = os.path.join(tmp, "stats.json")
+        for extra in ([], ["--stream"]):
+            args = ["--fixed", "--offset", "3", *extra, "-"]
+            plain = CliRunner().invoke(shark, args, input=text)
+            timed = CliRunner().invoke(
+                shark, ["--stats-json", report, *args], input=text
+            )
+            if plain.exit_code or timed.exit_code or timed.stdout != plain.stdout:
+                e(f"\tFAILED: --stats changed the output of {args}")
+                return False
+            with open(report) as f:
+                counts = json.load(f)["counts"]
+            if counts["lines"] != 4 or counts["chars_in"] != len(text):
+                e(f"\tFAILED to count the input: {counts}")
+                return False
+            if not extra and counts["dropped"] != expected_dropped:
+                e(f"\tFAILED to count dropped characters: {counts}")
+                return False
+    return True
+
+
+def ngram_check(phrase: str) -> bool:
+    """
+    Checks that --best finds readings at least as likely as the cleartext,
+    and that the NumPy and pure-Python decoders agree
+    """
+    p(f"N-gram check")
+    c = load_cipher("QWERTY")
+    for strip, direction in [(True, "R"), (False, "E")]:
+        cleartext = c.normalize(phrase, strip)
+        ciphertext = c.encode_text(phrase, strip, direction, True, seed=5)[1]
+        decode_with = {"R": "R", "E": "D"}[direction]
+        candidates = ngram.lattice(c, ciphertext, decode_with)
+        if not all(ch in options for ch, options in zip(cleartext, candidates)):
+            e(f"\tFAILED: the cleartext is not in the lattice of {ciphertext}")
+            return False
+        model = ngram.load_model(spaces=not strip)
+        decoder = ngram.Decoder(model)
+        found = decoder.decode(candidates, 3)
+        if found[0].score < model.score(cleartext) - 1e-9:
+            e(f"\tFAILED: {found[0].text} is less likely than {cleartext}")
+            return False
+        if ngram.np is not None:
+            ngram.np, saved = None, ngram.np
+            try:
+                slow = decoder.decode_many([candidates, "", candidates[:5]], 3)
+            finally:
+                ngram.np = saved
+            fast = decoder.decode_many([candidates, "", candidates[:5]], 3)
+            if [[r.text for r in rs] for rs in slow] != [
+                [r.text for r in rs] for rs in fast
+            ]:
+                e(f"\tFAILED: NumPy and Python decode {ciphertext} differently")
+                return False
+        args = ["--best", "--only-one", "--include" if not strip else "--strip"]
+        flag = {"R": "--reversible", "D": "--decipher"}[decode_with]
+        result = CliRunner().invoke(shark, [*args, flag, "-"], input=ciphertext)
+        if result.exit_code or result.stdout != f"{found[0].text}\n":
+            e(f"\tFAILED: --best printed {result.stdout!r}")
+            return False
+    return True
+
+
+def follow_check(phrase: str) -> bool:
+    """
+    Checks that following a file across restarts (from a checkpoint) gives
+    the same --fixed output as encoding it in one go, and that --seed output
+    does not depend on when whole lines arrived
+    """
+    p(f"Follow check")
+    c = load_cipher("QWERTY")
+    parts = [
+        f"{phrase}\n  {phrase.upper()}\n",
+        f"\n{phrase} and ",  # stops halfway through a line
+        f"more {phrase * 3}",  # a long line, still unfinished
+        f" ÆØ end\n{phrase}\n",
+    ]
+    settings = dict(drop=False, rnd=False, start=3, jump=2, only_one=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        log, saved = os.path.join(tmp, "log.txt"), os.path.join(tmp, "at.json")
+        open(log, "w").close()
+        followed = ""
+        for part in parts:
+            with open(log, "a") as f:
+                f.write(part)
+            # a new Follower each time, as if the process had been restarted
+            follower = Follower(c, log, saved, chunk_size=40, **settings)
+            for block in follower.poll():
+                followed += block
+                follower.save()
+        args = ["--fixed", "--offset", "3", "-j", "2", "--include", "--only-one", log]
+        whole = CliRunner().invoke(shark, args)
+        if whole.exit_code or followed != whole.stdout:
+            e(f"\tFAILED: following gave {followed!r}, not {whole.stdout!r}")
+            return False
+        try:
+            Follower(c, log, saved, chunk_size=40, **{**settings, "jump": 1})
+            e(f"\tFAILED to refuse a checkpoint made with other settings")
+            return False
+        except ValueError:
+            pass
+        outputs = []
+        for stages in ([parts], [parts[:1], parts[1:]]):
+            os.remove(log)
+            os.remove(saved)
+            for stage in stages:
+                with open(log, "a") as f:
+                    f.write("".join(stage))
+                follower = Follower(c, log, saved, chunk_size=40, seed=9)
+                outputs.append("".join(follower.poll()))
+                follower.save()
+            outputs[-len(stages) :] = ["".join(outputs[-len(stages) :])]
+        if outputs[0] != outputs[1]:
+            e(f"\tFAILED: --seed output changed with how the lines arrived")
+            return False
+    return True
+
+
+def memo_check(phrase: str) -> bool:
+    """
+    Checks that the RowCache gives the rows encode_text would, whether a
+    line is found whole, put together from words, or encoded, and that it
+    stays within its capacity
+    """
+    p(f"Memo check")
+    lines = [phrase, f"{phrase} {phrase.upper()}  {phrase}!", phrase[::-1], phrase]
+    small = RowCache(lines=len(phrase) * 8 * 3, words=len(phrase) * 8, long_line=10)
+    for layout in ("QWERTY", "Dvorak"):
+        c = load_cipher(layout)
+        for direction, start, jump, drop in [
+            ("R", 0, 1, False),
+            ("E", 5, 3, False),
+            ("D", 2, 2, True),
+        ]:
+            for memo in (RowCache(), small):
+                for line in lines * 2:
+                    want = c.encode_text(line, drop, direction, False, 8, start, jump)
+                    got = memo.encode_text(c, line, drop, direction, 8, start, jump)
+                    if got != want:
+                        e(f"\tFAILED: {layout} {direction} rows of {line!r}")
+                        return False
+    for name, counters in small.counters().items():
+        if counters.size > getattr(small, name).capacity or not counters.evictions:
+            e(f"\tFAILED: the {name} cache kept {counters}")
+            return False
+    if not small.counters()["words"].hits:
+        e(f"\tFAILED: long lines did not reuse their words")
+        return False
+    text = "\n".join(lines * 3)
+    args = ["--fixed", "-j", "2", "--include", "-"]
+    plain = CliRunner().invoke(shark, args, input=text)
+    cached = CliRunner().invoke(shark, ["--cache"] + args, input=text)
+    if cached.exit_code or cached.stdout != plain.stdout:
+        e(f"\tFAILED: shark --cache gave other output")
+        return False
+    return True
+
+
+def lazy_check(phrase: str) -> bool:
+    """
+    Checks that rows worked out one at a time are the rows worked out all
+    at once, with and without rnd, and are laid out the same
+    """
+    p(f"Lazy rows check")
+    c = load_cipher("QWERTY")
+    text = c.normalize(phrase, False)
+    for direction in "RED0":
+        fixed = c.iter_possibilities(text, direction, False, 8, 3, 2)
+        if list(fixed) != c.possibilities(text, direction, False, 8, 3, 2):
+            e(f"\tFAILED: lazy {direction} rows differ")
+            return False
+        first = next(
+            c.iter_possibilities(text, direction, True, 1, rng=random.Random(5))
+        )
+        if first != c.possibilities(text, direction, True, 8, rng=random.Random(5))[0]:
+            e(f"\tFAILED: the first random {direction} row depends on the limit")
+            return False
+    rows = c.encode_text(phrase, False, "R", False)
+    for only_one, separator, cleartext in [(True, "-", None), (False, "*", phrase)]:
+        layout = display_possibilities(list(rows), only_one, separator, cleartext, [1])
+        lines = display_lines(iter(rows), only_one, separator, cleartext, [1])
+        if "\n".join(lines) != layout:
+            e(f"\tFAILED: display_lines gave another layout")
+            return False
+    args = ["--fixed", "--only-one", "--include", "-"]
+    result = CliRunner().invoke(shark, args, input=phrase)
+    if result.exit_code or result.stdout != f"{rows[1]}\n":
+        e(f"\tFAILED: --only-one printed {result.stdout!r}")
+        return False
+    with tempfile.TemporaryDirectory() as tmp:
+        against = os.path.join(tmp, "against.txt")
+        with open(against, "w") as f:
+            f.write(f"{rows[1]}q\n")  # one letter longer than the ciphertext
+        args = ["--fixed", "--only-one", "--include", "-sep", "=", "--against"]
+        result = CliRunner().invoke(shark, [*args, against, "-"], input=phrase)
+        if result.stdout != f"{rows[1]}\n{'=' * len(text)}!\n":
+            e(f"\tFAILED: --against fenced --only-one with {result.stdout!r}")
+            return False
+    return True
+
+
+def grep_check(phrase: str) -> bool:
+    """
+    Checks that grep.PatternSet finds exactly the places where every letter
+    of a pattern is among the ciphertext's candidates, with and without
+    NumPy and however the file is split into blocks
+    """
+    p(f"Grep check")
+    c = load_cipher("QWERTY")
+    rng = random.Random(7)
+    lines = [phrase, phrase.upper(), f"{phrase} {phrase[::-1]}", "", phrase * 9]
+    words = [w for w in c.normalize(phrase, False).split() if len(w) > 1]
+    patterns = words[:3] + [phrase[5:20]]
+    for direction, decode in (("R", "R"), ("E", "D"), ("D", "E")):
+        ciphertext = [
+            c.possibilities(c.normalize(line, False), direction, True, 1, rng=rng)[0]
+            for line in lines
+        ]
+        raw = "\n".join(ciphertext).encode()
+        want = []
+        offset = 0
+        for number, line in enumerate(ciphertext):
+            candidates = ngram.lattice(c, line, decode)
+            for k, pattern in enumerate(c.normalize(x, False) for x in patterns):
+                for j in range(len(line) - len(pattern) + 1):
+                    if all(x in candidates[j + i] for i, x in enumerate(pattern)):
+                        want.append((number, j, offset + j, k))
+            offset += len(line) + 1
+        want.sort(key=lambda hit: (hit[2], hit[3]))
+        found = PatternSet(c, patterns, direction)
+        slow = PatternSet(c, patterns, direction)
+        slow._bytes = None  # as if NumPy were missing
+        for name, ps, size in [("slow", slow, 0), ("block", found, 7)]:
+            for chunk_size in (size, 1 << 20) if size else (1 << 20,):
+                hits = list(ps.search(io.BytesIO(raw), chunk_size=chunk_size))
+                got = [
+                    (h.line, h.column, h.offset, ps.patterns.index(h.pattern))
+                    for h in hits
+                ]
+                if got != want or ps.count(io.BytesIO(raw)) != len(want):
+                    e(f"\tFAILED: {name} {direction} search found {got}, not {want}")
+                    return False
+                if any(
+                    raw[h.offset : h.offset + len(h.text)].decode() != h.text
+                    for h in hits
+                ):
+                    e(f"\tFAILED: {name} {direction} search misplaced its text")
+                    return False
+    return bool(want)
+
+
+def design_check() -> bool:
+    """
+    Checks that Cipher.from_rows links a layout the same as its file, and
+    that the layout search scores swaps the same as whole layouts
+    """
+    p(f"Design check")
+    for layout in ("QWERTY", "Dvorak", "test-alphabet"):
+        c = Cipher(layout)
+        with open(os.path.join(LAYOUT_DIR, c.layout)) as f:
+            rows = f.read().splitlines()
+        built = Cipher.from_rows(rows, layout, reverse=c.reverse)
+        if [cap_list_str(row) for row in built.grid] != [
+            cap_list_str(row) for row in c.grid
+        ] or any(built.tables[d].neighbors != c.tables[d].neighbors for d in "RED"):
+            e(f"\tFAILED: from_rows linked {layout} differently")
+            return False
+        thrown_out = sum(k.bake_surround() for k in c.letter_index.values())
+        if sum(c.irreversible.values()) != thrown_out:
+            e(f"\tFAILED to count the irreversible links of {layout}")
+            return False
+    rows = ["qwertyuiop", "asdfghjkl", "zxcvbnm"]
+    rng = random.Random(6)
+    for objective in OBJECTIVES:
+        scorer = Scorer(objective, {ch: rng.random() for ch in ALPHABET}, "E")
+        letters = list("".join(rows))
+        shape = scorer.geometry([len(row) for row in rows])
+        for _ in range(20):
+            f = scorer.weights(letters)
+            terms = scorer.terms(shape, f)
+            i, j = rng.sample(range(len(letters)), 2)
+            changed = scorer.swap(shape, f, i, j)
+            letters[i], letters[j] = letters[j], letters[i]
+            expected = scorer.score(
+                ["".join(letters[:10]), "".join(letters[10:19]), "".join(letters[19:])]
+            )
+            swapped = scorer.total(terms) + scorer.scale * sum(
+                t - terms[x] for x, t in changed.items()
+            )
+            if abs(swapped - expected) > 1e-9:
+                e(f"\tFAILED: a swap scored {swapped} rather than {expected}")
+                return False
+        best = anneal(rows, scorer, 2000, seed=1)
+        if best.score < scorer.score(rows) or sorted("".join(best.rows)) != sorted(
+            "".join(rows)
+        ):
+            e(f"\tFAILED: the {objective} search made {best} worse")
+            return False
+        Cipher.from_rows(best.rows)  # the result is a usable layout
+    found = search(rows, Scorer("ambiguous"), chains=2, steps=500, seed=2, jobs=2)
+    if len(found) != 2 or found[0].score < found[1].score:
+        e(f"\tFAILED to run the search on a process pool: {found}")
+        return False
+    return True
+
+
+def session_check(phrase: str) -> bool:
+    """
+    Checks that an interactive session's pins, rejections, undo, and redo
+    change the reading as they should, and that the matches it keeps up to
+    date match ones found from scratch
+    """
+    p(f"Session check")
+    c = load_cipher("QWERTY")
+    words = [c.normalize(w) for w in phrase_check(phrase).split()]
+    counts = {w: i + 1 for i, w in enumerate(words + ["ab", "ba", "lazy", "dog"])}
+    cleartext = " ".join(words * 3)
+    ciphertext = c.encode_text(cleartext, False, "R", True, seed=4)[1]
+    s = Solver(c, Dictionary(counts))
+    board = Session(s, ciphertext)
+    board.reading()  # find every match up front, so all of them must be kept right
+    at = len(words[0]) + 1
+    first = board.reading()[0].text
+    board.accept(at, words[1])
+    if board.reading()[0].text[at : at + len(words[1])] != words[1]:
+        e(f"\tFAILED to read {words[1]} after accepting it")
+        return False
+    board.reject(0, board.reading(0, len(words[0]))[0].text)
+    last = len(cleartext) - 1
+    board.exclude(last, board.candidates(last).replace(cleartext[last], "")[0])
+    board.pin(last, cleartext[last])
+    after = board.reading()[0].text
+    fresh = Session(s, ciphertext)
+    fresh.state = fresh.state._replace(
+        letters=board.state.letters, rejected=board.state.rejected
+    )
+    if [board.matches(i) for i in range(len(board))] != [
+        fresh.matches(i) for i in range(len(fresh))
+    ]:
+        e(f"\tFAILED: the session's matches went stale")
+        return False
+    for _ in range(4):
+        board.undo()
+    if board.reading()[0].text != first or board.undo():
+        e(f"\tFAILED to undo back to {first}")
+        return False
+    while board.redo():
+        pass
+    if board.reading()[0].text != after:
+        e(f"\tFAILED to redo back to {after}")
+        return False
+    with tempfile.TemporaryDirectory() as tmp:
+        source, word_list = os.path.join(tmp, "ct.txt"), os.path.join(tmp, "words")
+        with open(source, "w") as f:
+            f.write(ciphertext)
+        with open(word_list, "w") as f:
+            f.write("\n".join(counts))
+        commands = f"accept {at + 1} {words[1]}\nundo\nredo\nbogus\nwords 0\n"
+        commands += f"words {len(ciphertext) + 1}\nshow\nquit\n"
+        result = CliRunner().invoke(session, ["-w", word_list, source], input=commands)
+        shown = result.stdout.splitlines()
+        if (
+            result.exit_code
+            or words[1] not in shown[3]
+            or shown[5] != shown[3]
+            or shown[-2:] != shown[4:6]  # show stays at the last good column
+        ):
+            e(f"\tFAILED: unshark session printed {result.stdout!r}")
+            return False
+    return True
+
+
+def lattice_check(phrase: str) -> bool:
+    """
+    Checks that a lattice file reads back (streamed and memory-mapped) as
+    the candidates the cipher gives, and that --lattice writes the same file
+    """
+    p(f"Lattice check")
+    text = f"{phrase}\n\n{phrase.upper()} ÆØ\n"
+    for layout, strip, direction in [("QWERTY", True, "R"), ("Dvorak", False, "D")]:
+        c = load_cipher(layout)
+        binary = io.BytesIO()
+        LatticeWriter(c, binary, direction, strip).write_all(text.splitlines())
+        expected = [
+            [
+                set(options)
+                for options in ngram.lattice(c, c.normalize(line, strip), direction)
+            ]
+            for line in text.splitlines()
+        ]
+        flags = [
+            "-k",
+            layout,
+            direction_flags[direction],
+            "--strip" if strip else "--include",
+        ]
+        result = CliRunner().invoke(shark, ["--lattice", *flags, "-"], input=text)
+        if result.exit_code or result.stdout_bytes != binary.getvalue():
+            e(f"\tFAILED: --lattice {' '.join(flags)} wrote something else")
+            return False
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "text.lattice")
+            with open(path, "wb") as f:
+                f.write(binary.getvalue())
+            for source in (io.BytesIO(binary.getvalue()), open(path, "rb")):
+                with LatticeReader(source) as reader:
+                    found = [
+                        [set(options) for options in line.candidates()]
+                        for line in reader
+                    ]
+                    if reader.header["layout"] != c.layout or found != expected:
+                        e(f"\tFAILED to read back the lattice of {layout}")
+                        return False
+    return True
+
+
+def serve_check(phrase: str) -> bool:
+    """
+    Checks that the server gives the same answers as the cipher and the
+    shark command, and that small --fixed encodes sent together share a batch
+    """
+    p(f"Serve check")
+    server = SharkServer(["QWERTY", "Dvorak"], batch_delay=0.05)
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, "shark.sock")
+        source = os.path.join(tmp, "text.txt")
+        with open(source, "w") as f:
+            f.write(f"{phrase}\n{phrase.upper()}\n")
+        with server.running(address):
+            for args, stdin in [
+                (["--fixed", "--offset", "3", "-k", "Dvorak", source], ""),
+                (["--fixed", "--only-one", "--include", "-"], phrase),
+                (["--fixed", "--seed", "5", "--random", source], ""),
+                (["--fixed", "-j", "x", source], ""),
+            ]:
+                reply = request("/shark", {"args": args, "stdin": stdin}, address)
+                local = CliRunner().invoke(shark, args, input=stdin)
+                if (reply["stdout"], reply["exit"]) != (local.stdout, local.exit_code):
+                    e(f"\tFAILED: the server ran {args} differently")
+                    return False
+            # --corpus is read after the command line is parsed
+            args = ["text.txt", "--best", "--corpus", "text.txt"]
+            reply = request("/shark", {"args": args, "cwd": tmp}, address)
+            local = CliRunner().invoke(shark, [source, "--best", "--corpus", source])
+            if (reply["stdout"], reply["exit"]) != (local.stdout, local.exit_code):
+                e(f"\tFAILED: the server read --corpus outside of cwd")
+                return False
+            c = load_cipher("QWERTY")
+            texts = [phrase[i:] for i in range(12)]
+            with ThreadPoolExecutor(len(texts)) as pool:
+                replies = list(
+                    pool.map(
+                        lambda i: request(
+                            "/encode",
+                            {"text": texts[i], "random": False, "start": i, "jump": 3},
+                            address,
+                        ),
+                        range(len(texts)),
+                    )
+                )
+            for i, reply in enumerate(replies):
+                if reply["rows"] != c.encode_text(texts[i], True, "R", False, 8, i, 3):
+                    e(f"\tFAILED: the server encoded {texts[i]!r} differently")
+                    return False
+            if server.batches >= len(texts):
+                e(f"\tFAILED to batch {len(texts)} encodes together")
+                return False
+            ciphertext = c.encode_text(phrase, True, "E", False, start=2)[1]
+            sock = connect(address)  # one connection for several requests
+            try:
+                decoded = request(
+                    "/decode",
+                    {"text": ciphertext, "direction": "E", "start": 2},
+                    sock=sock,
+                )
+                checked = request(
+                    "/verify",
+                    {"cleartext": phrase, "ciphertext": ciphertext, "direction": "D"},
+                    sock=sock,
+                )
+            finally:
+                sock.close()
+            if (
+                decoded["text"] != c.decode_fixed(ciphertext, "E", 2)
+                or checked["mismatches"]
+            ):
+                e(f"\tFAILED: /decode or /verify disagree with the cipher")
+                return False
+            try:
+                request("/encode", {"layout": "no such layout", "text": "x"}, address)
+                e(f"\tFAILED to reject a missing layout")
+                return False
+            except ServerError:
+                pass
+    return True
+
+
+def startup_check(phrase: str, tries: int = 3) -> bool:
+    """
+    Checks that python -m oneline matches --only-one and that importing it
+    stays within its time budget without pulling in the CLI machinery
+    """
+    p(f"Startup check")
+    here = os.path.dirname(os.path.abspath(__file__))
+    timing = (
+        "import sys, time; t = time.perf_counter(); import oneline; "
+        "print(time.perf_counter() - t); "
+        "print(*(m for m in ('click', 'typing', 'json') if m in sys.modules))"
+    )
+    best = float("inf")
+    for _ in range(tries):
+        run = subprocess.run(
+            [sys.executable, "-c", timing], cwd=here, capture_output=True, text=True
+        )
+        seconds, heavy = run.stdout.split("\n")[:2]
+        if heavy:
+            e(f"\tFAILED: importing oneline imported {heavy}")
+            return False
+        best = min(best, float(seconds))
+    if best > IMPORT_BUDGET:
+        e(f"\tFAILED: importing oneline took {best:.4f}s (budget {IMPORT_BUDGET}s)")
+        return False
+    for args in [
+        ["--fixed"],
+        ["-k", "Dvorak", "--fixed", "--offset", "3", "-j", "2", "--include"],
+        ["--layout=Colemak", "--fixed", "--encrypt", "--start=-1"],
+        ["--fixed", "--seed", "4"],  # handed over to the shark command
+        ["--fixed", "-j=-2"],  # an error there, since Click does not split -j=
+    ]:
+        quick = subprocess.run(
+            [sys.executable, "-m", "oneline", *args, "-"],
+            cwd=here,
+            input=f"{phrase}\n{phrase.upper()}\n",
+            capture_output=True,
+            text=True,
+        )
+        full = CliRunner().invoke(
+            shark, ["--only-one", *args, "-"], input=f"{phrase}\n{phrase.upper()}\n"
+        )
+        if quick.returncode != full.exit_code or quick.stdout != full.stdout:
+            e(f"\tFAILED: python -m oneline {' '.join(args)} differs from shark")
+            return False
+    return True
+
+
+def bench_check() -> bool:
+    """
+    Checks the benchmark inputs and that the baseline comparison only
+    flags results beyond the threshold
+    """
+    p(f"Bench check")
+    if parse_size("64K") != 65536 or parse_size("100M") != 100 << 20:
+        e(f"\tFAILED to parse sizes")
+        return False
+    for punctuated in (False, True):
+        text = sample_text(5000, punctuated, line=80)
+        if len(text) != 5000 or text != sample_text(5000, punctuated, line=80):
+            e(f"\tFAILED to make {len(text)} characters reproducibly")
+            return False
+    baseline = {"results": {"x": {"rate": 1000.0, "peak": 1 << 20}}}
+    fine = Result("x", "chars", 800, 1.0, 1 << 20)
+    slow = Result("x", "chars", 700, 1.0, 1 << 20)
+    big = Result("x", "chars", 1000, 1.0, 2 << 20)
+    new = Result("y", "chars", 1, 1.0, 0)
+    if compare([fine, new], baseline, 0.25) or len(compare([slow, big], baseline)) != 2:
+        e(f"\tFAILED to compare with the baseline")
+        return False
+    return True
+
+
+def solver_check(layout: str, phrase: str) -> bool:
+    """
+    Encrypts the phrase with and without its spaces and checks that the
+    dictionary solver finds it among its readings
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tSolver check")
+    words = [c.normalize(w) for w in phrase.split()]
+    d = Dictionary(words + ["ab", "ba", "lazy", "dog", "spy", "fax"])
+    for directed in (False, True):
+        s = Solver(c, d, "D" if directed else "R")
+        for drop in (True, False):
+            cleartext = c.normalize(" ".join(words), drop)
+            crypt = c.encode_text(cleartext, drop, "E" if directed else "R", seed=1)
+            readings = [r.text for r in s.solve(crypt[1], 50)]
+            if cleartext not in readings:
+                e(f"\t\tFAILED to solve {crypt[1]} (directed={directed})")
+                return False
+    return True
+
+
+def index_check(layout: str, phrase: str) -> bool:
+    """
+    Checks that a word index finds the same words as the dictionary solver,
+    and finds every word of the phrase from its ciphertext
+    """
+    phrase = phrase_check(phrase)
+    c = Cipher(layout)
+    p(f"\tIndex check")
+    words = [c.normalize(w) for w in phrase.split()]
+    counts = {w: i + 1 for i, w in enumerate(words + ["ab", "ba", "lazy", "dog"])}
+    with tempfile.TemporaryDirectory() as tmp:
+        for directed in (False, True):
+            direction = "D" if directed else "R"
+            s = Solver(c, Dictionary(counts), direction)
+            path = os.path.join(tmp, f"{direction}.sharkidx")
+            with WordIndex.build(c, counts, direction, path) as idx:
+                for word in words:
+                    crypt = c.encode_text(word, True, "E" if directed else "R", seed=2)
+                    found = idx.lookup(crypt[1])
+                    if word not in [w for w, _ in found]:
+                        e(f"\t\tFAILED to find {word} from {crypt[1]}")
+                        return False
+                    if sorted(w for w, _ in found) != sorted(
+                        w for _, w in s.words(crypt[1])
+                    ):
+                        e(f"\t\tFAILED to match the solver for {crypt[1]}")
+                        return False
+                    if [n for _, n in found] != sorted(
+                        (n for _, n in found), reverse=True
+                    ):
+                        e(f"\t\tFAILED to sort {crypt[1]} by count")
+                        return False
+    return True
+
+
+def stream_check(phrase: str) -> bool:
+    """
+    Checks that --stream --only-one output matches the line-by-line output
+    whatever size the chunks are cut to
+    """
+    p(f"Stream check")
+    c = Cipher()
+    text = f"  {phrase}\n\n{phrase * 5}  \t{phrase} \r\n  {phrase.upper()}  "
+    for drop in (True, False):
+        expected = "".join(
+            display_possibilities(
+                c.encode_text(line, drop, "R", False, start=3, jump=-2), True
+            )
+            + "\n"
+            for line in io.StringIO(text, newline=None)
+        )
+        for chunk_size in (1, 5, 64, 1 << 20):
+            raw = io.TextIOWrapper(io.BytesIO(text.encode()), encoding="utf-8")
+            out = io.BytesIO()
+            with BufferedOutput(out, chunk_size) as buffered:
+                stream_shark(
+                    c, raw, buffered, drop, "R", False, 3, -2, True, "-", chunk_size
+                )
+            if out.getvalue().decode() != expected:
+                e(f"\tFAILED with drop={drop} and chunk_size={chunk_size}")
+                return False
+    return True
+
+
+def jobs_check(phrase: str) -> bool:
+    """
+    Checks that encoding with a process pool gives the same output as one
+    process, both for --fixed and for seeded --random output
+    """
+    p(f"Jobs check")
+    c = Cipher()
+    text = [f"{phrase}\n" * 20, phrase * 50, "\n"]
+    for rnd in (False, True):
+        runs = [
+            "".join(shark_stream(c, text, rnd=rnd, chunk_size=100, jobs=jobs, seed=42))
+            for jobs in (1, 3)
+        ]
+        if runs[0] != runs[1]:
+            e(f"\tFAILED with rnd={rnd}")
+            return False
+    return True
+
+
+def registry_check(layout: str) -> bool:
+    """Checks that load_cipher shares one Cipher per layout, linked as usual"""
+    p(f"\tRegistry check")
+    c = load_cipher(layout)
+    if c is not load_cipher(layout.upper()):
+        e(f"\t\tFAILED to share the registered cipher for {layout}")
+        return False
+    fresh = Cipher(layout)
+    if any(c.tables[d].neighbors != fresh.tables[d].neighbors for d in "RED"):
+        e(f"\t\tFAILED: the registered {layout} differs from a fresh one")
+        return False
+    return True
+
+
+def mask_check(layout: str) -> bool:
+    """
+    Checks that the Keycap bitmasks agree with the lists they stand for
+    """
+    p(f"\tMask check")
+    c = Cipher(layout)
+    for direction, method in direction_methods.items():
+        if direction not in "RED":
+            continue
+        for letter, k in c.letter_index.items():
+            names = cap_list_str(getattr(k, method))
+            for other in c.letter_index:
+                if c.linked(letter, other, direction) != (other in names):
+                    e(f"\t\tFAILED: {letter}-{other} ({direction})")
+                    return False
+    return True
+
+
 def association_check(layout: str) -> bool:
     """
     Checks that each letter is contained in the surrounding of each letter that
@@ -117,6 +1121,23 @@ def run_tests(phrase: str) -> List[bool]:
         test_catch_missing(),
         test_invalid_repeat(),
         test_ignore_missing(),
+        stream_check(phrase),
+        jobs_check(phrase),
+        invert_check(phrase),
+        recover_check(phrase),
+        detect_check(),
+        bench_check(),
+        stats_check(phrase),
+        ngram_check(phrase),
+        lattice_check(phrase),
+        session_check(phrase),
+        design_check(),
+        follow_check(phrase),
+        memo_check(phrase),
+        lazy_check(phrase),
+        grep_check(phrase),
+        serve_check(phrase),
+        startup_check(phrase),
     ]
     for layout in [
         "QWERTY",
@@ -130,8 +1151,16 @@ def run_tests(phrase: str) -> List[bool]:
         results.extend(
             [
                 association_check(layout),  # make sure the letters are properly linked
+                mask_check(layout),  # the bitmasks match the lists
+                registry_check(layout),  # load_cipher shares fresh ciphers
                 reverse(layout, phrase),  # encrypt and then decipher a text
                 reverse(layout, phrase, directed=True),  # same as above but directed
+                fixed_check(layout, phrase),  # compiled tables match encode_chr
+                verify_check(layout, phrase),  # bulk mismatches match encode_chr
+                batch_check(layout, phrase),  # NumPy rows match the tables
+                random_check(layout, phrase),  # --random is safe to share
+                solver_check(layout, phrase),  # the dictionary solver finds it
+                index_check(layout, phrase),  # so does the word index
             ]
         )
     return results
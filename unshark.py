@@ -1,15 +1,810 @@
 #!/usr/bin/env python3
 
-import click
+import heapq
+import math
+import re
 from typing import *
-from .cipher import *
+
+import click
+
+from cipher import *
+from wordindex import WordIndex
 
 """
-A stub file for later development of an interactive cipher-solver using a
-dictionary.
+A dictionary-driven solver for shark ciphertext.
+
+Each ciphertext letter could have come from any of its possibilities in the
+decoding direction, so the solver walks a trie of the dictionary along those
+candidate sets and keeps the k cheapest ways to cut the whole text into
+words.  Text encoded with --strip (no spaces) is segmented the same way as
+text with its spaces left in.  Positions no dictionary word can explain are
+kept as bracketed candidate sets so names and typos do not sink a solution.
 
-If you implement this, please submit a pull request.
+A Session solves interactively: pinning letters and accepting or rejecting
+words narrows the candidates a few positions at a time, and undo and redo
+step between snapshots that share everything the changes left alone.
 """
 
+DEFAULT_DICTIONARY: str = "/usr/share/dict/words"
+
+
+def read_word_counts(path: str = DEFAULT_DICTIONARY) -> Dict[str, int]:
+    """
+    Reads a word list with one word per line, optionally followed by
+    whitespace and a count; words with anything besides letters are skipped
+    """
+    counts: Dict[str, int] = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parts = line.split()
+            if not parts or not parts[0].isalpha():
+                continue
+            word = parts[0].lower()
+            count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+            counts[word] = counts.get(word, 0) + count
+    return counts
+
+
+class Dictionary:
+    """
+    A word list stored as a trie of nested dicts
+
+    Each word's node holds its cost under the "" key.  Costs are negative
+    log probabilities, from the counts when the word list has them
+    ("word count" per line) and otherwise the same for every word, so the
+    cheapest segmentation is the one with the fewest words.
+    """
+
+    def __init__(self, words: Union[Iterable[str], Dict[str, int]]):
+        counts: Dict[str, int] = (
+            dict(words) if isinstance(words, dict) else {w: 1 for w in words}
+        )
+        total: int = sum(counts.values()) or 1
+        self.root: Dict[str, Any] = {}
+        self.size: int = 0
+        self.longest: int = 0
+        self.worst: float = 0.0  # the highest cost of any word
+        for word, count in counts.items():
+            word = word.strip().lower()
+            if not word or count <= 0:
+                continue
+            node = self.root
+            for ch in word:
+                node = node.setdefault(ch, {})
+            cost = math.log(total / count)
+            if "" not in node:
+                self.size += 1
+            node[""] = min(node.get("", cost), cost)
+            self.longest = max(self.longest, len(word))
+            self.worst = max(self.worst, node[""])
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_DICTIONARY) -> "Dictionary":
+        """Reads a word list (see read_word_counts)"""
+        return cls(read_word_counts(path))
+
+    def __contains__(self, word: str) -> bool:
+        node = self.root
+        for ch in word:
+            node = node.get(ch)
+            if node is None:
+                return False
+        return "" in node
+
+    def matches(
+        self, candidates: Sequence[str], start: int = 0
+    ) -> Iterator[Tuple[int, str, float]]:
+        """
+        Yields (end, word, cost) for every word that can be spelled from
+        position start onwards taking one letter from each candidate set
+        (a None in candidates ends every word)
+        """
+        stack: List[Tuple[Dict[str, Any], int, str]] = [(self.root, start, "")]
+        while stack:
+            node, at, word = stack.pop()
+            if "" in node and word:
+                yield at, word, node[""]
+            if at >= len(candidates) or candidates[at] is None:
+                continue
+            for ch in candidates[at]:
+                child = node.get(ch)
+                if child is not None:
+                    stack.append((child, at + 1, word + ch))
+
+
+class Solution(NamedTuple):
+    """
+    One reading of a ciphertext
+
+    pieces are the dictionary words, the separators that were in the
+    ciphertext, and "[…]" candidate sets where no word fit.
+    """
+
+    cost: float
+    pieces: Tuple[str, ...]
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces)
+
+    def __str__(self) -> str:
+        return self.text
+
+
+class Solver:
+    """
+    Finds dictionary words and segmentations consistent with ciphertext
+
+    direction is the direction used to decode, as with the shark command:
+    'R' for ciphertext made with --reversible and 'D' for ciphertext made
+    with --encrypt.
+    """
+
+    def __init__(self, c: Cipher, dictionary: Dictionary, direction: chr = "R"):
+        self.cipher: Cipher = c
+        self.dictionary: Dictionary = dictionary
+        self.direction: chr = direction.upper().strip()[0]
+        self.neighbors: Dict[chr, str] = c.tables[self.direction].neighbors
+        # an unexplained letter costs more than any word that could cover it
+        self.unknown_cost: float = 2 * dictionary.worst + 1
+
+    def candidates(self, ciphertext: str) -> List[Optional[str]]:
+        """
+        The possible cleartext letters for each position, or None for
+        characters outside the layout (spaces, punctuation, …)
+        """
+        return [
+            "".join(dict.fromkeys(self.neighbors.get(ch) or "")) or None
+            for ch in ciphertext
+        ]
+
+    def fixed_candidates(
+        self, ciphertext: str, start: int = 0, jump: int = 1
+    ) -> List[Optional[str]]:
+        """
+        Like Solver.candidates, but for --fixed ciphertext made with a known
+        start and jump, where Cipher.invert narrows each position down to
+        the letters that fit its place in the rotation
+        """
+        # the direction that made the ciphertext, not the one that decodes it
+        made_with = {"R": "R", "D": "E", "E": "D"}[self.direction]
+        return [
+            None if ch not in self.neighbors else options or None
+            for ch, options in zip(
+                ciphertext, self.cipher.invert(ciphertext, made_with, start, jump)
+            )
+        ]
+
+    def words(self, ciphertext_word: str) -> List[Tuple[float, str]]:
+        """Dictionary words the ciphertext word could decipher to, cheapest first"""
+        candidates = self.candidates(ciphertext_word.strip().lower())
+        return sorted(
+            (cost, word)
+            for end, word, cost in self.dictionary.matches(candidates)
+            if end == len(candidates)
+        )
+
+    def solve(
+        self, ciphertext: str, k: int = 5, fixed: Tuple[int, int] = None
+    ) -> List[Solution]:
+        """
+        Returns the k cheapest readings of the ciphertext (see segment)
+
+        Words never cross a character outside the layout, which is passed
+        through as it is.
+
+        fixed is the (start, jump) of --fixed ciphertext, if known.
+        """
+        text: str = self.cipher.normalize(ciphertext, drop=False)
+        candidates = (
+            self.candidates(text)
+            if fixed is None
+            else self.fixed_candidates(text, *fixed)
+        )
+        return segment(
+            text,
+            candidates,
+            lambda i: self.dictionary.matches(candidates, i),
+            self.unknown_cost,
+            k,
+        )
+
+
+def segment(
+    text: str,
+    candidates: Sequence[Optional[str]],
+    words: Callable[[int], Iterable[Tuple[int, str, float]]],
+    unknown_cost: float,
+    k: int = 5,
+    start: int = 0,
+    end: int = None,
+) -> List[Solution]:
+    """
+    The k cheapest ways to cut text[start:end] into words, where words(i)
+    gives (end, word, cost) for the words starting at i (as
+    Dictionary.matches does); words running past end are left out
+
+    Keeps the k best ways to reach every position, extending each one by
+    every word that starts there.  Positions with no candidates (None) are
+    passed through as they are, and any other position can be left
+    unexplained for unknown_cost, shown as its "[candidates]".
+    """
+    end = len(text) if end is None else end
+    n = end - start
+    # best[i]: up to k (cost, previous position, rank there, piece), counting
+    # positions from start
+    best: List[List[Tuple[float, int, int, str]]] = [[] for _ in range(n + 1)]
+    best[0] = [(0.0, -1, -1, "")]
+    for i in range(n):
+        if not best[i]:
+            continue
+        best[i] = heapq.nsmallest(k, best[i])  # final from here on
+        at = start + i
+        if candidates[at] is None:
+            steps = [(i + 1, text[at], 0.0)]
+        else:
+            steps = [
+                (stop - start, w, cost) for stop, w, cost in words(at) if stop <= end
+            ]
+            steps.append((i + 1, f"[{candidates[at]}]", unknown_cost))
+        for stop, piece, cost in steps:
+            for rank, (so_far, *_) in enumerate(best[i]):
+                best[stop].append((so_far + cost, i, rank, piece))
+
+    solutions: List[Solution] = []
+    for cost, at, rank, piece in sorted(best[n])[:k]:
+        pieces: List[str] = [piece] if n else []
+        while at > 0:
+            _, at, rank, piece = best[at][rank]
+            pieces.append(piece)
+        solutions.append(Solution(cost, tuple(reversed(pieces))))
+    return solutions
+
+
+class Vector:
+    """
+    A persistent list: Vector.set returns a new Vector and leaves this one
+    as it was, sharing every chunk of CHUNK items that did not change
+    """
+
+    CHUNK: int = 256
+    __slots__ = ("chunks", "size")
+
+    def __init__(self, items: Iterable = (), chunks: Tuple[Tuple, ...] = None):
+        if chunks is None:
+            items = list(items)
+            chunks = tuple(
+                tuple(items[i : i + self.CHUNK])
+                for i in range(0, len(items), self.CHUNK)
+            )
+        self.chunks: Tuple[Tuple, ...] = chunks
+        self.size: int = sum(len(chunk) for chunk in chunks)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> Any:
+        if not 0 <= i < self.size:
+            raise IndexError(i)
+        return self.chunks[i // self.CHUNK][i % self.CHUNK]
+
+    def __iter__(self) -> Iterator:
+        for chunk in self.chunks:
+            yield from chunk
+
+    def set(self, changes: Dict[int, Any]) -> "Vector":
+        """A copy with changes (position -> value) made"""
+        if not changes:
+            return self
+        chunks: List = list(self.chunks)
+        copied: Dict[int, List] = {}
+        for i, value in changes.items():
+            if not 0 <= i < self.size:
+                raise IndexError(i)
+            c = i // self.CHUNK
+            if c not in copied:
+                copied[c] = list(chunks[c])
+            copied[c][i % self.CHUNK] = value
+        for c, chunk in copied.items():
+            chunks[c] = tuple(chunk)
+        return Vector(chunks=tuple(chunks))
+
+
+class Snapshot(NamedTuple):
+    """
+    Everything a Session knows at one point, kept whole for undo and redo
+
+    letters are the candidates left at each position (None outside the
+    layout), rejected the words turned down at each position, and matches
+    the dictionary words found from each position (None until needed).
+    Each is a Vector, so a snapshot costs only the chunks that changed.
+    """
+
+    letters: Vector
+    rejected: Vector
+    matches: Vector
+    action: str
+
+
+class Session:
+    """
+    Solves one ciphertext step by step, answering each change quickly
+
+    Pinning a letter, excluding one, or accepting a word narrows the
+    candidates at a few positions, and only the dictionary matches that
+    start close enough to reach those positions are thrown away.  Matches
+    are found the first time something asks for them, so a reading of a
+    window of the text costs about the same however long the text is.
+    Positions count from 0 in the normalized ciphertext.
+    """
+
+    def __init__(self, solver: Solver, ciphertext: str, fixed: Tuple[int, int] = None):
+        self.solver: Solver = solver
+        self.text: str = solver.cipher.normalize(ciphertext, drop=False)
+        self.original: List[Optional[str]] = (
+            solver.candidates(self.text)
+            if fixed is None
+            else solver.fixed_candidates(self.text, *fixed)
+        )
+        blank = [None] * len(self.text)
+        self.state: Snapshot = Snapshot(
+            Vector(self.original), Vector(blank), Vector(blank), "start"
+        )
+        self.history: List[Snapshot] = []
+        self.future: List[Snapshot] = []
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def candidates(self, position: int) -> Optional[str]:
+        return self.state.letters[position]
+
+    # --- changes ---
+
+    def pin(self, position: int, letter: chr) -> None:
+        """Fixes the cleartext letter at position"""
+        self._check(position, letter, self.original)
+        self._change({position: letter}, {}, f"pin {position} {letter}")
+
+    def unpin(self, position: int) -> None:
+        """Puts back every candidate the ciphertext allows at position"""
+        self._check(position)
+        self._change({position: self.original[position]}, {}, f"unpin {position}")
+
+    def exclude(self, position: int, letter: chr) -> None:
+        """Rules out one candidate at position"""
+        self._check(position, letter)
+        left = self.state.letters[position].replace(letter, "")
+        if not left:
+            raise ValueError(f"{letter} is the only letter left there")
+        self._change({position: left}, {}, f"exclude {position} {letter}")
+
+    def accept(self, position: int, word: str) -> None:
+        """Pins every letter of word, starting at position"""
+        word = word.lower()
+        for i, letter in enumerate(word):
+            self._check(position + i, letter)
+        pins = {position + i: letter for i, letter in enumerate(word)}
+        self._change(pins, {}, f"accept {position} {word}")
+
+    def reject(self, position: int, word: str) -> None:
+        """Stops word being read at position"""
+        self._check(position)
+        word = word.lower()
+        rejected = self.state.rejected[position] or frozenset()
+        self._change({}, {position: rejected | {word}}, f"reject {position} {word}")
+
+    def undo(self) -> bool:
+        """Goes back one change; False if there is nothing to undo"""
+        if not self.history:
+            return False
+        self.future.append(self.state)
+        self.state = self.history.pop()
+        return True
+
+    def redo(self) -> bool:
+        """Makes the last undone change again; False if there is none"""
+        if not self.future:
+            return False
+        self.history.append(self.state)
+        self.state = self.future.pop()
+        return True
+
+    def _check(self, position: int, letter: chr = None, letters=None) -> None:
+        if not 0 <= position < len(self.text):
+            raise ValueError("That is outside the ciphertext")
+        options = (letters or self.state.letters)[position]
+        if options is None:
+            raise ValueError(f"{self.text[position]!r} is not a letter")
+        if letter is not None and letter not in options:
+            raise ValueError(f"{letter} cannot be there (only {options})")
+
+    def _change(
+        self, letters: Dict[int, Optional[str]], rejected: Dict[int, Any], action: str
+    ) -> None:
+        state = self.state
+        stale: Set[int] = set(rejected)
+        for position in letters:
+            stale.update(self._reaching(position))
+        self.history.append(state)
+        self.future.clear()
+        self.state = Snapshot(
+            state.letters.set(letters),
+            state.rejected.set(rejected),
+            state.matches.set({i: None for i in stale if state.matches[i] is not None}),
+            action,
+        )
+
+    def _reaching(self, position: int) -> Iterator[int]:
+        """The positions a word could start at and still cover position"""
+        letters = self.state.letters
+        longest = self.solver.dictionary.longest
+        for start in range(position, max(position - longest, -1), -1):
+            if letters[start] is None:
+                return  # no word crosses a character outside the layout
+            yield start
+
+    # --- answers ---
+
+    def matches(self, position: int) -> Tuple[Tuple[int, str, float], ...]:
+        """(end, word, cost) for each word that can start at position"""
+        self._find(position, position + 1)
+        return self.state.matches[position] or ()
+
+    def _find(self, start: int, end: int) -> None:
+        """Fills in the matches from start to end that are not known yet"""
+        state = self.state
+        found: Dict[int, Tuple] = {}
+        for i in range(start, end):
+            if state.matches[i] is not None or state.letters[i] is None:
+                continue
+            rejected = state.rejected[i] or ()
+            found[i] = tuple(
+                sorted(
+                    (stop, word, cost)
+                    for stop, word, cost in self.solver.dictionary.matches(
+                        state.letters, i
+                    )
+                    if word not in rejected
+                )
+            )
+        if found:
+            # the snapshot does not really change, so neither do undo and redo
+            self.state = state._replace(matches=state.matches.set(found))
+
+    def reading(self, start: int = 0, end: int = None, k: int = 1) -> List[Solution]:
+        """The k cheapest readings of the text from start to end"""
+        end = len(self.text) if end is None else min(end, len(self.text))
+        start = max(0, min(start, end))
+        self._find(start, end)
+        matches = self.state.matches
+        return segment(
+            self.text,
+            self.state.letters,
+            lambda i: matches[i] or (),
+            self.solver.unknown_cost,
+            k,
+            start,
+            end,
+        )
+
+
+@click.group()
+def unshark():
+    """
+    Tools for cracking shark ciphertext with a dictionary
+    """
+
+
+@unshark.command()
+@click.argument("text", type=click.File(), nargs=1)
+@click.option(
+    "-k",
+    "--layout",
+    default="QWERTY",
+    type=click.STRING,
+    help="The layout the ciphertext was made with.",
+)
+@click.option(
+    "-w",
+    "--dictionary",
+    "word_list",
+    default=DEFAULT_DICTIONARY,
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Word list with one word (and optionally a count) per line.",
+)
+@click.option(
+    "-n",
+    "--results",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="How many readings to show for each line.",
+)
+@click.option(
+    "--fixed",
+    is_flag=True,
+    help="TEXT was made with --fixed (give its --offset and -j too).",
+)
+@click.option("--offset", "--start", "start", type=click.INT, default=0)
+@click.option("-j", "skip", type=click.INT, default=1)
+@click.option(
+    "--reversible",
+    "direction",
+    flag_value="R",
+    default=True,
+    help="""[DEFAULT] TEXT was made with --reversible""",
+)
+@click.option(
+    "--decipher",
+    "direction",
+    flag_value="D",
+    help="""TEXT was made with --encrypt""",
+)
+@click.option(
+    "--encrypt",
+    "direction",
+    flag_value="E",
+    help="""TEXT was made with --decipher""",
+)
+def solve(
+    text,
+    layout: str,
+    word_list: str,
+    results: int,
+    fixed: bool,
+    start: int,
+    skip: int,
+    direction: chr,
+) -> None:
+    """
+    Lists the most likely readings of each line of ciphertext in TEXT
+
+    Use - for TEXT to read from stdin.  Letters no dictionary word fits are
+    shown as [candidates].
+    """
+    s = Solver(load_cipher(layout), Dictionary.load(word_list), direction)
+    for line in text:
+        for solution in s.solve(line, results, (start, skip) if fixed else None):
+            p(f"{solution.cost:8.2f}\t{solution}")
+        p("")
+
+
+SESSION_HELP: str = """\
+show [COLUMN]          the reading around COLUMN (or where you last were)
+words COLUMN           the words that could start at COLUMN
+pin COLUMN LETTER      fix the letter at COLUMN
+unpin COLUMN           put back every letter COLUMN could be
+exclude COLUMN LETTER  rule out a letter at COLUMN
+accept COLUMN WORD     pin the letters of WORD from COLUMN on
+reject COLUMN WORD     never read WORD at COLUMN
+undo, redo, help, quit"""
+
+
+def aligned(solution: Solution) -> str:
+    """
+    A reading with each "[candidates]" piece shown as its letter if only
+    one is left and ? if not, so it lines up with the ciphertext
+    """
+    return "".join(
+        (piece[1] if len(piece) == 3 else "?") if piece.startswith("[") else piece
+        for piece in solution.pieces
+    )
+
+
+@unshark.command()
+@click.argument("text", type=click.File(), nargs=1)
+@click.option(
+    "-k",
+    "--layout",
+    default="QWERTY",
+    type=click.STRING,
+    help="The layout the ciphertext was made with.",
+)
+@click.option(
+    "-w",
+    "--dictionary",
+    "word_list",
+    default=DEFAULT_DICTIONARY,
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Word list with one word (and optionally a count) per line.",
+)
+@click.option(
+    "--width",
+    type=click.IntRange(min=10),
+    default=72,
+    show_default=True,
+    help="How many columns of the ciphertext to show at a time.",
+)
+@click.option(
+    "--fixed",
+    is_flag=True,
+    help="TEXT was made with --fixed (give its --offset and -j too).",
+)
+@click.option("--offset", "--start", "start", type=click.INT, default=0)
+@click.option("-j", "skip", type=click.INT, default=1)
+@click.option(
+    "--reversible",
+    "direction",
+    flag_value="R",
+    default=True,
+    help="""[DEFAULT] TEXT was made with --reversible""",
+)
+@click.option(
+    "--decipher",
+    "direction",
+    flag_value="D",
+    help="""TEXT was made with --encrypt""",
+)
+@click.option(
+    "--encrypt",
+    "direction",
+    flag_value="E",
+    help="""TEXT was made with --decipher""",
+)
+def session(
+    text,
+    layout: str,
+    word_list: str,
+    width: int,
+    fixed: bool,
+    start: int,
+    skip: int,
+    direction: chr,
+) -> None:
+    """
+    Solves the ciphertext in TEXT interactively, one command per line of
+    stdin (type help for the commands)
+
+    Columns count from 1 through the whole of TEXT, line breaks included,
+    once the whitespace at its start and end is stripped.
+    """
+    s = Solver(load_cipher(layout), Dictionary.load(word_list), direction)
+    board = Session(s, text.read(), (start, skip) if fixed else None)
+    interactive = sys.stdin.isatty()
+    column = 1
+
+    def show(at: int) -> None:
+        left = max(0, min(at - 1 - width // 2, len(board) - width))
+        right = min(left + width, len(board))
+        reading = board.reading(left, right)[0]
+        p(f"{left + 1:>6} {board.text[left:right]}".replace("\n", " "))
+        p(f"{'':>6} {aligned(reading)}".replace("\n", " "))
+
+    show(column)
+    while True:
+        if interactive:
+            click.echo("unshark> ", nl=False)
+        command = sys.stdin.readline()
+        if not command:
+            break
+        words = command.split()
+        if not words:
+            continue
+        verb, args = words[0].lower(), words[1:]
+        try:
+            if verb in ("quit", "exit", "q"):
+                break
+            if verb == "help":
+                p(SESSION_HELP)
+                continue
+            if verb in ("undo", "redo"):
+                if not getattr(board, verb)():
+                    p(f"Nothing to {verb}")
+                show(column)
+                continue
+            if args:
+                at = int(args[0])
+                if not 1 <= at <= len(board):
+                    raise ValueError("That is outside the ciphertext")
+                column = at
+            if verb == "show":
+                show(column)
+            elif verb == "words":
+                found = board.matches(column - 1)
+                p(" ".join(word for _, word, _ in sorted(found, key=lambda m: m[2])))
+            elif verb in ("pin", "exclude", "accept", "reject") and len(args) == 2:
+                getattr(board, verb)(column - 1, args[1])
+                show(column)
+            elif verb == "unpin" and len(args) == 1:
+                board.unpin(column - 1)
+                show(column)
+            else:
+                p(f"Not a command: {command.strip()} (try help)")
+        except ValueError as x:
+            e(f"Error: {x}")
+
+
+@unshark.group()
+def index():
+    """
+    Build and query word indexes
+
+    An index maps each ciphertext word straight to the dictionary words it
+    could decipher to, for one layout and direction.
+    """
+
+
+@index.command()
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "-k",
+    "--layout",
+    default="QWERTY",
+    type=click.STRING,
+    help="The layout the ciphertext will be made with.",
+)
+@click.option(
+    "-w",
+    "--dictionary",
+    "word_list",
+    default=DEFAULT_DICTIONARY,
+    show_default=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Word list with one word (and optionally a count) per line.",
+)
+@click.option(
+    "--reversible",
+    "direction",
+    flag_value="R",
+    default=True,
+    help="""[DEFAULT] For ciphertext made with --reversible""",
+)
+@click.option(
+    "--decipher",
+    "direction",
+    flag_value="D",
+    help="""For ciphertext made with --encrypt""",
+)
+@click.option(
+    "--encrypt",
+    "direction",
+    flag_value="E",
+    help="""For ciphertext made with --decipher""",
+)
+def build(output: str, layout: str, word_list: str, direction: chr) -> None:
+    """
+    Writes a word index to OUTPUT
+    """
+    with WordIndex.build(
+        load_cipher(layout), read_word_counts(word_list), direction, output
+    ) as idx:
+        e(
+            f"Indexed {sum(g['count'] for g in idx.groups.values())} words "
+            f"for {idx.header['layout']} ({idx.header['direction']})"
+        )
+
+
+@index.command()
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("text", type=click.File(), nargs=1)
+@click.option(
+    "-n",
+    "--results",
+    type=click.IntRange(min=0),
+    default=10,
+    show_default=True,
+    help="How many words to list for each ciphertext word (0 for all).",
+)
+def query(path: str, text, results: int) -> None:
+    """
+    Lists the dictionary words each word of TEXT could decipher to,
+    using the index at PATH
+
+    TEXT needs its spaces (made with --include); use - to read stdin.
+    """
+    with WordIndex(path) as idx:
+        for line in text:
+            for word in re.findall(r"\w+", line.lower()):
+                found = idx.lookup(word)
+                shown = found[:results] if results else found
+                more = (
+                    f" (+{len(found) - len(shown)})" if len(found) > len(shown) else ""
+                )
+                p(f"{word}:\t{' '.join(w for w, _ in shown)}{more}")
+
+
 if __name__ == "__main__":
-    pass  # TODO: write the program
+    unshark()
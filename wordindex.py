@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import struct
+from typing import *
+
+from cipher import *
+
+"""
+A prebuilt index from ciphertext words to the dictionary words they could
+decipher to, for one layout and decoding direction.
+
+Dictionary words are grouped by length and numbered from most to least
+common.  For every length, position, and ciphertext letter the index holds a
+bitset of the words whose letter at that position is one of the ciphertext
+letter's possibilities.  Looking up a ciphertext word is then a direct probe:
+AND together one bitset per position and read off the set bits, which come
+out in order of how common the words are.
+
+The file is laid out so it can be memory-mapped and only the bitsets that
+are actually probed get read:
+
+    MAGIC, header size (uint32), JSON header (offsets count from its end),
+    then for each word length: the words (one byte per letter, the letter's
+    index in the alphabet), their counts (uint32), and the bitsets
+    (position-major, then ciphertext letter in alphabet order)
+"""
+
+MAGIC: bytes = b"SHRKIDX1"
+
+
+class WordIndex:
+    """
+    A memory-mapped word index; see WordIndex.build to make one
+
+    header holds the layout, reverse flag, direction, alphabet, and where
+    each length's words, counts, and bitsets start in the file.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self.map[: len(MAGIC)] == MAGIC, f"{path} is not a word index"
+        (size,) = struct.unpack_from("<I", self.map, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header: Dict[str, Any] = json.loads(self.map[start : start + size])
+        self.alphabet: str = self.header["alphabet"]
+        self.letters: Dict[chr, int] = {ch: i for i, ch in enumerate(self.alphabet)}
+        # offsets in the header count from the end of the header
+        self.groups: Dict[int, Dict[str, int]] = {
+            int(length): {
+                k: v + (start + size if k in ("words", "counts", "bits") else 0)
+                for k, v in group.items()
+            }
+            for length, group in self.header["lengths"].items()
+        }
+        self._bits: Dict[Tuple[int, int, int], int] = {}
+        self._found: Dict[str, List[Tuple[str, int]]] = {}
+
+    def __enter__(self) -> "WordIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.map.close()
+
+    @staticmethod
+    def build(
+        c: Cipher, counts: Dict[str, int], direction: chr, path: str
+    ) -> "WordIndex":
+        """
+        Writes an index of the words in counts (word -> how common it is)
+        for ciphertext decoded in direction, then opens it
+
+        Words with letters outside the layout are left out.
+        """
+        direction = direction.upper().strip()[0]
+        neighbors: Dict[chr, str] = c.tables[direction].neighbors
+        alphabet: str = "".join(neighbors)
+        assert len(alphabet) < 256, "Too many letters to index"
+        letters: Dict[chr, int] = {ch: i for i, ch in enumerate(alphabet)}
+
+        by_length: Dict[int, List[Tuple[str, int]]] = {}
+        for word, count in counts.items():
+            word = word.lower()
+            if word and all(ch in letters for ch in word):
+                by_length.setdefault(len(word), []).append((word, count))
+
+        header: Dict[str, Any] = {
+            "layout": c.layout,
+            "reverse": c.reverse,
+            "direction": direction,
+            "alphabet": alphabet,
+            "lengths": {},
+        }
+        blobs: List[bytes] = []
+        offset: int = 0  # counting from the end of the header
+        for length, group in sorted(by_length.items()):
+            group.sort(key=lambda wc: (-wc[1], wc[0]))  # most common first
+            width = (len(group) + 7) // 8
+            words = bytes(letters[ch] for word, _ in group for ch in word)
+            word_counts = struct.pack(
+                f"<{len(group)}I", *(min(n, 0xFFFFFFFF) for _, n in group)
+            )
+            bitsets: List[bytes] = []
+            for position in range(length):
+                # which words have each cleartext letter at this position
+                plain: List[bytearray] = [bytearray(width) for _ in alphabet]
+                for j, (word, _) in enumerate(group):
+                    plain[letters[word[position]]][j >> 3] |= 1 << (j & 7)
+                plain_bits = [int.from_bytes(b, "little") for b in plain]
+                for ch in alphabet:
+                    bits = 0
+                    for option in set(neighbors[ch]):
+                        bits |= plain_bits[letters[option]]
+                    bitsets.append(bits.to_bytes(width, "little"))
+            header["lengths"][length] = {
+                "count": len(group),
+                "width": width,
+                "words": offset,
+                "counts": offset + len(words),
+                "bits": offset + len(words) + len(word_counts),
+            }
+            blobs += [words, word_counts] + bitsets
+            offset += len(words) + len(word_counts) + width * length * len(alphabet)
+
+        encoded = json.dumps(header).encode()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+            for blob in blobs:
+                f.write(blob)
+        os.replace(tmp, path)
+        return WordIndex(path)
+
+    def bits(self, length: int, position: int, letter: int) -> int:
+        """The bitset of words of this length allowed at position by a letter"""
+        key = (length, position, letter)
+        found = self._bits.get(key)
+        if found is None:
+            group = self.groups[length]
+            at = (
+                group["bits"]
+                + (position * len(self.alphabet) + letter) * group["width"]
+            )
+            found = int.from_bytes(self.map[at : at + group["width"]], "little")
+            self._bits[key] = found
+        return found
+
+    def word(self, length: int, number: int) -> Tuple[str, int]:
+        """The word with a given number among words of its length, and its count"""
+        group = self.groups[length]
+        at = group["words"] + number * length
+        word = "".join(self.alphabet[b] for b in self.map[at : at + length])
+        (count,) = struct.unpack_from("<I", self.map, group["counts"] + 4 * number)
+        return word, count
+
+    def lookup(self, ciphertext_word: str) -> List[Tuple[str, int]]:
+        """
+        Returns (word, count) for every indexed word the ciphertext word
+        could decipher to, most common first
+        """
+        ciphertext_word = ciphertext_word.strip().lower()
+        found = self._found.get(ciphertext_word)
+        if found is not None:
+            return found
+        length = len(ciphertext_word)
+        found = []
+        if length in self.groups and all(ch in self.letters for ch in ciphertext_word):
+            bits = -1
+            for position, ch in enumerate(ciphertext_word):
+                bits &= self.bits(length, position, self.letters[ch])
+                if not bits:
+                    break
+            while bits:
+                low = bits & -bits
+                found.append(self.word(length, low.bit_length() - 1))
+                bits ^= low
+        self._found[ciphertext_word] = found
+        return found